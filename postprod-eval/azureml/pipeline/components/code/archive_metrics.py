@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.common.mlflow_logger import mlflow_log_metric
+from llmevalgrader.evaluation.metric_retention import FactMetricRetention
+
+logger = get_logger("archive_metrics")
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(
+        allow_abbrev=False, description="parse user arguments"
+    )
+    parser.add_argument("--archive_path", type=str, help="Path to the parquet archive of FACT_EVALUATION_METRIC")
+    parser.add_argument("--key_vault_url", type=str, help="Key vault url")
+    parser.add_argument("--retention_months", type=int, default=12,
+                        help="Number of months kept in FACT_EVALUATION_METRIC, including the current month")
+    parser.add_argument("--dry_run", type=str, default="false",
+                        help="Only log the months that would be archived")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    db_handler = DBHandler(args.key_vault_url)
+    db_handler.init_db_connection()
+    try:
+        retention = FactMetricRetention(db_handler)
+        archived_months = retention.run(
+            args.archive_path, args.retention_months, dry_run=args.dry_run.strip().lower() == "true"
+        )
+        mlflow_log_metric("archived_months", len(archived_months))
+    finally:
+        db_handler.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,27 @@ import argparse
 import json
 import pandas as pd
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from pathlib import Path
 
 from llmevalgrader.common.adls_handler import ADLSHandler
 from llmevalgrader.common.db_handler import DBHandler
 from llmevalgrader.common.logger import get_logger
+from llmevalgrader.common.mlflow_logger import mlflow_log_metric
 from llmevalgrader.common.utils import start_date_for_pipeline_run, end_date_for_pipeline_run
+from llmevalgrader.evaluation.conversation_context import CONVERSATION_APP_TYPE, build_context
+from llmevalgrader.evaluation.near_duplicates import collapse_near_duplicates
+from llmevalgrader.evaluation.prescreen_model import (
+    AUDIT_ROUTE,
+    METADATA_FILE_NAME,
+    MODEL_FILE_NAME,
+    PRESCREEN_ROUTE_COLUMN,
+    PrescreenModel,
+    prescreen_rows,
+)
+from llmevalgrader.evaluation.token_estimator import (
+    balance_shards, estimate_cost, estimate_prompt_tokens, estimate_request_tokens
+)
 
 logger = get_logger("prep_data")
 adls_handler = ADLSHandler()
@@ -35,29 +50,138 @@ def parse_args():
     parser.add_argument("--gold_zone_fact_eval_path", type=str)
     parser.add_argument("--prep_data_output_path", type=str)
     parser.add_argument("--key_vault_url", type=str)    
+    parser.add_argument("--context_window_turns", type=int, default=0,
+                        help="Number of previous turns in the rebuilt context, 0 for the whole history")
+    parser.add_argument("--context_lookback_days", type=int, default=1,
+                        help="Number of days before the start date read for the turns of ongoing conversations")
+    parser.add_argument("--turns_per_request", type=int, default=1,
+                        help="Number of turns in each evaluation dataset, for the evaluators grading several turns "
+                             "per LLM call")
+    parser.add_argument("--shard_count", type=int, default=1,
+                        help="Number of output files, balanced by projected tokens, for the parallel evaluation "
+                             "workers")
+    parser.add_argument("--prompt_overhead_tokens", type=int, default=700,
+                        help="Number of tokens of the prompt template of the evaluator, sent once per request")
+    parser.add_argument("--completion_tokens_per_turn", type=int, default=10,
+                        help="Number of completion tokens projected per graded turn")
+    parser.add_argument("--context_max_tokens", type=int, default=0,
+                        help="Token budget of the context in the evaluation flow, 0 when the context is not windowed")
+    parser.add_argument("--prompt_token_price", type=float, default=0.0,
+                        help="Price of 1000 prompt tokens of the evaluator deployment, for the projected cost")
+    parser.add_argument("--completion_token_price", type=float, default=0.0,
+                        help="Price of 1000 completion tokens of the evaluator deployment, for the projected cost")
+    parser.add_argument("--max_projected_tokens", type=int, default=0,
+                        help="Number of projected prompt and completion tokens above which the run is aborted, 0 for "
+                             "no limit")
+    parser.add_argument("--near_duplicate_threshold", type=float, default=0.0,
+                        help="Similarity of the near duplicate (query, context, response) triples graded once, 0 to "
+                             "grade every row")
+    parser.add_argument("--prescreen_model_path", type=str, default=None,
+                        help="Folder of the pre-screen model scoring the confident high grades instead of the "
+                             "evaluator")
+    parser.add_argument("--prescreen_audit_rate", type=float, default=0.05,
+                        help="Share of the rows scored by the pre-screen model also graded by the evaluator")
+    parser.add_argument("--prescreen_output_path", type=str, default=None,
+                        help="Folder of the rows scored by the pre-screen model, written by write_metrics")
+    parser.add_argument("--retry_dataset_path", type=str, default=None,
+                        help="Folder of the retry dataset written by write_metrics, graded instead of the gold zone "
+                             "rows")
 
     args, _ = parser.parse_known_args()
     return args
 
 
-def write_filtered_parquet_to_evaluation_zone(eval_fact_df, output_path):
+def write_filtered_parquet_to_evaluation_zone(eval_fact_df, output_path, request_tokens=None, shard_count=1):
     """
-    Writes the filtered DataFrame to the evaluation zone as a parquet file.
+    Writes the filtered DataFrame to the evaluation zone as json lines files.
 
     Args:
         eval_fact_df (pandas.DataFrame): The filtered DataFrame.
+        output_path (str): The folder of the files.
+        request_tokens (list): The projected tokens of each row, used to balance the files.
+        shard_count (int): The number of files, of about the same number of projected tokens.
 
     Returns:
         None
     """
     datetime_suffix = datetime.now().strftime("%Y%m%d%H%M%S")
-    # write eval_fact_df to a json lines file
-    eval_fact_df.to_json(
-        f"{output_path}/evaluation_fact_{datetime_suffix}.jsonl", orient="records", lines=True
-    )
+    if shard_count <= 1:
+        # write eval_fact_df to a json lines file
+        eval_fact_df.to_json(
+            f"{output_path}/evaluation_fact_{datetime_suffix}.jsonl", orient="records", lines=True
+        )
+        return
+
+    if request_tokens is None:
+        request_tokens = [1] * len(eval_fact_df)
+    for shard_index, positions in enumerate(balance_shards(request_tokens, shard_count)):
+        eval_fact_df.iloc[positions].to_json(
+            f"{output_path}/evaluation_fact_{datetime_suffix}_{shard_index:03d}.jsonl", orient="records", lines=True
+        )
+        logger.info(f"Wrote shard {shard_index} of {len(positions)} rows and "
+                    f"{sum(request_tokens[position] for position in positions)} projected prompt tokens")
 
     return
 
+
+def read_retry_dataset(retry_dataset_path):
+    """
+    Reads the retry dataset written by write_metrics, the evaluation datasets without results of a previous run.
+
+    Args:
+        retry_dataset_path (str): The folder of the retry dataset.
+
+    Returns:
+        pandas.DataFrame: The evaluation datasets, in the format of format_dataframe_output.
+    """
+    retry_files = sorted(Path(retry_dataset_path).glob("*.jsonl"))
+    retry_df_list = [pd.read_json(retry_file, lines=True, dtype=False) for retry_file in retry_files]
+    retry_df = pd.concat(retry_df_list, ignore_index=True) if retry_df_list else pd.DataFrame()
+    logger.info(f"Read {len(retry_df)} evaluation datasets from {len(retry_files)} retry dataset files")
+    return retry_df
+
+
+def prescreen_evaluation_rows(eval_fact_df, prescreen_model_path, metric_names, audit_rate, prescreen_output_path):
+    """
+    Pre-scores the evaluation rows with the pre-screen model, writes the rows it scores to the pre-screen
+    output folder and returns the rows to grade with the evaluator. Every row is graded by the evaluator while
+    the training pipeline has not written a model yet.
+
+    Args:
+        eval_fact_df (pandas.DataFrame): The evaluation rows.
+        prescreen_model_path (str): The folder of the pre-screen model.
+        metric_names (list): The metrics of the evaluator, the model must predict its only metric.
+        audit_rate (float): The share of the confident rows graded by the evaluator too.
+        prescreen_output_path (str): The folder of the rows scored by the model.
+
+    Returns:
+        eval_fact_df (pandas.DataFrame): The rows to grade with the evaluator, with their predicted grade and route.
+    """
+    if not all(Path(prescreen_model_path, file_name).exists() for file_name in [MODEL_FILE_NAME, METADATA_FILE_NAME]):
+        logger.warning(f"No pre-screen model in {prescreen_model_path}, the training pipeline has not written one "
+                       f"yet. Grading every row with the evaluator.")
+        return eval_fact_df
+    model = PrescreenModel.load(prescreen_model_path)
+    model_metric_name = model.metadata.get("metric_name")
+    if [metric["metric_name"] for metric in metric_names] != [model_metric_name]:
+        logger.warning(f"The pre-screen model predicts {model_metric_name}, the evaluator grades "
+                       f"{[metric['metric_name'] for metric in metric_names]}. Grading every row with the evaluator.")
+        return eval_fact_df
+    logger.info(f"Loaded the pre-screen model of {model_metric_name} trained at {model.metadata.get('trained_at')} "
+                f"with a skip threshold of {model.metadata['skip_threshold']}")
+
+    row_count = len(eval_fact_df)
+    eval_fact_df, prescreened_df = prescreen_rows(eval_fact_df, model, audit_rate)
+    mlflow_log_metric("prescreened_rows", len(prescreened_df))
+    mlflow_log_metric("prescreen_rate", len(prescreened_df) / row_count)
+    mlflow_log_metric("prescreen_audit_rows", int((eval_fact_df[PRESCREEN_ROUTE_COLUMN] == AUDIT_ROUTE).sum()))
+    if not prescreened_df.empty:
+        write_filtered_parquet_to_evaluation_zone(
+            format_dataframe_output(fill_missing_text_values(prescreened_df)), prescreen_output_path
+        )
+    return eval_fact_df
+
+
 def filter_evaluation_fact_on_common_properties(
     eval_fact_df, app_name, app_type, start_date, end_date, metric_names
 ):
@@ -95,7 +219,25 @@ def filter_evaluation_fact_on_common_properties(
     return eval_fact_df
 
 
-def format_dataframe_output(eval_fact_df):
+def fill_missing_text_values(eval_fact_df):
+    """
+    Replaces the nulls of the text columns with "NA", the value the evaluation flows expect for missing fields.
+    The gold zone keeps native nulls, see llmevalgrader.transformation.schema.
+
+    Args:
+        eval_fact_df (pandas.DataFrame): The evaluation fact DataFrame.
+
+    Returns:
+        eval_fact_df (pandas.DataFrame): The evaluation fact DataFrame without nulls in text columns.
+    """
+    for column_name in eval_fact_df.select_dtypes(include=["object", "string", "category"]).columns:
+        eval_fact_df[column_name] = eval_fact_df[column_name].astype(object).where(
+            eval_fact_df[column_name].notna(), "NA"
+        )
+    return eval_fact_df
+
+
+def format_dataframe_output(eval_fact_df, turns_per_request=1):
     """
     Format the evaluation fact dataframe which needs to be written as output based on the evaluator.
 
@@ -104,20 +246,78 @@ def format_dataframe_output(eval_fact_df):
     {"evaluation_dataset": [{eval_fact_df_row_2}]}
     {"evaluation_dataset": [{eval_fact_df_row_3}]}
 
+    Example output for batched evaluators with 2 turns per request:
+    {"evaluation_dataset": [{eval_fact_df_row_1}, {eval_fact_df_row_2}]}
+    {"evaluation_dataset": [{eval_fact_df_row_3}]}
+
     Args:
-        evaluator (str): Name of the evaluation being run.
         eval_fact_df (pandas.DataFrame): The filtered evaluation fact dataframe which needs to be formatted for output.
+        turns_per_request (int): The number of rows in each evaluation dataset, graded by a single prompt flow run.
 
     Returns:
         pd.DataFrame(eval_fact_formatted_dict): The formatted evaluation fact dataframe.
     """
+    if turns_per_request < 1:
+        raise ValueError(f"Invalid number of turns per request {turns_per_request}, it must be 1 or more")
 
-    eval_fact_dict = [[row.to_dict()] for _, row in eval_fact_df.iterrows()]
+    eval_fact_rows = [row.to_dict() for _, row in eval_fact_df.iterrows()]
+    eval_fact_dict = [
+        eval_fact_rows[start:start + turns_per_request] for start in range(0, len(eval_fact_rows), turns_per_request)
+    ]
     
     eval_fact_formatted_dict = [{"evaluation_dataset": item} for item in eval_fact_dict]
 
     return pd.DataFrame(eval_fact_formatted_dict)  
-      
+
+
+def log_token_estimate(
+    eval_fact_df,
+    turns_per_request=1,
+    prompt_overhead_tokens=0,
+    completion_tokens_per_turn=0,
+    context_max_tokens=0,
+    prompt_token_price=0.0,
+    completion_token_price=0.0,
+    max_projected_tokens=0,
+):
+    """
+    Projects the tokens and the cost of the evaluation before it runs, logs them as run metrics and aborts the
+    run above a token limit, e.g. so that a large window does not exhaust the Azure OpenAI quota mid-run.
+
+    Args:
+        eval_fact_df (pandas.DataFrame): The evaluation rows, in the order of the evaluation datasets.
+        turns_per_request (int): The number of rows graded by each request.
+        prompt_overhead_tokens (int): The tokens of the prompt template, sent once per request.
+        completion_tokens_per_turn (int): The completion tokens projected per row.
+        context_max_tokens (int): The token budget of the context in the evaluation flow, 0 for no budget.
+        prompt_token_price (float): The price of 1000 prompt tokens.
+        completion_token_price (float): The price of 1000 completion tokens.
+        max_projected_tokens (int): The projected tokens above which the run is aborted, 0 for no limit.
+
+    Returns:
+        list: The projected prompt tokens of each evaluation dataset.
+    """
+    row_prompt_tokens = estimate_prompt_tokens(eval_fact_df, context_max_tokens).to_list()
+    request_tokens = estimate_request_tokens(row_prompt_tokens, turns_per_request, prompt_overhead_tokens)
+    prompt_tokens = sum(request_tokens)
+    completion_tokens = completion_tokens_per_turn * len(eval_fact_df)
+    projected_cost = estimate_cost(prompt_tokens, completion_tokens, prompt_token_price, completion_token_price)
+
+    mlflow_log_metric("projected_prompt_tokens", prompt_tokens)
+    mlflow_log_metric("projected_completion_tokens", completion_tokens)
+    mlflow_log_metric("projected_max_request_tokens", max(request_tokens, default=0))
+    mlflow_log_metric("projected_cost", projected_cost)
+    logger.info(f"Projected {prompt_tokens} prompt tokens and {completion_tokens} completion tokens for "
+                f"{len(request_tokens)} requests, cost {projected_cost:.2f}")
+
+    if max_projected_tokens > 0 and prompt_tokens + completion_tokens > max_projected_tokens:
+        error_msg = (f"Projected {prompt_tokens + completion_tokens} tokens, above the limit of "
+                     f"{max_projected_tokens} tokens. Shorten the evaluation window or raise max_projected_tokens.")
+        logger.error(error_msg)
+        raise Exception(error_msg)
+    return request_tokens
+
+
 def main():
     """
     The main function that orchestrates the data preparation process.
@@ -134,36 +334,88 @@ def main():
             args.gold_zone_fact_eval_path,
             args.prep_data_output_path,
         )
-            
+
+        if args.retry_dataset_path:
+            # A retry run grades again only the rows without results of a previous run, already prepared.
+            retry_df = read_retry_dataset(args.retry_dataset_path)
+            if retry_df.empty:
+                error_msg = f"Retry dataset {args.retry_dataset_path} has no records to run evaluation."
+                logger.error(error_msg)
+                raise Exception(error_msg)
+            mlflow_log_metric("retry_evaluation_datasets", len(retry_df))
+            write_filtered_parquet_to_evaluation_zone(
+                retry_df, args.prep_data_output_path, shard_count=args.shard_count
+            )
+            logger.info("Saved retry dataset to evaluation zone")
+            return
+
         start_date = start_date_for_pipeline_run(args.start_date)
         logger.info(f"Start Date is {start_date.strftime('%m/%d/%Y, %H:%M:%S')}")
         end_date =  end_date_for_pipeline_run(args.end_date)
         logger.info(f"End Date is {end_date.strftime('%m/%d/%Y, %H:%M:%S')}")
 
+        # The conversation rows hold the text of each turn once, the context is rebuilt from them. They are
+        # also read for the lookback days, for the history of the conversations ongoing at the start date.
+        context_start_date = start_date - timedelta(days=args.context_lookback_days)
         try:
-            eval_fact_df = adls_handler.read_fact_table(
+            # The app filters are pushed down to the parquet reader, which skips the row groups of other apps
+            # with their statistics. The rows are filtered again below.
+            fact_df = adls_handler.read_fact_table(
                 args.gold_zone_fact_eval_path,
-                start_date,
+                context_start_date,
                 end_date,
+                filters=[
+                    ("app_name", "==", args.app_name),
+                    ("app_type", "in", sorted({args.app_type, CONVERSATION_APP_TYPE})),
+                ],
             )
-            logger.info(f"Read {len(eval_fact_df)} rows from FACT_EVALUATION for date range {start_date} to {end_date}")
+            logger.info(f"Read {len(fact_df)} rows from FACT_EVALUATION for date range {context_start_date} to {end_date}")
         except Exception as e:
-            logger.error(f"Failed to read FACT_EVALUATION data for date range {start_date} to {end_date}: {e}")
+            logger.error(f"Failed to read FACT_EVALUATION data for date range {context_start_date} to {end_date}: {e}")
             raise e
 
         eval_fact_df = filter_evaluation_fact_on_common_properties(
-            eval_fact_df, args.app_name, args.app_type, start_date, end_date, args.metric_names
+            fact_df, args.app_name, args.app_type, start_date, end_date, args.metric_names
         )
+        if args.prescreen_model_path and not eval_fact_df.empty:
+            # The rows the pre-screen model scores are not graded by the evaluator, and their context is not built.
+            eval_fact_df = prescreen_evaluation_rows(
+                eval_fact_df, args.prescreen_model_path, args.metric_names, args.prescreen_audit_rate,
+                args.prescreen_output_path,
+            )
+        eval_fact_df = build_context(eval_fact_df, fact_df, args.context_window_turns)
+        del fact_df
+        if args.near_duplicate_threshold > 0 and not eval_fact_df.empty:
+            # Only the representatives of the near duplicates are graded, their metrics are copied to the
+            # other rows of their cluster by write_metrics. The rows are compared with their context.
+            row_count = len(eval_fact_df)
+            eval_fact_df = collapse_near_duplicates(eval_fact_df, args.near_duplicate_threshold)
+            mlflow_log_metric("near_duplicate_rows", row_count - len(eval_fact_df))
+            mlflow_log_metric("near_duplicate_rate", (row_count - len(eval_fact_df)) / row_count)
 
         if eval_fact_df.empty:
             error_msg = "Prep data returned no records to run evaluation."
             logger.error(error_msg)
             raise Exception(error_msg)
 
-        eval_fact_df_for_write = format_dataframe_output(eval_fact_df)
+        eval_fact_df = fill_missing_text_values(eval_fact_df)
+        eval_fact_df_for_write = format_dataframe_output(eval_fact_df, args.turns_per_request)
+        logger.info(f"Formatted {len(eval_fact_df)} rows into {len(eval_fact_df_for_write)} evaluation datasets "
+                    f"of up to {args.turns_per_request} turns")
+
+        request_tokens = log_token_estimate(
+            eval_fact_df,
+            args.turns_per_request,
+            args.prompt_overhead_tokens,
+            args.completion_tokens_per_turn,
+            args.context_max_tokens,
+            args.prompt_token_price,
+            args.completion_token_price,
+            args.max_projected_tokens,
+        )
 
         write_filtered_parquet_to_evaluation_zone(
-            eval_fact_df_for_write, args.prep_data_output_path
+            eval_fact_df_for_write, args.prep_data_output_path, request_tokens, args.shard_count
         )
         logger.info("Saved filtered parquet file to evaluation zone")
 
@@ -0,0 +1,148 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import argparse
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from llmevalgrader.common.adls_handler import ADLSHandler
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.common.mlflow_logger import mlflow_log_metric
+from llmevalgrader.evaluation.prescreen_model import (
+    PRESCREEN_ROUTE, PrescreenModel, calibrate_skip_threshold, get_model_metadata
+)
+
+logger = get_logger("train_prescreen")
+adls_handler = ADLSHandler()
+
+# The grades of the LLM only, the rows scored by a pre-screen model and the copies of the grades of near
+# duplicates are left out.
+LLM_GRADES_QUERY = """SELECT F.evaluation_dataset_id, F.metric_numeric_value
+    FROM FACT_EVALUATION_METRIC F
+    INNER JOIN DIM_METRIC D ON F.metric_id = D.metric_id
+    WHERE D.metric_name = ? AND F.app_name = ? AND F.fact_creation_time >= ?
+    AND F.metric_numeric_value IS NOT NULL
+    AND (F.evaluator_metadata IS NULL
+         OR (F.evaluator_metadata NOT LIKE ? AND F.evaluator_metadata NOT LIKE ?))
+    ORDER BY F.updated_date"""
+# Share of the grades held out to calibrate the skip threshold.
+VALIDATION_BUCKETS = 5
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(
+        allow_abbrev=False, description="parse user arguments"
+    )
+    parser.add_argument("--app_name", type=str)
+    parser.add_argument("--app_type", type=str)
+    parser.add_argument("--metric_name", type=str, help="Numerical metric predicted by the model")
+    parser.add_argument("--gold_zone_fact_eval_path", type=str)
+    parser.add_argument("--prescreen_model_path", type=str, help="Folder of the pre-screen model")
+    parser.add_argument("--key_vault_url", type=str, help="Key vault url")
+    parser.add_argument("--training_days", type=int, default=90,
+                        help="Number of days of LLM grades the model is trained on")
+    parser.add_argument("--high_score", type=float, default=4,
+                        help="Lowest grade of a high relevance turn, the only turns the model scores")
+    parser.add_argument("--target_precision", type=float, default=0.95,
+                        help="Share of the turns scored by the model graded at least high_score by the LLM")
+    parser.add_argument("--min_training_rows", type=int, default=1000,
+                        help="Number of LLM grades below which the previous model is kept")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def read_llm_grades(db_handler, app_name, metric_name, start_date):
+    """
+    Reads the LLM grades of a metric of an app since a date from FACT_EVALUATION_METRIC.
+
+    Args:
+        db_handler (DBHandler): The connected database handler.
+        app_name (str): The app name.
+        metric_name (str): The metric name.
+        start_date (datetime): The earliest fact creation time.
+
+    Returns:
+        pandas.DataFrame: The evaluation_dataset_id and the metric_numeric_value of each grade.
+    """
+    params = (metric_name, app_name, start_date.strftime("%Y-%m-%d %H:%M:%S"),
+              f'%"scored_by": "{PRESCREEN_ROUTE}"%', '%"near_duplicate_of"%')
+    batches = list(db_handler.stream_query(LLM_GRADES_QUERY, params, batch_format="dataframe"))
+    if len(batches) == 0:
+        return pd.DataFrame(columns=["evaluation_dataset_id", "metric_numeric_value"])
+    grades_df = pd.concat(batches, ignore_index=True)
+    # The latest grade of a row re-graded by a retry run.
+    return grades_df.drop_duplicates(subset=["evaluation_dataset_id"], keep="last")
+
+
+def main():
+    """
+    Trains the pre-screen model of a metric of an app on the recent LLM grades and saves it, with its skip
+    threshold calibrated on held-out grades.
+    """
+    args = parse_args()
+    end_date = datetime.now(timezone.utc)
+    start_date = end_date - timedelta(days=args.training_days)
+
+    db_handler = DBHandler(args.key_vault_url)
+    db_handler.init_db_connection()
+    try:
+        grades_df = read_llm_grades(db_handler, args.app_name, args.metric_name, start_date)
+    finally:
+        db_handler.close_db_connection()
+    logger.info(f"Read {len(grades_df)} LLM grades of {args.metric_name} since {start_date}")
+
+    fact_df = adls_handler.read_fact_table(
+        args.gold_zone_fact_eval_path,
+        start_date,
+        end_date,
+        filters=[("app_name", "==", args.app_name), ("app_type", "==", args.app_type)],
+    )
+    fact_df = fact_df[["evaluation_dataset_id", "query", "response"]].astype({"evaluation_dataset_id": str})
+    grades_df = grades_df.astype({"evaluation_dataset_id": str}).merge(fact_df, on="evaluation_dataset_id")
+    grades_df = grades_df.fillna({"query": "", "response": ""})
+    mlflow_log_metric("prescreen_training_rows", len(grades_df))
+    if len(grades_df) < args.min_training_rows:
+        logger.warning(f"Only {len(grades_df)} LLM grades with their text, below {args.min_training_rows}. "
+                       f"Keeping the previous pre-screen model, if any, the evaluation grades every row until one "
+                       f"is trained.")
+        return
+
+    is_validation = np.array([zlib.crc32(evaluation_dataset_id.encode("utf-8")) % VALIDATION_BUCKETS == 0
+                              for evaluation_dataset_id in grades_df["evaluation_dataset_id"]], dtype=bool)
+    training_df, validation_df = grades_df[~is_validation], grades_df[is_validation]
+    model = PrescreenModel.fit(
+        training_df["query"].to_list(), training_df["response"].to_list(), training_df["metric_numeric_value"]
+    )
+
+    validation_scores = validation_df["metric_numeric_value"].to_numpy(dtype=float)
+    validation_predictions = model.predict(validation_df["query"].to_list(), validation_df["response"].to_list())
+    validation_mae = float(np.abs(validation_predictions - validation_scores).mean())
+    calibration = calibrate_skip_threshold(
+        validation_predictions, validation_scores, args.high_score, args.target_precision
+    )
+    model.metadata.update(get_model_metadata(
+        args.metric_name, len(training_df), args.high_score, calibration, validation_mae
+    ))
+    mlflow_log_metric("prescreen_validation_mae", validation_mae)
+    mlflow_log_metric("prescreen_validation_coverage", calibration["coverage"])
+    mlflow_log_metric("prescreen_validation_precision", calibration["precision"])
+    logger.info(f"Validation MAE {validation_mae:.3f}, skip threshold {calibration['skip_threshold']:.3f} "
+                f"skipping {calibration['coverage']:.1%} of the held-out rows at a precision of "
+                f"{calibration['precision']:.1%}")
+
+    model.save(args.prescreen_model_path)
+    logger.info(f"Saved the pre-screen model to {args.prescreen_model_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,18 @@
 
 import argparse
 import ast
+import json
 import datetime
 from datetime import datetime, timezone, timedelta
 import pandas as pd
 
 
-from llmevalgrader.common.entities import AzureMonitorDataSource, MappingList
+from llmevalgrader.common.entities import AzureMonitorDataSource, MappingList, ParquetLayout
 from llmevalgrader.transformation.transform import DataTransformer
 from llmevalgrader.transformation.goldzone_prep import create_goldzone_tables
 from llmevalgrader.transformation.sampling import simple_sample
-from llmevalgrader.common.adls_handler import ADLSHandler
+from llmevalgrader.transformation import arrow_engine
+from llmevalgrader.common.adls_handler import FACT_TABLE_LAYOUT, ADLSHandler
 from llmevalgrader.common.logger import get_logger
 
 
@@ -35,6 +37,13 @@ def parse_args():
     parser.add_argument("--fact_evaluation_output", type=str, help="Fact evaluation output path", required=True)
     parser.add_argument("--dim_metadata_output", type=str, help="Dim metadata output path", required=True)
     parser.add_argument("--dim_conversation_output", type=str, help="Dim conversation output path", required=True)
+    parser.add_argument("--engine", type=str, help="Transformation engine, pandas or arrow", default="pandas",
+                        choices=["pandas", "arrow"])
+    parser.add_argument("--parse_workers", type=int, default=0,
+                        help="Number of processes parsing the log Properties, 0 to parse them in the main process")
+    parser.add_argument("--fact_layout", type=str, default="",
+                        help="Parquet layout of the fact files as a JSON ParquetLayout, "
+                             "empty for the default layout FACT_TABLE_LAYOUT")
     args, _ = parser.parse_known_args()
     return args
 
@@ -58,12 +67,17 @@ def main():
 
     
     # Initialize the transformation processor
-    transformation_processor = DataTransformer(
+    logger.info(f"Transformation engine is {args.engine}")
+    use_arrow = args.engine == "arrow"
+    transformer_class = arrow_engine.ArrowDataTransformer if use_arrow else DataTransformer
+    transformation_processor = transformer_class(
         start_date=start_date,
         end_date=end_date,
         key_vault_url=args.key_vault_url,
         data_source=data_source,
         mappings=mapping_list,
+        chatbot_name=args.chatbot_name,
+        parse_workers=args.parse_workers,
     )
 
     # Orchestrating the transformation process
@@ -78,35 +92,40 @@ def main():
     # Read existing data
     adls_handler = ADLSHandler()
     try:
-        existing_fact_data = adls_handler.read_fact_table(
+        read_fact_table = adls_handler.read_fact_arrow_table if use_arrow else adls_handler.read_fact_table
+        existing_fact_data = read_fact_table(
             fact_output_path=args.fact_evaluation_output, start_date=start_date, end_date=end_date
         )
     except Exception as e:
         logger.warning(f"Failed to read existing fact data from path {args.fact_evaluation_output} : {e}")
         logger.info("Creating new fact data")
-        existing_fact_data = pd.DataFrame()
+        existing_fact_data = None if use_arrow else pd.DataFrame()
+    read_dim_table = adls_handler.read_dim_arrow_table if use_arrow else adls_handler.read_dim_table
     try:
-        existing_metadata = adls_handler.read_dim_table(
+        existing_metadata = read_dim_table(
             dim_output_path=args.dim_metadata_output, dim_file_name="dim_metadata.parquet"
         )
     except Exception as e:
         logger.warning(f"Failed to read existing dim metadata from path {args.dim_metadata_output} : {e}")
         logger.info("Creating new metadata")
-        existing_metadata = pd.DataFrame()
+        existing_metadata = None if use_arrow else pd.DataFrame()
     try:
-        existing_conversation = adls_handler.read_dim_table(
+        existing_conversation = read_dim_table(
             dim_output_path=args.dim_conversation_output, dim_file_name="dim_conversation.parquet"
         )
     except Exception as e:
         logger.warning(f"Failed to read existing dim conversation from path {args.dim_conversation_output} : {e}")
         logger.info("Creating new conversation")
-        existing_conversation = pd.DataFrame()
+        existing_conversation = None if use_arrow else pd.DataFrame()
 
     # Sampling the data
-    concat_data = simple_sample(concat_data)
+    concat_data = arrow_engine.simple_sample(concat_data) if use_arrow else simple_sample(concat_data)
 
     # Prepare the data model
-    fact_data, metadata, conversation = create_goldzone_tables(concat_data, existing_fact_data, existing_metadata, existing_conversation)
+    goldzone_tables = arrow_engine.create_goldzone_tables if use_arrow else create_goldzone_tables
+    fact_data, metadata, conversation = goldzone_tables(
+        concat_data, existing_fact_data, existing_metadata, existing_conversation
+    )
     logger.info("Data model created successfully")
     logger.info(f"New Fact data shape: {fact_data.shape}")
     logger.info(f"New Metadata shape: {metadata.shape}")
@@ -114,7 +133,10 @@ def main():
 
     # Write the data to the output paths
     logger.info("Writing data to output paths")
-    adls_handler.write_fact_table(args.fact_evaluation_output, fact_data)
+    fact_layout = ParquetLayout.from_dict(json.loads(args.fact_layout)) if args.fact_layout.strip() \
+        else FACT_TABLE_LAYOUT
+    logger.info(f"Fact layout is {fact_layout.to_dict()}")
+    adls_handler.write_fact_table(args.fact_evaluation_output, fact_data, layout=fact_layout)
     adls_handler.write_dim_table(
         args.dim_metadata_output,
         "dim_metadata.parquet",
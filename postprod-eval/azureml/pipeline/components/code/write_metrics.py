@@ -2,6 +2,7 @@
 # Licensed under the MIT License.
 
 import argparse
+import json
 import os
 import pandas as pd
 from pathlib import Path
@@ -11,9 +12,15 @@ from llmevalgrader.common.entities import FactEvaluationMetric, DimMetrics
 from llmevalgrader.common.db_handler import DBHandler
 from llmevalgrader.common.logger import get_logger
 from llmevalgrader.common.mlflow_logger import mlflow_log_metric
+from llmevalgrader.evaluation.metric_rollup import DailyMetricRollup
+from llmevalgrader.evaluation.near_duplicates import NEAR_DUPLICATES_COLUMN, get_near_duplicate_metadata
+from llmevalgrader.evaluation.prescreen_model import (
+    PRESCREEN_ROUTE_COLUMN, PRESCREEN_SCORE_COLUMN, get_prescreen_metadata
+)
 
 logger = get_logger("write_metrics")
 
+
 class MetricsProcessor:
     """
     Class for processing and writing evaluation metrics to a database table.
@@ -50,17 +57,241 @@ class MetricsProcessor:
         for pf_input_file in pf_input_files_list:
             with open((Path(eval_dataset_path)/pf_input_file), 'r') as file:
                 pf_input_df = pd.read_json(file, lines=True)
-                pf_input_row_count = pf_input_df.shape[0]
+                pf_input_row_count += pf_input_df.shape[0]
 
         mlflow_log_metric("evaluation_input_rows", pf_input_row_count)
         mlflow_log_metric("evaluation_successful_rows", pf_output_row_count)
         mlflow_log_metric("evaluation_failed_rows", pf_input_row_count - pf_output_row_count)
+        # Evaluation flows with a grading cache record whether each result was read from it.
+        cached_rows = [row for row in eval_metric_raw_data if "grading_cache_hit" in row]
+        if len(cached_rows) > 0:
+            grading_cache_hits = sum(1 for row in cached_rows if row["grading_cache_hit"])
+            mlflow_log_metric("grading_cache_hits", grading_cache_hits)
+            mlflow_log_metric("grading_cache_hit_rate", grading_cache_hits / len(cached_rows))
+            logger.info(f"{grading_cache_hits} of {len(cached_rows)} evaluation results read from the grading cache")
+        # Evaluation flows with a context window record the tokens of each context, once per turn.
+        windowed_turns = {row["evaluation_dataset_id"]: row for row in eval_metric_raw_data
+                          if "windowed_context_tokens" in row}
+        if len(windowed_turns) > 0:
+            context_tokens = sum(row["context_tokens"] for row in windowed_turns.values())
+            windowed_context_tokens = sum(row["windowed_context_tokens"] for row in windowed_turns.values())
+            truncated_turns = sum(1 for row in windowed_turns.values()
+                                  if row["windowed_context_tokens"] < row["context_tokens"])
+            mlflow_log_metric("context_tokens", context_tokens)
+            mlflow_log_metric("windowed_context_tokens", windowed_context_tokens)
+            mlflow_log_metric("truncated_context_turns", truncated_turns)
+            logger.info(f"Windowed the context of {truncated_turns} of {len(windowed_turns)} turns, "
+                        f"from {context_tokens} to {windowed_context_tokens} tokens")
+        # Evaluation flows with a rate controlled LLM node record the tokens and times of each LLM call.
+        llm_calls = {row["evaluation_dataset_id"]: row for row in eval_metric_raw_data
+                     if row.get("llm_request_start") and row.get("llm_request_end")}
+        if len(llm_calls) > 0:
+            llm_tokens = sum(row.get("llm_total_tokens") or 0 for row in llm_calls.values())
+            throttled_retries = sum(row.get("llm_throttled_retries") or 0 for row in llm_calls.values())
+            transient_retries = sum(row.get("llm_transient_retries") or 0 for row in llm_calls.values())
+            elapsed_minutes = (max(row["llm_request_end"] for row in llm_calls.values())
+                               - min(row["llm_request_start"] for row in llm_calls.values())) / 60
+            mlflow_log_metric("llm_requests", len(llm_calls))
+            mlflow_log_metric("llm_throttled_retries", throttled_retries)
+            mlflow_log_metric("llm_transient_retries", transient_retries)
+            if elapsed_minutes > 0:
+                mlflow_log_metric("achieved_rpm", len(llm_calls) / elapsed_minutes)
+                mlflow_log_metric("achieved_tpm", llm_tokens / elapsed_minutes)
+            logger.info(f"{len(llm_calls)} LLM calls of {llm_tokens} tokens in {elapsed_minutes:.1f} minutes, "
+                        f"{throttled_retries} throttled retries, {transient_retries} transient retries")
         logger.info(f"Read {pf_output_row_count} rows from prompt flow output files.")
         if pf_input_row_count != pf_output_row_count:
             logger.error(f"Prompt flow input and output row counts do not match. Input: {pf_input_row_count} row(s), Output: {pf_output_row_count} row(s)")
             logger.error("Please check pipeline job logs for failed mini-batches.")
         return eval_metric_raw_data
 
+    def read_evaluation_datasets(self, *eval_dataset_paths):
+        """
+        Reads the evaluation datasets of the promptflow input files, one per line.
+
+        Parameters:
+            eval_dataset_paths (str): Paths to the promptflow input files containing evaluation dataset, or to
+                the rows scored by the pre-screen model. None is skipped.
+
+        Returns:
+            generator: The evaluation_dataset list of turns of each promptflow input row.
+        """
+        for eval_dataset_path in eval_dataset_paths:
+            if eval_dataset_path is None:
+                continue
+            for pf_input_file in sorted(os.listdir(eval_dataset_path)):
+                with open((Path(eval_dataset_path)/pf_input_file), 'r') as file:
+                    for line in file:
+                        if line.strip():
+                            yield json.loads(line)["evaluation_dataset"]
+
+    def add_prescreen_metadata(self, eval_dataset_path, eval_metrics_raw_data):
+        """
+        Records the route of the rows graded by the evaluator after the pre-screen model, in their
+        evaluator_metadata, from the prescreen_route and prescreen_score fields set by prep data.
+
+        Parameters:
+            eval_dataset_path (str): Path to the promptflow input files containing evaluation dataset.
+            eval_metrics_raw_data (list): The raw evaluation metrics data read from the promptflow output files.
+
+        Returns:
+            list: The raw evaluation metrics data, with the evaluator_metadata of the pre-screened rows.
+        """
+        prescreen_metadata = {}
+        for evaluation_dataset in self.read_evaluation_datasets(eval_dataset_path):
+            for turn in evaluation_dataset:
+                if turn.get(PRESCREEN_ROUTE_COLUMN):
+                    prescreen_metadata[str(turn["evaluation_dataset_id"])] = get_prescreen_metadata(
+                        turn[PRESCREEN_ROUTE_COLUMN], turn[PRESCREEN_SCORE_COLUMN]
+                    )
+        for eval_metrics_row in eval_metrics_raw_data:
+            evaluator_metadata = prescreen_metadata.get(str(eval_metrics_row["evaluation_dataset_id"]))
+            if evaluator_metadata is not None:
+                eval_metrics_row["evaluator_metadata"] = evaluator_metadata
+        return eval_metrics_raw_data
+
+    def get_prescreen_metrics(self, prescreen_dataset_path):
+        """
+        Returns the metrics of the rows scored by the pre-screen model instead of the evaluator, in the format of
+        the raw evaluation metrics data, the predicted grade rounded as the metric value.
+
+        Parameters:
+            prescreen_dataset_path (str): Path to the rows scored by the pre-screen model, written by prep data.
+
+        Returns:
+            list: The raw evaluation metrics data of the pre-screened rows.
+        """
+        prescreen_metrics = []
+        for evaluation_dataset in self.read_evaluation_datasets(prescreen_dataset_path):
+            for turn in evaluation_dataset:
+                metric = json.loads(turn["metric_names"])[0]
+                prescreen_metrics.append({
+                    "evaluation_dataset_id": turn["evaluation_dataset_id"],
+                    "conversation_id": turn["conversation_id"],
+                    "metadata_id": turn["metadata_id"],
+                    "timestamp": turn["timestamp"],
+                    "app_name": turn.get("app_name"),
+                    "metric_name": metric["metric_name"],
+                    "metric_version": metric["metric_version"],
+                    "metric_type": metric["metric_type"],
+                    "metric_value": round(float(turn[PRESCREEN_SCORE_COLUMN])),
+                    "metric_raw_value": str(turn[PRESCREEN_SCORE_COLUMN]),
+                    "evaluator_metadata": get_prescreen_metadata(turn[PRESCREEN_ROUTE_COLUMN],
+                                                                 turn[PRESCREEN_SCORE_COLUMN]),
+                })
+        mlflow_log_metric("prescreen_metrics", len(prescreen_metrics))
+        logger.info(f"Read {len(prescreen_metrics)} metrics of the rows scored by the pre-screen model")
+        return prescreen_metrics
+
+    def expand_near_duplicates(self, eval_dataset_paths, eval_metrics_raw_data):
+        """
+        Copies the evaluation metrics of the representatives of near duplicate rows, graded in their place, to
+        the rows of their cluster kept in the near_duplicates field of the representative by prep data. The
+        evaluator_metadata of the copies references the representative.
+
+        Parameters:
+            eval_dataset_paths (list): Paths to the promptflow input files containing evaluation dataset and to
+                the rows scored by the pre-screen model.
+            eval_metrics_raw_data (list): The raw evaluation metrics data of the evaluator and of the pre-screen model.
+
+        Returns:
+            list: The raw evaluation metrics data with the metrics of the near duplicate rows.
+        """
+        near_duplicates = {}
+        for evaluation_dataset in self.read_evaluation_datasets(*eval_dataset_paths):
+            for turn in evaluation_dataset:
+                if turn.get(NEAR_DUPLICATES_COLUMN):
+                    near_duplicates[str(turn["evaluation_dataset_id"])] = turn[NEAR_DUPLICATES_COLUMN]
+        if len(near_duplicates) == 0:
+            return eval_metrics_raw_data
+
+        near_duplicate_metrics = []
+        for eval_metrics_row in eval_metrics_raw_data:
+            representative_id = str(eval_metrics_row["evaluation_dataset_id"])
+            for member in near_duplicates.get(representative_id, []):
+                near_duplicate_metrics.append({
+                    **eval_metrics_row,
+                    **member,
+                    "evaluator_metadata": get_near_duplicate_metadata(
+                        representative_id, eval_metrics_row.get("evaluator_metadata")
+                    ),
+                })
+        mlflow_log_metric("near_duplicate_metrics", len(near_duplicate_metrics))
+        logger.info(f"Copied {len(near_duplicate_metrics)} evaluation metrics of {len(near_duplicates)} "
+                    f"representatives to their near duplicate rows")
+        return eval_metrics_raw_data + near_duplicate_metrics
+
+    def get_failed_rows(self, eval_dataset_path, eval_metrics_raw_data):
+        """
+        Finds the prompt flow input rows without evaluation results, by their evaluation_dataset_id.
+
+        Parameters:
+            eval_dataset_path (str): Path to the promptflow input files containing evaluation dataset.
+            eval_metrics_raw_data (list): The raw evaluation metrics data read from the promptflow output files.
+
+        Returns:
+            list: The prompt flow input rows to re-run, each with the turns of its evaluation_dataset without results.
+        """
+        evaluated_ids = {str(row["evaluation_dataset_id"]) for row in eval_metrics_raw_data}
+        failed_rows = []
+        for evaluation_dataset in self.read_evaluation_datasets(eval_dataset_path):
+            evaluation_dataset = [turn for turn in evaluation_dataset
+                                  if str(turn["evaluation_dataset_id"]) not in evaluated_ids]
+            if len(evaluation_dataset) > 0:
+                failed_rows.append({"evaluation_dataset": evaluation_dataset})
+        failed_turn_count = sum(len(row["evaluation_dataset"]) for row in failed_rows)
+        mlflow_log_metric("evaluation_failed_turns", failed_turn_count)
+        if failed_turn_count > 0:
+            logger.warning(f"{failed_turn_count} turns in {len(failed_rows)} prompt flow input rows have no "
+                           "evaluation results")
+        return failed_rows
+
+    def write_retry_dataset(self, failed_rows, retry_dataset_path, retry_attempt):
+        """
+        Writes the failed prompt flow input rows to the evaluation zone, in the format of the prep data output, so
+        that only those rows are graded again.
+
+        Parameters:
+            failed_rows (list): The prompt flow input rows to re-run, see get_failed_rows.
+            retry_dataset_path (str): Path to the folder of the retry dataset.
+            retry_attempt (int): The retry attempt of the current run, 0 for the first run.
+        """
+        retry_file_path = Path(retry_dataset_path)/f"retry_dataset_{retry_attempt + 1}.jsonl"
+        with open(retry_file_path, 'w') as file:
+            for row in failed_rows:
+                file.write(json.dumps(row) + "\n")
+        logger.info(f"Wrote {len(failed_rows)} failed prompt flow input rows to {retry_file_path}")
+
+    def invoke_retry(self, retry_endpoint_name, retry_dataset_uri, retry_attempt):
+        """
+        Runs the evaluation pipeline again on the retry dataset, through its batch endpoint.
+
+        Parameters:
+            retry_endpoint_name (str): Name of the batch endpoint of the evaluation pipeline.
+            retry_dataset_uri (str): The datastore URI of the retry dataset.
+            retry_attempt (int): The retry attempt of the current run, 0 for the first run.
+        """
+        # Imported here, the Azure Machine Learning SDK is only needed by the retry runs.
+        from azure.ai.ml import Input
+        from llmevalgrader.common.azure_ml_handler import AzureMLHandler
+
+        aml_handler = AzureMLHandler(
+            os.environ["AZUREML_ARM_SUBSCRIPTION"],
+            os.environ["AZUREML_ARM_RESOURCEGROUP"],
+            os.environ["AZUREML_ARM_WORKSPACE_NAME"],
+        )
+        job = aml_handler.invoke_batch_endpoint(
+            endpoint_name=retry_endpoint_name,
+            inputs={
+                "evaluation_data_start_date": Input(type="string", default="NA"),
+                "evaluation_data_end_date": Input(type="string", default="NA"),
+                "retry_dataset": Input(type="uri_folder", path=retry_dataset_uri),
+                "retry_attempt": Input(type="integer", default=retry_attempt + 1),
+            },
+            experiment_name=os.environ.get("AZUREML_ARM_PROJECT_NAME"),
+        )
+        logger.info(f"Invoked retry attempt {retry_attempt + 1} of the failed rows with job {job.name}")
+
     def process_metrics(self, eval_metrics_raw_data):
         """
         Processes raw evaluation metrics data and transforms it into FactInputDSMetric entities.
@@ -131,14 +362,15 @@ class MetricsProcessor:
                 evaluation_dataset_id=eval_metrics_row["evaluation_dataset_id"],
                 conversation_id=eval_metrics_row["conversation_id"],
                 metadata_id=eval_metrics_row["metadata_id"],
-                evaluator_metadata=None,
+                evaluator_metadata=eval_metrics_row.get("evaluator_metadata"),
                 metric_numeric_value=metric_numeric_value,
                 metric_str_value=metric_str_value,
                 metric_raw_value=eval_metrics_row["metric_raw_value"],
                 fact_creation_time=datetime.datetime.fromtimestamp(eval_metrics_row["timestamp"]/1000).strftime("%Y-%m-%d %H:%M:%S"),
                 created_by="system",
                 updated_date=datetime.datetime.now(),
-                updated_by="system"          
+                updated_by="system",
+                app_name=eval_metrics_row.get("app_name"),
             )
             fact_evaluation_metric_list.append(fact_evaluation_metric)
         logger.info(f"Transformed {len(fact_evaluation_metric_list)} prompt flow output rows into FACT_EVALUATION_METRIC rows.")
@@ -152,9 +384,28 @@ class MetricsProcessor:
             fact_evaluation_metric_list (list): A list of FactInputDSMetric entities.
         """
         logger.info(f"Inserting {len(fact_evaluation_metric_list)} rows into FACT_EVALUATION_METRIC table...")
+        if "app_name" not in self.db_handler.get_table_columns("FACT_EVALUATION_METRIC"):
+            logger.warning("FACT_EVALUATION_METRIC has no app_name column, the metrics are written without their "
+                           "app name. Run migrate_database.py to add the column.")
+            for fact_evaluation_metric in fact_evaluation_metric_list:
+                vars(fact_evaluation_metric).pop("app_name", None)
         unique_columns = {"evaluation_dataset_id", "metric_id"}
         self.db_handler.upsert_into_table("FACT_EVALUATION_METRIC", fact_evaluation_metric_list, unique_columns, True)
         logger.info("Insertion into FACT_EVALUATION_METRIC table complete.")
+
+    def rollup_metrics(self, fact_evaluation_metric_list):
+        """
+        Recomputes the AGG_DAILY_EVALUATION_METRIC rows for the days touched by this run.
+
+        Parameters:
+            fact_evaluation_metric_list (list): A list of FactInputDSMetric entities written by this run.
+        """
+        if not self.db_handler.table_exists("AGG_DAILY_EVALUATION_METRIC"):
+            logger.warning("AGG_DAILY_EVALUATION_METRIC does not exist, the daily rollup is skipped. "
+                           "Run migrate_database.py to create the table.")
+            return
+        rollup_row_count = DailyMetricRollup(self.db_handler).run(fact_evaluation_metric_list)
+        mlflow_log_metric("daily_rollup_rows", rollup_row_count)
     
     def close_connection(self):
         """
@@ -176,8 +427,23 @@ def parse_args():
     parser.add_argument("--eval_dataset_path", type=str, help="Path to prep data output containing evaluation dataset")
     parser.add_argument("--eval_metrics_data_path", type=str, help="Path to promptflow output containing evaluation metrics")
     parser.add_argument("--key_vault_url", type=str, help="Key vault url")
+    parser.add_argument("--rollup_daily_metrics", type=str, default="true",
+                        help="Recompute the daily metric rollup table for the days touched by this run")
+    parser.add_argument("--prescreen_dataset_path", type=str, default=None,
+                        help="Path to the rows scored by the pre-screen model instead of the evaluator")
+    parser.add_argument("--retry_dataset_path", type=str, default=None,
+                        help="Path to the folder of the retry dataset, the prompt flow input rows without results")
+    parser.add_argument("--retry_dataset_uri", type=str, default=None,
+                        help="Datastore URI of the folders of the retry datasets, the run ID is appended to it")
+    parser.add_argument("--retry_attempt", type=int, default=0,
+                        help="Retry attempt of the current run, 0 for the first run")
+    parser.add_argument("--max_retry_attempts", type=int, default=0,
+                        help="Number of retry runs invoked automatically for the failed rows, 0 for none")
+    parser.add_argument("--retry_endpoint_name", type=str, default=None,
+                        help="Name of the batch endpoint of the evaluation pipeline, invoked for the retry runs")
     args, _ = parser.parse_known_args()
-    return args                
+    return args
+
 
 def main():
     args = parse_args()
@@ -185,9 +451,30 @@ def main():
     metrics_processor = MetricsProcessor(args.key_vault_url)
 
     eval_metrics_raw_data = metrics_processor.read_metrics(args.eval_dataset_path, args.eval_metrics_data_path)
+    failed_rows = metrics_processor.get_failed_rows(args.eval_dataset_path, eval_metrics_raw_data)
+    if len(failed_rows) > 0 and args.retry_dataset_path:
+        metrics_processor.write_retry_dataset(failed_rows, args.retry_dataset_path, args.retry_attempt)
+    eval_metrics_raw_data = metrics_processor.add_prescreen_metadata(args.eval_dataset_path, eval_metrics_raw_data)
+    if args.prescreen_dataset_path:
+        eval_metrics_raw_data += metrics_processor.get_prescreen_metrics(args.prescreen_dataset_path)
+    eval_metrics_raw_data = metrics_processor.expand_near_duplicates(
+        [args.eval_dataset_path, args.prescreen_dataset_path], eval_metrics_raw_data
+    )
     fact_evaluation_metric_list = metrics_processor.process_metrics(eval_metrics_raw_data)
     metrics_processor.write_metrics(fact_evaluation_metric_list)
+    if args.rollup_daily_metrics.strip().lower() == "true":
+        metrics_processor.rollup_metrics(fact_evaluation_metric_list)
     metrics_processor.close_connection()
 
+    # The results of the current run are written first, the retry run only grades the failed rows.
+    if len(failed_rows) > 0 and args.retry_dataset_path:
+        if args.retry_attempt < args.max_retry_attempts and args.retry_endpoint_name and args.retry_dataset_uri:
+            retry_dataset_uri = f"{args.retry_dataset_uri.rstrip('/')}/{os.environ['AZUREML_RUN_ID']}/"
+            metrics_processor.invoke_retry(args.retry_endpoint_name, retry_dataset_uri, args.retry_attempt)
+        elif args.max_retry_attempts > 0:
+            logger.error(f"{len(failed_rows)} prompt flow input rows failed after {args.retry_attempt} retry attempts, "
+                         f"see the retry dataset in {args.retry_dataset_path}")
+
+
 if __name__ == "__main__":
     main()
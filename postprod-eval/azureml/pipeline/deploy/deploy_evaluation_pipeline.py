@@ -3,6 +3,7 @@
 
 import json
 import os
+import re
 import subprocess
 import yaml
 from dotenv import load_dotenv
@@ -16,17 +17,35 @@ from llmevalgrader.common.entities import App, Evaluator
 
 from llmevalgrader.common.logger import get_logger
 
+from deploy_prescreen_pipeline import get_prescreen_model_path
+
 logger = get_logger("deploy_evaluation_pipeline")
 
 pipeline_components = []
 
+# Worker processes of the promptflow batch run of a node, as the promptflow default.
+DEFAULT_FLOW_WORKER_COUNT = 4
+
+# The prompt template of the flows scoring several metrics with a single LLM call, holding one rubric per metric.
+MULTI_METRIC_TEMPLATE_NAME = "multi_metric_score.jinja2"
+
 def create_dynamic_evaluation_pipeline(
         app_info,
         evaluator_name,
         metric_names,        
+        turns_per_request,
+        near_duplicate_threshold,
+        context_max_tokens,
         fact_evaluation_input,
         prepped_evaluation_data_path,
         pf_output_data_path,
+        prescreened_data_path,
+        prescreen_model_input,
+        prescreen_audit_rate,
+        retry_data_path,
+        max_retry_attempts,
+        evaluation_endpoint,
+        flow_environment_variables,
         key_vault_url,
         pipeline_name
     ):
@@ -36,10 +55,21 @@ def create_dynamic_evaluation_pipeline(
         Args:
             app_info (str): Info of the application.
             evaluator_name (str): Name of the evaluator.
-            metric_names (list(dict)): List of dictionaries containing name, version and allowed values of the metrics generated from the evaluation.
+            metric_names (list(dict)): List of dictionaries containing name, version, type and allowed values of the
+                metrics generated from the evaluation.
+            turns_per_request (int): Number of turns graded by each run of the evaluation promptflow.
+            near_duplicate_threshold (float): Similarity of the near duplicate turns graded once, 0 to grade every turn.
+            context_max_tokens (int): Token budget of the context in the evaluation promptflow, 0 for no budget.
             fact_evaluation_input (Input): Input object representing fact evaluation data.
             prepped_evaluation_data_path (Output): Output object representing prepped evaluation data.
             pf_output_data_path (Output): Output object representing promptflow output data.
+            prescreened_data_path (str): Datastore path of the rows scored by the pre-screen model.
+            prescreen_model_input (Input): Input object representing the pre-screen model, None to grade every row.
+            prescreen_audit_rate (float): Share of the rows scored by the pre-screen model also graded by the evaluator.
+            retry_data_path (str): Datastore path of the retry datasets, the promptflow input rows without results.
+            max_retry_attempts (int): Number of evaluation runs invoked automatically for the rows without results.
+            evaluation_endpoint (str): Name of the batch endpoint of the pipeline, invoked for the retry runs.
+            flow_environment_variables (dict): Environment variables of the evaluation promptflow.
             key_vault_url (str): URL of the key vault.
             pipeline_name (str): Name of the pipeline.
     """
@@ -50,7 +80,9 @@ def create_dynamic_evaluation_pipeline(
     )
     def evaluation_pipeline(
             evaluation_data_start_date: str,
-            evaluation_data_end_date: str
+            evaluation_data_end_date: str,
+            retry_dataset: Input(type=AssetTypes.URI_FOLDER, optional=True) = None,
+            retry_attempt: int = 0
         ):
         prepped_evaluation_data = Output(path=prepped_evaluation_data_path, type=AssetTypes.URI_FOLDER, mode="rw_mount")
 
@@ -62,9 +94,18 @@ def create_dynamic_evaluation_pipeline(
             start_date=evaluation_data_start_date,
             end_date=evaluation_data_end_date,
             gold_zone_eval_fact_path=fact_evaluation_input,
-            key_vault_url=key_vault_url
+            key_vault_url=key_vault_url,
+            turns_per_request=turns_per_request,
+            near_duplicate_threshold=near_duplicate_threshold,
+            context_max_tokens=context_max_tokens,
+            prescreen_model_path=prescreen_model_input,
+            prescreen_audit_rate=prescreen_audit_rate,
+            retry_dataset_path=retry_dataset
             )
         prep_data.outputs.prep_data_output_path = prepped_evaluation_data
+        prep_data.outputs.prescreen_output_path = Output(
+            path=prescreened_data_path, type=AssetTypes.URI_FOLDER, mode="rw_mount"
+        )
 
         pf_output = Output(path=pf_output_data_path, type=AssetTypes.URI_FOLDER, mode="rw_mount")
 
@@ -72,16 +113,88 @@ def create_dynamic_evaluation_pipeline(
             data=prep_data.outputs.prep_data_output_path,
             evaluation_dataset="${data.evaluation_dataset}",
             )
+        # A single promptflow batch run per node, the rate limits are split between its worker processes.
+        evaluation.max_concurrency_per_instance = 1
+        if flow_environment_variables:
+            evaluation.environment_variables = flow_environment_variables
         evaluation.outputs.flow_outputs = pf_output
 
         write_metrics = pipeline_components[2](
             eval_dataset_path=prep_data.outputs.prep_data_output_path,
             eval_metrics_data_path=evaluation.outputs.flow_outputs,
-            key_vault_url=key_vault_url
+            prescreen_dataset_path=prep_data.outputs.prescreen_output_path,
+            key_vault_url=key_vault_url,
+            retry_dataset_uri=retry_data_path,
+            retry_attempt=retry_attempt,
+            max_retry_attempts=max_retry_attempts,
+            retry_endpoint_name=evaluation_endpoint
             )
+        # The rows without results of this run are written under the job name of write_metrics, see write_metrics.py.
+        write_metrics.outputs.retry_dataset_path = Output(
+            path=retry_data_path + "${{name}}/", type=AssetTypes.URI_FOLDER, mode="rw_mount"
+        )
 
     return evaluation_pipeline
 
+def get_flow_context_max_tokens(flow_path: str) -> int:
+    """
+    Returns the token budget of the context in an evaluation promptflow, the max_tokens of its fit_context node,
+    or the context_max_tokens of the node windowing the context of the batched flows.
+
+    Args:
+        flow_path (str): Path to the flow.dag.yaml of the evaluation promptflow.
+
+    Returns:
+        int: The token budget of the context, 0 when the flow does not window the context.
+    """
+    with open(flow_path, "r") as file:
+        flow = yaml.safe_load(file)
+    for node in flow.get("nodes", []):
+        node_inputs = node.get("inputs", {})
+        if node.get("source", {}).get("path") == "fit_context.py":
+            return int(node_inputs.get("max_tokens", 0))
+        if "context_max_tokens" in node_inputs:
+            return int(node_inputs["context_max_tokens"])
+    return 0
+
+def get_flow_environment_variables(evaluator_info: Evaluator) -> dict:
+    """
+    Returns the environment variables of the evaluation promptflow of an evaluator.
+
+    The grading cache of the flows is disabled unless the evaluator has a blob container, since the disk store of a
+    compute node is not shared with the other nodes of the cluster.
+
+    The rate controller of the flows is per process, and the promptflow batch engine runs one line at a time in each
+    of its PF_WORKER_COUNT worker processes, so the deployment quota of the rate_limit of the evaluator is split
+    evenly between the workers.
+
+    Args:
+        evaluator_info (Evaluator): Information about the evaluator used.
+
+    Returns:
+        dict: The environment variables, by name.
+    """
+    environment_variables = {}
+    if evaluator_info.grading_cache_blob_url:
+        environment_variables["LLMEVAL_GRADING_CACHE"] = "blob"
+        environment_variables["LLMEVAL_GRADING_CACHE_BLOB_URL"] = evaluator_info.grading_cache_blob_url
+    else:
+        environment_variables["LLMEVAL_GRADING_CACHE"] = "none"
+
+    if evaluator_info.rate_limit:
+        worker_count = int(evaluator_info.rate_limit.get("worker_count", DEFAULT_FLOW_WORKER_COUNT))
+        if worker_count < 1:
+            logger.error(f"Invalid worker_count {worker_count} of evaluator {evaluator_info.evaluator_name}")
+            raise ValueError(f"Invalid worker_count {worker_count}, it must be 1 or more")
+        environment_variables["PF_WORKER_COUNT"] = str(worker_count)
+        environment_variables["LLMEVAL_RATE_LIMIT_TPM"] = str(
+            float(evaluator_info.rate_limit.get("tokens_per_minute", 0)) / worker_count
+        )
+        environment_variables["LLMEVAL_RATE_LIMIT_RPM"] = str(
+            float(evaluator_info.rate_limit.get("requests_per_minute", 0)) / worker_count
+        )
+    return environment_variables
+
 def build_pipeline(
         app_info: App,
         evaluator_info: Evaluator,
@@ -113,6 +226,10 @@ def build_pipeline(
     app_path = app_info.app_name + "/" + evaluator_info.evaluator_name
     prepped_evaluation_data_path = aml_datastore_evaluation_path + "in-prepped-data/" + app_path.replace("_", "-") + "/${{name}}/"
     pf_output_data_path = aml_datastore_evaluation_path + "out-evaluation-metrics/" + app_path.replace("_", "-") + "/${{name}}/"
+    prescreened_data_path = (
+        aml_datastore_evaluation_path + "out-prescreened-data/" + app_path.replace("_", "-") + "/${{name}}/"
+    )
+    retry_data_path = aml_datastore_evaluation_path + "in-retry-data/" + app_path.replace("_", "-") + "/"
 
     prep_data_component = load_component("../components/definition/prep_data.yml")
     evaluation_promptflow_component = load_component(evaluator_info.evaluation_flow_path)
@@ -122,8 +239,21 @@ def build_pipeline(
     pipeline_components.append(evaluation_promptflow_component)
     pipeline_components.append(write_metrics_component)
 
+    # The evaluator grades every row until its pre-screen model is trained and activated.
+    prescreen_config = evaluator_info.prescreen or {}
+    prescreen_model_input = None
+    if prescreen_config.get("active") == "true":
+        prescreen_model_input = Input(
+            path=get_prescreen_model_path(aml_datastore_evaluation_path, evaluator_info), type=AssetTypes.URI_FOLDER
+        )
+
     metric_names = [
-        {"metric_name": metric.metric_name, "metric_version": evaluator_info.evaluation_metrics_version, "metric_allowed_values": metric.metric_allowed_values}
+        {
+            "metric_name": metric.metric_name,
+            "metric_version": evaluator_info.evaluation_metrics_version,
+            "metric_type": metric.metric_type,
+            "metric_allowed_values": metric.metric_allowed_values
+        }
         for metric in evaluator_info.evaluation_metrics
     ]
 
@@ -131,9 +261,19 @@ def build_pipeline(
         app_info=app_info,
         evaluator_name=evaluator_info.evaluator_name,
         metric_names=json.dumps(metric_names).replace('"', '\\"'),
+        turns_per_request=evaluator_info.turns_per_request,
+        near_duplicate_threshold=evaluator_info.near_duplicate_threshold,
+        context_max_tokens=get_flow_context_max_tokens(evaluator_info.evaluation_flow_path),
         fact_evaluation_input=fact_evaluation_input,
         prepped_evaluation_data_path=prepped_evaluation_data_path,
         pf_output_data_path=pf_output_data_path,
+        prescreened_data_path=prescreened_data_path,
+        prescreen_model_input=prescreen_model_input,
+        prescreen_audit_rate=prescreen_config.get("audit_rate", 0.05),
+        retry_data_path=retry_data_path,
+        max_retry_attempts=evaluator_info.max_retry_attempts,
+        evaluation_endpoint=evaluator_info.evaluation_endpoint,
+        flow_environment_variables=get_flow_environment_variables(evaluator_info),
         key_vault_url=aml_key_vault_url,
         pipeline_name=pipeline_name
     )
@@ -155,6 +295,29 @@ def validate_promptflow(promptflow_path: str):
         logger.exception(f"Exception while running prompt flow validate for {promptflow_path}: {ex.stderr.decode('utf-8')}")
         raise
 
+def validate_metric_rubrics(evaluator_info: Evaluator):
+    """
+    Validates that the prompt template of a flow scoring several metrics with a single LLM call has a rubric for each
+    metric of the evaluator. The template scores every metric from 1 to 5 stars, so the metrics must be numerical.
+
+    Args:
+        evaluator_info (Evaluator): Information about the evaluator used.
+    """
+    template_path = os.path.join(os.path.dirname(evaluator_info.evaluation_flow_path), MULTI_METRIC_TEMPLATE_NAME)
+    if not os.path.exists(template_path):
+        return
+    with open(template_path, "r") as file:
+        rubric_metric_names = set(re.findall(r'if "(\w+)" in metric_names', file.read()))
+    for metric in evaluator_info.evaluation_metrics:
+        if metric.metric_name not in rubric_metric_names:
+            logger.error(f"No rubric for metric {metric.metric_name} of evaluator {evaluator_info.evaluator_name} "
+                         f"in {template_path}, add one before adding the metric to the evaluator")
+            raise ValueError(f"No rubric for metric {metric.metric_name} in {template_path}")
+        if metric.metric_type != "numerical":
+            logger.error(f"Metric {metric.metric_name} of evaluator {evaluator_info.evaluator_name} is "
+                         f"{metric.metric_type}, {template_path} only scores numerical metrics from 1 to 5")
+            raise ValueError(f"Unsupported type {metric.metric_type} of metric {metric.metric_name} in {template_path}")
+
 def main():
     """Build and publish evaluation pipelines"""
     load_dotenv()
@@ -184,6 +347,7 @@ def main():
     for evaluator in evaluators:
         # Validate promptflow
         validate_promptflow(evaluator.evaluation_flow_path)
+        validate_metric_rubrics(evaluator)
 
 
         evaluation_name = f"{evaluator.evaluator_name}-evaluation-{evaluator.app.app_name}".replace("_", "-")
@@ -0,0 +1,135 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""This script is used to schedule the pipelines training the pre-screen models of the evaluators."""
+import os
+import yaml
+from dotenv import load_dotenv
+from azure.ai.ml import Input, Output, load_component
+from azure.ai.ml.constants import AssetTypes
+from azure.ai.ml.dsl import pipeline
+
+from llmevalgrader.common.azure_ml_handler import AzureMLHandler
+from llmevalgrader.common.config_handler import get_evaluator_info
+from llmevalgrader.common.entities import Evaluator
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("deploy_prescreen_pipeline")
+
+
+def get_prescreen_model_path(aml_datastore_evaluation_path: str, evaluator_info: Evaluator):
+    """
+    Returns the datastore path of the pre-screen model of an evaluator of an app, written by the training
+    pipeline and read by the evaluation pipeline.
+    """
+    app_path = evaluator_info.app.app_name + "/" + evaluator_info.evaluator_name
+    return aml_datastore_evaluation_path + "prescreen-models/" + app_path.replace("_", "-") + "/"
+
+
+def build_pipeline(
+        evaluator_info: Evaluator,
+        aml_key_vault_url: str,
+        aml_datastore_gold_zone_path: str,
+        aml_datastore_evaluation_path: str,
+        pipeline_name: str
+):
+    """
+    Constructs the Azure Machine Learning pipeline training the pre-screen model of an evaluator of an app on
+    the LLM grades of its metric.
+
+    Args:
+        evaluator_info (Evaluator): Information about the evaluator, with its prescreen configuration.
+        aml_key_vault_url (str): URL of the Azure Key Vault.
+        aml_datastore_gold_zone_path (str): AML datastore path for gold zone input data.
+        aml_datastore_evaluation_path (str): AML datastore path for evaluation output data.
+        pipeline_name (str): Name of the pipeline.
+
+    Returns:
+        PipelineJob: Azure Machine Learning pipeline job.
+    """
+    numerical_metrics = [metric for metric in evaluator_info.evaluation_metrics
+                         if str(metric.metric_type).lower() == "numerical"]
+    if len(evaluator_info.evaluation_metrics) != 1 or len(numerical_metrics) != 1:
+        error_msg = (f"The pre-screen model of evaluator {evaluator_info.evaluator_name} predicts a single numerical "
+                     f"metric, the evaluator has {len(evaluator_info.evaluation_metrics)} metrics")
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+
+    prescreen_config = evaluator_info.prescreen
+    train_prescreen_component = load_component("../components/definition/train_prescreen.yml")
+    fact_evaluation_dataset_folder = "fact_evaluation_dataset/fact_evaluation_dataset/"
+    fact_evaluation_input = Input(
+        path=aml_datastore_gold_zone_path + fact_evaluation_dataset_folder, type=AssetTypes.URI_FOLDER
+    )
+    prescreen_model_path = get_prescreen_model_path(aml_datastore_evaluation_path, evaluator_info)
+
+    @pipeline(
+        name=pipeline_name,
+        display_name=pipeline_name,
+        experiment_name=evaluator_info.app.app_name
+    )
+    def prescreen_pipeline():
+        train_prescreen = train_prescreen_component(
+            app_name=evaluator_info.app.app_name,
+            app_type=evaluator_info.app.app_type,
+            metric_name=numerical_metrics[0].metric_name,
+            gold_zone_eval_fact_path=fact_evaluation_input,
+            key_vault_url=aml_key_vault_url,
+            training_days=prescreen_config.get("training_days", 90),
+            high_score=prescreen_config.get("high_score", 4),
+            target_precision=prescreen_config.get("target_precision", 0.95)
+            )
+        train_prescreen.outputs.prescreen_model_path = Output(
+            path=prescreen_model_path, type=AssetTypes.URI_FOLDER, mode="rw_mount"
+        )
+
+    return prescreen_pipeline()
+
+
+def main():
+    """Build and schedule the pre-screen training pipelines"""
+    load_dotenv()
+    subscription_id = os.getenv("SUBSCRIPTION_ID")
+    resource_group_name = os.getenv("RESOURCE_GROUP_NAME")
+    workspace_name = os.getenv("AML_WORKSPACE_NAME")
+    key_vault_url = os.getenv("KEY_VAULT_URL")
+
+    aml_config_file_path = "../config/aml_config.yml"
+    evaluation_config_file_path = "../config/evaluation_config.yml"
+    with open(aml_config_file_path, 'r') as file:
+        aml_config = yaml.safe_load(file)
+
+    compute_name = aml_config["compute"]["name"]
+    aml_datastore_gold_zone_path = aml_config["datastore"]["gold_zone"]
+    aml_datastore_evaluation_path = aml_config["datastore"]["evaluation"]
+
+    aml_handler = AzureMLHandler(subscription_id, resource_group_name, workspace_name)
+    aml_handler.get_compute(compute_name)
+
+    for evaluator in get_evaluator_info(evaluation_config_file_path):
+        if not evaluator.prescreen:
+            continue
+        prescreen_name = f"{evaluator.evaluator_name}-prescreen-{evaluator.app.app_name}".replace("_", "-")
+
+        logger.info(f"Building pipeline for {prescreen_name}...")
+        pipeline_job = build_pipeline(
+            evaluator_info=evaluator,
+            aml_key_vault_url=key_vault_url,
+            aml_datastore_gold_zone_path=aml_datastore_gold_zone_path,
+            aml_datastore_evaluation_path=aml_datastore_evaluation_path,
+            pipeline_name=prescreen_name.replace("-", "_")
+        )
+        pipeline_job.settings.default_compute = compute_name
+        pipeline_job.experiment_name = evaluator.app.app_name
+
+        logger.info(f"Scheduling pipeline for {prescreen_name}...")
+        aml_handler.schedule_pipeline(
+            pipeline_job=pipeline_job,
+            schedule_name=prescreen_name,
+            schedule=evaluator.prescreen["schedule"],
+            schedule_start_time=evaluator.prescreen.get("schedule_start_time")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""This script is used to schedule the pipeline archiving expired evaluation metrics to the evaluation datastore."""
+import os
+import yaml
+from dotenv import load_dotenv
+from azure.ai.ml import Output, load_component
+from azure.ai.ml.constants import AssetTypes
+from azure.ai.ml.dsl import pipeline
+
+from llmevalgrader.common.azure_ml_handler import AzureMLHandler
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("deploy_retention_pipeline")
+
+RETENTION_PIPELINE_NAME = "evaluation_metrics_retention"
+
+
+def build_pipeline(aml_key_vault_url: str, aml_datastore_evaluation_path: str, retention_months: int):
+    """
+    Constructs the Azure Machine Learning pipeline archiving the months of FACT_EVALUATION_METRIC
+    older than the retention period.
+
+    Args:
+        aml_key_vault_url (str): URL of the Azure Key Vault.
+        aml_datastore_evaluation_path (str): AML datastore path for evaluation output data.
+        retention_months (int): Number of months kept in FACT_EVALUATION_METRIC.
+
+    Returns:
+        PipelineJob: Azure Machine Learning pipeline job.
+    """
+    archive_metrics_component = load_component("../components/definition/archive_metrics.yml")
+    archive_path = aml_datastore_evaluation_path + "archive-evaluation-metrics/fact_evaluation_metric/"
+
+    @pipeline(
+        name=RETENTION_PIPELINE_NAME,
+        display_name=RETENTION_PIPELINE_NAME,
+        experiment_name=RETENTION_PIPELINE_NAME
+    )
+    def retention_pipeline():
+        archive_metrics = archive_metrics_component(
+            key_vault_url=aml_key_vault_url,
+            retention_months=retention_months
+            )
+        archive_metrics.outputs.archive_path = Output(path=archive_path, type=AssetTypes.URI_FOLDER, mode="rw_mount")
+
+    return retention_pipeline()
+
+
+def main():
+    """Build and schedule the retention pipeline"""
+    load_dotenv()
+    subscription_id = os.getenv("SUBSCRIPTION_ID")
+    resource_group_name = os.getenv("RESOURCE_GROUP_NAME")
+    workspace_name = os.getenv("AML_WORKSPACE_NAME")
+    key_vault_url = os.getenv("KEY_VAULT_URL")
+
+    aml_config_file_path = "../config/aml_config.yml"
+    with open(aml_config_file_path, 'r') as file:
+        aml_config = yaml.safe_load(file)
+
+    compute_name = aml_config["compute"]["name"]
+    aml_datastore_evaluation_path = aml_config["datastore"]["evaluation"]
+    retention_config = aml_config["retention"]
+
+    aml_handler = AzureMLHandler(subscription_id, resource_group_name, workspace_name)
+    aml_handler.get_compute(compute_name)
+
+    logger.info(f"Building pipeline for {RETENTION_PIPELINE_NAME}...")
+    pipeline_job = build_pipeline(
+        aml_key_vault_url=key_vault_url,
+        aml_datastore_evaluation_path=aml_datastore_evaluation_path,
+        retention_months=retention_config["retention_months"]
+    )
+    pipeline_job.settings.default_compute = compute_name
+    pipeline_job.experiment_name = RETENTION_PIPELINE_NAME
+
+    logger.info(f"Scheduling pipeline for {RETENTION_PIPELINE_NAME}...")
+    aml_handler.schedule_pipeline(
+        pipeline_job=pipeline_job,
+        schedule_name=RETENTION_PIPELINE_NAME.replace("_", "-"),
+        schedule=retention_config["schedule"],
+        schedule_start_time=retention_config["schedule_start_time"]
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""This script is used to apply the pending schema migrations to the evaluation metrics database."""
+import argparse
+import os
+from dotenv import load_dotenv
+
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.schema_migrations import SchemaMigrator
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("migrate_database")
+
+
+def parse_args():
+    """Parse command line arguments
+
+    Returns:
+        Namespace: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Process command line arguments")
+    parser.add_argument(
+        "--include",
+        help="Comma separated versions of the optional migrations to apply, e.g. 4,5 for the clustered "
+             "columnstore index and the monthly partitioning",
+        type=lambda versions: [int(version) for version in versions.split(",") if version.strip()],
+        default=[],
+    )
+    parser.add_argument(
+        "--dry_run",
+        help="Only log the pending migrations and their statements",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Apply pending schema migrations"""
+    args = parse_args()
+    load_dotenv()
+    key_vault_url = os.getenv("KEY_VAULT_URL")
+
+    db_handler = DBHandler(key_vault_url)
+    db_handler.init_db_connection()
+    try:
+        migrator = SchemaMigrator(db_handler)
+        migrator.apply(include=args.include, dry_run=args.dry_run)
+    finally:
+        db_handler.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -46,13 +46,13 @@ def parse_args():
     parser.add_argument(
         "--evaluation_start_date",
         help="Date to run the aggregation for in format YYYY/MM/DD HH:MM",
-        required=True,
+        required=False,
         type=valid_date,
     )
     parser.add_argument(
         "--evaluation_end_date",
         help="Date to run the aggregation for in format YYYY/MM/DD HH:MM",
-        required=True,
+        required=False,
         type=valid_date,
     )
     parser.add_argument(
@@ -60,6 +60,11 @@ def parse_args():
         help="Endpoint name to run the aggregation for",
         required=False,
     )
+    parser.add_argument(
+        "--retry_dataset_path",
+        help="Datastore path of a retry dataset written by write_metrics, to evaluate again only the rows without results",
+        required=False,
+    )
     return parser.parse_args()
 
 
@@ -89,8 +94,12 @@ def get_ml_client():
 
 def main():
     args = parse_args()
-    evaluation_data_start_date = args.evaluation_start_date
-    evaluation_data_end_date = args.evaluation_end_date
+    # "NA" dates are ignored by a retry run, which grades the rows of the retry dataset.
+    evaluation_data_start_date = args.evaluation_start_date or "NA"
+    evaluation_data_end_date = args.evaluation_end_date or "NA"
+
+    if args.retry_dataset_path is None and "NA" in (evaluation_data_start_date, evaluation_data_end_date):
+        raise argparse.ArgumentTypeError("Start and end dates are required, unless a retry dataset is given")
 
     # compare start and end date return error if start date is greater than end date
     if evaluation_data_start_date > evaluation_data_end_date:
@@ -102,18 +111,22 @@ def main():
         else args.endpoint_name
     )
 
+    inputs = {
+        "evaluation_data_start_date": Input(
+            type="string", default=evaluation_data_start_date
+        ),
+        "evaluation_data_end_date": Input(
+            type="string", default=evaluation_data_end_date
+        ),
+    }
+    if args.retry_dataset_path is not None:
+        inputs["retry_dataset"] = Input(type="uri_folder", path=args.retry_dataset_path)
+
     ml_client = get_ml_client()
     job = ml_client.batch_endpoints.invoke(
         experiment_name = "sample-chatbot",
         endpoint_name=endpoint_name,
-        inputs={
-            "evaluation_data_start_date": Input(
-                type="string", default=evaluation_data_start_date
-            ),
-            "evaluation_data_end_date": Input(
-                type="string", default=evaluation_data_end_date
-            ),
-        },
+        inputs=inputs,
     )
 
     ml_client.jobs.stream(name=job.name)
@@ -0,0 +1,154 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Token-budgeted windowing of the conversation context passed to the LLM graders, shared by the evaluation prompt
+flows with additional_includes.
+
+The context of a turn is the history of its conversation, so the judge prompts of the late turns of long
+conversations grow with the conversation. The window keeps the most recent turns that fit in a token budget,
+plus a head slot with the beginning of the conversation, which usually states what the user is after, so that
+the prompt tokens of a turn are bounded whatever the length of the conversation.
+
+Tokens are counted with tiktoken when the encoding can be loaded, otherwise estimated from the number of
+characters. The token estimator of llmevalgrader, which projects the prompt tokens of a run before it starts,
+counts them the same way.
+"""
+import functools
+import logging
+import re
+import threading
+
+DEFAULT_ENCODING_NAME = "cl100k_base"
+# Used when tiktoken or its encoding files are not available, e.g. without network access.
+CHARS_PER_TOKEN = 4
+# The turns of the context start with this prefix, see conversation_context.format_turn of llmevalgrader.
+TURN_SEPARATOR = re.compile(r"(?=\nUser:)")
+# Marks the part of the conversation left out of the window.
+OMITTED_MARKER = "\n[...]\n"
+# The lines of a flow run in threads, the encoding is loaded once.
+_encoding_lock = threading.Lock()
+
+
+def get_encoding(encoding_name: str):
+    """
+    Returns the tiktoken encoding of a name, or None when it cannot be loaded.
+    """
+    if not encoding_name:
+        return None
+    with _encoding_lock:
+        return _load_encoding(encoding_name)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_encoding(encoding_name: str):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logging.warning("Failed to load the %s encoding, estimating the tokens from the characters: %s",
+                        encoding_name, e)
+        return None
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING_NAME) -> int:
+    """
+    Returns the number of tokens of a text.
+
+    Args:
+        text (str): The text.
+        encoding_name (str): The tiktoken encoding, None to estimate the tokens from the characters.
+
+    Returns:
+        int: The number of tokens, 0 for an empty text.
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False,
+                    encoding_name: str = DEFAULT_ENCODING_NAME) -> str:
+    """
+    Truncates a text to a number of tokens.
+
+    Args:
+        text (str): The text.
+        max_tokens (int): The number of tokens kept.
+        keep_end (bool): Whether to keep the end of the text rather than its beginning.
+        encoding_name (str): The tiktoken encoding, None to estimate the tokens from the characters.
+
+    Returns:
+        str: The truncated text.
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        return text[-max_chars:] if keep_end else text[:max_chars]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[-max_tokens:] if keep_end else tokens[:max_tokens])
+
+
+def split_turns(context: str) -> list:
+    """
+    Splits a conversation context into its turns, a context without turns is a single turn.
+    """
+    return [turn for turn in TURN_SEPARATOR.split(context) if turn]
+
+
+def window_context(context: str, max_tokens: int, head_tokens: int = 0,
+                   encoding_name: str = DEFAULT_ENCODING_NAME) -> dict:
+    """
+    Fits a conversation context into a token budget.
+
+    A context within the budget is kept as is. Otherwise, the context keeps up to head_tokens tokens of its first
+    turn, then the most recent turns that fit in the rest of the budget, with a marker of the omitted part in
+    between. A most recent turn longer than the budget keeps its end, the answer under evaluation
+    follows it.
+
+    Args:
+        context (str): The context, the conversation history before the turn.
+        max_tokens (int): The token budget of the context, 0 to keep the context as is.
+        head_tokens (int): The tokens of the budget kept for the beginning of the conversation, 0 for none.
+        encoding_name (str): The tiktoken encoding, None to estimate the tokens from the characters.
+
+    Returns:
+        dict: The windowed context, with the number of tokens of the original context (context_tokens) and of
+            the windowed context (windowed_context_tokens).
+    """
+    if max_tokens < 0 or head_tokens < 0:
+        raise ValueError(f"Invalid context window of {max_tokens} tokens with a head of {head_tokens} tokens, "
+                         "they must be 0 or more")
+    context_tokens = count_tokens(context, encoding_name)
+    if max_tokens == 0 or context_tokens <= max_tokens:
+        return {"context": context, "context_tokens": context_tokens, "windowed_context_tokens": context_tokens}
+
+    turns = split_turns(context)
+    head = ""
+    if head_tokens > 0 and len(turns) > 1:
+        head = truncate_tokens(turns.pop(0), min(head_tokens, max_tokens // 2), encoding_name=encoding_name)
+    budget = max_tokens - count_tokens(head, encoding_name) - count_tokens(OMITTED_MARKER, encoding_name)
+
+    recent_turns = []
+    for turn in reversed(turns):
+        turn_tokens = count_tokens(turn, encoding_name)
+        if turn_tokens > budget:
+            break
+        recent_turns.insert(0, turn)
+        budget -= turn_tokens
+    if len(recent_turns) == 0:
+        recent_turns = [truncate_tokens(turns[-1], budget, keep_end=True, encoding_name=encoding_name)]
+
+    windowed_context = head + OMITTED_MARKER + "".join(recent_turns)
+    return {
+        "context": windowed_context,
+        "context_tokens": context_tokens,
+        "windowed_context_tokens": count_tokens(windowed_context, encoding_name),
+    }
@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+
+from promptflow.core import tool
+
+from context_window import DEFAULT_ENCODING_NAME, window_context
+
+
+@tool
+def fit_context(evaluation_data: dict, max_tokens: int = 2000, head_tokens: int = 200,
+                encoding_name: str = DEFAULT_ENCODING_NAME):
+    """Fit the context of a turn into a token budget, before rendering it in the prompt of the LLM.
+
+    Args:
+        evaluation_data (dict): The evaluation data of the turn.
+        max_tokens (int): The token budget of the context, 0 to keep the context as is.
+        head_tokens (int): The tokens of the budget kept for the beginning of the conversation.
+        encoding_name (str): The tiktoken encoding of the model.
+
+    Returns:
+        evaluation_data (dict): The evaluation data with the windowed context, and the number of tokens of the
+                                original context (context_tokens) and of the windowed context
+                                (windowed_context_tokens).
+    """
+    window = window_context(evaluation_data.get("context") or "", max_tokens, head_tokens, encoding_name)
+    if window["windowed_context_tokens"] < window["context_tokens"]:
+        logging.info("Windowed the context from %s to %s tokens", window["context_tokens"],
+                     window["windowed_context_tokens"])
+        evaluation_data = {**evaluation_data, "context": window["context"]}
+    else:
+        evaluation_data = dict(evaluation_data)
+    evaluation_data["context_tokens"] = window["context_tokens"]
+    evaluation_data["windowed_context_tokens"] = window["windowed_context_tokens"]
+    return evaluation_data
@@ -0,0 +1,246 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Content-addressed cache of the outputs of the LLM graders, shared by the evaluation prompt flows with
+additional_includes.
+
+An output is cached under a hash of the prompt template, the deployment name, the temperature and the inputs of
+the prompt, so that identical (query, context, response) triples are graded once, and that changing the prompt
+or the model invalidates the cached grades.
+
+The store is selected with environment variables:
+    LLMEVAL_GRADING_CACHE: "none" (default), "disk" or "blob". The deployed evaluation pipelines use the blob
+        store when the evaluator has a grading_cache_blob_url in the evaluation_config.yml.
+    LLMEVAL_GRADING_CACHE_PATH: The folder of the disk store, e.g. a mounted datastore folder shared by the runs.
+        Without it, the disk store uses a temporary folder of the node, which the other nodes do not share.
+    LLMEVAL_GRADING_CACHE_MAX_ENTRIES: The number of entries the disk store keeps, the least recently used
+        entries are evicted beyond it.
+    LLMEVAL_GRADING_CACHE_BLOB_URL: The URL of the blob container of the blob store, which needs the
+        azure-storage-blob and azure-identity packages in the requirements.txt of the flow.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+GRADING_CACHE_ENV_VAR = "LLMEVAL_GRADING_CACHE"
+GRADING_CACHE_PATH_ENV_VAR = "LLMEVAL_GRADING_CACHE_PATH"
+GRADING_CACHE_MAX_ENTRIES_ENV_VAR = "LLMEVAL_GRADING_CACHE_MAX_ENTRIES"
+GRADING_CACHE_BLOB_URL_ENV_VAR = "LLMEVAL_GRADING_CACHE_BLOB_URL"
+DEFAULT_GRADING_CACHE_PATH = os.path.join(tempfile.gettempdir(), "llmeval_grading_cache")
+DEFAULT_MAX_ENTRIES = 100000
+# The disk store checks its size every this number of writes.
+EVICTION_INTERVAL = 100
+
+
+def get_template_hash(template_path: str) -> str:
+    """
+    Returns the SHA-256 hash of a prompt template file.
+
+    Args:
+        template_path (str): The path of the template, relative to the flow folder or absolute.
+
+    Returns:
+        str: The hex digest of the template content.
+    """
+    if not os.path.isabs(template_path):
+        template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), template_path)
+    with open(template_path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_cache_key(template_hash: str, deployment_name: str, temperature: float, inputs: dict) -> str:
+    """
+    Returns the cache key of a grading, the SHA-256 hash of everything that determines the LLM output.
+
+    Args:
+        template_hash (str): The hash of the prompt template.
+        deployment_name (str): The name of the Azure OpenAI deployment.
+        temperature (float): The sampling temperature.
+        inputs (dict): The inputs rendered in the prompt template.
+
+    Returns:
+        str: The hex digest of the key.
+    """
+    key = json.dumps(
+        {"template": template_hash, "deployment_name": deployment_name, "temperature": float(temperature),
+         "inputs": inputs},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class GradingCacheStore:
+    """
+    Base class of the stores of the grading cache. A store never raises on a lookup, a failure is a miss.
+    """
+
+    def get(self, key: str):
+        """
+        Returns the cached output of a key, or None.
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, output: str):
+        """
+        Caches the output of a key.
+        """
+        raise NotImplementedError
+
+
+class NullGradingCacheStore(GradingCacheStore):
+    """
+    Store that caches nothing, when the cache is disabled.
+    """
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, output: str):
+        pass
+
+
+class DiskGradingCacheStore(GradingCacheStore):
+    """
+    Stores each entry as a JSON file of a local or mounted folder, with least recently used eviction.
+
+    A lookup touches the modification time of the entry file, and the entries with the oldest modification times
+    are removed when the folder holds more than max_entries entries. Entries are written to a temporary file
+    and renamed, so that concurrent runs sharing the folder never read a partial entry.
+
+    Args:
+        path (str): The folder of the entries.
+        max_entries (int): The number of entries kept.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.write_count = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _get_entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        entry_path = self._get_entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as file:
+                output = json.load(file)["output"]
+            os.utime(entry_path)
+            return output
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Invalid grading cache entry %s: %s", entry_path, e)
+            return None
+
+    def set(self, key: str, output: str):
+        entry_path = self._get_entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temporary_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump({"output": output, "created": time.time()}, file)
+        os.replace(temporary_path, entry_path)
+        self.write_count += 1
+        if self.write_count % EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries beyond max_entries.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        entries = []
+        for folder, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if file_name.endswith(".json"):
+                    entry_path = os.path.join(folder, file_name)
+                    try:
+                        entries.append((os.stat(entry_path).st_mtime, entry_path))
+                    except FileNotFoundError:
+                        continue
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort()
+        removed_count = 0
+        for _, entry_path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry_path)
+                removed_count += 1
+            except FileNotFoundError:
+                continue
+        logging.info("Evicted %s grading cache entries from %s", removed_count, self.path)
+        return removed_count
+
+
+class BlobGradingCacheStore(GradingCacheStore):
+    """
+    Stores each entry as a JSON blob of an Azure Storage container, authenticated with DefaultAzureCredential.
+    Eviction is left to the lifecycle management policy of the storage account.
+
+    Args:
+        container_url (str): The URL of the blob container.
+    """
+
+    def __init__(self, container_url: str):
+        try:
+            from azure.core.exceptions import ResourceNotFoundError
+            from azure.identity import DefaultAzureCredential
+            from azure.storage.blob import ContainerClient
+        except ImportError as e:
+            raise ImportError("The blob grading cache needs the azure-storage-blob and azure-identity packages, "
+                              "add them to the requirements.txt of the flow") from e
+        self.resource_not_found_error = ResourceNotFoundError
+        self.container_client = ContainerClient.from_container_url(container_url, credential=DefaultAzureCredential())
+
+    def get(self, key: str):
+        try:
+            content = self.container_client.download_blob(f"{key}.json").readall()
+            return json.loads(content)["output"]
+        except self.resource_not_found_error:
+            return None
+        except Exception as e:
+            logging.warning("Failed to read grading cache entry %s: %s", key, e)
+            return None
+
+    def set(self, key: str, output: str):
+        self.container_client.upload_blob(
+            f"{key}.json", json.dumps({"output": output, "created": time.time()}), overwrite=True
+        )
+
+
+_store = None
+
+
+def get_store() -> GradingCacheStore:
+    """
+    Returns the store of the process, created from the environment variables on first use.
+    """
+    global _store
+    if _store is None:
+        if GRADING_CACHE_ENV_VAR not in os.environ:
+            logging.warning("The grading cache is disabled, set %s to blob with %s, or to disk with %s "
+                            "a folder shared by the runs, to enable it",
+                            GRADING_CACHE_ENV_VAR, GRADING_CACHE_BLOB_URL_ENV_VAR, GRADING_CACHE_PATH_ENV_VAR)
+        store_type = os.environ.get(GRADING_CACHE_ENV_VAR, "none").lower()
+        if store_type == "none":
+            _store = NullGradingCacheStore()
+        elif store_type == "disk":
+            if GRADING_CACHE_PATH_ENV_VAR not in os.environ:
+                logging.warning("%s is not set, the grading cache is stored in %s, which is not shared with the "
+                                "other nodes", GRADING_CACHE_PATH_ENV_VAR, DEFAULT_GRADING_CACHE_PATH)
+            _store = DiskGradingCacheStore(
+                os.environ.get(GRADING_CACHE_PATH_ENV_VAR, DEFAULT_GRADING_CACHE_PATH),
+                int(os.environ.get(GRADING_CACHE_MAX_ENTRIES_ENV_VAR, DEFAULT_MAX_ENTRIES)),
+            )
+        elif store_type == "blob":
+            _store = BlobGradingCacheStore(os.environ[GRADING_CACHE_BLOB_URL_ENV_VAR])
+        else:
+            raise ValueError(f"Invalid grading cache store {store_type}, it must be disk, blob or none")
+    return _store
@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+
+from promptflow.core import tool
+
+from grading_cache import get_cache_key, get_store, get_template_hash
+
+
+@tool
+def lookup_grade(template_path: str, deployment_name: str, temperature: float, question: str, context: str,
+                 answer: str):
+    """Look up the grade of the inputs in the grading cache, before calling the LLM.
+
+    Args:
+        template_path (str): The prompt template of the LLM node, relative to the flow folder.
+        deployment_name (str): The deployment of the LLM node.
+        temperature (float): The temperature of the LLM node.
+        question (str): The question rendered in the prompt.
+        context (str): The context rendered in the prompt.
+        answer (str): The answer rendered in the prompt.
+
+    Returns:
+        lookup (dict): The cache key, whether the grade is cached (hit) and the cached LLM output.
+    """
+    key = get_cache_key(
+        get_template_hash(template_path), deployment_name, temperature,
+        {"question": question, "context": context, "answer": answer},
+    )
+    try:
+        output = get_store().get(key)
+    except Exception as e:
+        logging.warning("Grading cache lookup failed, calling the LLM: %s", e)
+        output = None
+    return {"key": key, "hit": output is not None, "output": output}
@@ -0,0 +1,32 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+
+from promptflow.core import tool
+
+from grading_cache import get_store
+
+
+@tool
+def update_grade(lookup: dict, llm_output: object = None):
+    """Return the grade of the inputs, from the grading cache on a hit, or from the LLM, which is then cached.
+
+    Args:
+        lookup (dict): The output of lookup_grade.
+        llm_output (object): The output of the LLM node, None when the node was skipped on a cache hit. The
+                             output of rate_controlled_chat holds the LLM output in its output field.
+
+    Returns:
+        output (str): The LLM output of the inputs.
+    """
+    if lookup["hit"]:
+        return lookup["output"]
+    if isinstance(llm_output, dict):
+        llm_output = llm_output.get("output")
+    if llm_output is not None:
+        try:
+            get_store().set(lookup["key"], llm_output)
+        except Exception as e:
+            logging.warning("Failed to cache the grade: %s", e)
+    return llm_output
@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import functools
+import logging
+import os
+import re
+import time
+
+from jinja2 import Template
+from openai import AzureOpenAI
+from promptflow.connections import AzureOpenAIConnection
+from promptflow.core import tool
+
+from rate_controller import estimate_request_tokens, get_controller
+
+# The controller stats are logged every this number of requests of the process.
+STATS_LOG_INTERVAL = 100
+ROLE_PATTERN = re.compile(r"^\s*(system|user|assistant)\s*:\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def parse_chat_messages(prompt: str) -> list:
+    """
+    Splits a rendered prompt into chat messages, on the lines holding only a role, as the LLM tool does.
+    """
+    matches = list(ROLE_PATTERN.finditer(prompt))
+    if len(matches) == 0:
+        return [{"role": "user", "content": prompt.strip()}]
+    messages = []
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(prompt)
+        messages.append({"role": match.group(1).lower(), "content": prompt[match.end():end].strip()})
+    return messages
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(template_path: str) -> Template:
+    if not os.path.isabs(template_path):
+        template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), template_path)
+    with open(template_path, "r", encoding="utf-8") as file:
+        return Template(file.read(), trim_blocks=True, keep_trailing_newline=True)
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(api_base: str, api_key: str, api_version: str) -> AzureOpenAI:
+    # Throttled requests and transient errors are retried by the rate controller, which adapts the concurrency
+    # to the throttled requests.
+    return AzureOpenAI(azure_endpoint=api_base, api_key=api_key, api_version=api_version, max_retries=0)
+
+
+@tool
+def rate_controlled_chat(connection: AzureOpenAIConnection, template_path: str, deployment_name: str,
+                         temperature: float, max_tokens: int, question: str, context: str, answer: str):
+    """Call an Azure OpenAI chat deployment with the rendered prompt template, within the client-side rate
+    limits of the deployment, see rate_controller.py.
+
+    Args:
+        connection (AzureOpenAIConnection): The Azure OpenAI connection.
+        template_path (str): The prompt template, relative to the flow folder.
+        deployment_name (str): The chat deployment.
+        temperature (float): The sampling temperature.
+        max_tokens (int): The completion tokens of the request.
+        question (str): The question rendered in the prompt.
+        context (str): The context rendered in the prompt.
+        answer (str): The answer rendered in the prompt.
+
+    Returns:
+        llm_call (dict): The LLM output, the total tokens of the request, its throttled and transient retries and
+                         its start and end times in seconds since the epoch.
+    """
+    prompt = get_template(template_path).render(question=question, context=context, answer=answer)
+    messages = parse_chat_messages(prompt)
+    client = get_client(connection.api_base, connection.api_key, connection.api_version)
+    controller = get_controller(deployment_name)
+
+    request_start = time.time()
+    response, throttled_retries, transient_retries = controller.call(
+        lambda: client.chat.completions.create(
+            model=deployment_name, messages=messages, temperature=temperature, max_tokens=max_tokens
+        ),
+        estimate_request_tokens(messages, max_tokens),
+    )
+    request_end = time.time()
+
+    stats = controller.get_stats()
+    if stats["requests"] % STATS_LOG_INTERVAL == 0:
+        logging.info("Deployment %s: %s requests, %.0f RPM, %.0f TPM, %s throttled, %s transient retries, "
+                     "%s concurrent requests", deployment_name, stats["requests"], stats["achieved_rpm"],
+                     stats["achieved_tpm"], stats["throttled_requests"], stats["transient_retries"],
+                     stats["concurrency_limit"])
+    return {
+        "output": response.choices[0].message.content,
+        "total_tokens": response.usage.total_tokens if response.usage is not None else None,
+        "throttled_retries": throttled_retries,
+        "transient_retries": transient_retries,
+        "request_start": request_start,
+        "request_end": request_end,
+    }
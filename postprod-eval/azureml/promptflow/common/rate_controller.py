@@ -0,0 +1,328 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Client-side rate control of the LLM calls of the evaluation prompt flows, shared by the flows with
+additional_includes.
+
+Each deployment gets a controller, shared by the threads of the process, which combines:
+    - token buckets of the tokens per minute (TPM) and requests per minute (RPM) of the deployment quota, the
+      tokens of a request being estimated as Azure OpenAI counts them, prompt tokens plus max_tokens,
+    - an additive increase, multiplicative decrease (AIMD) limit of the concurrent requests: the limit grows
+      by one request per limit successful requests and halves on a throttled (429) request,
+    - a pause of all the requests for the retry-after delay of a throttled request,
+    - retries with exponential backoff of the requests failing with a transient error, a timeout, a connection
+      error or a 5xx response, counted apart from the throttled retries and leaving the limits as they are.
+
+The controllers are configured with environment variables, set to the share of the deployment quota of each
+process when several processes or nodes grade in parallel:
+    LLMEVAL_RATE_LIMIT_TPM: The tokens per minute, 0 (default) for no limit.
+    LLMEVAL_RATE_LIMIT_RPM: The requests per minute, 0 (default) for no limit.
+    LLMEVAL_INITIAL_CONCURRENCY: The initial limit of concurrent requests, 4 by default.
+    LLMEVAL_MAX_CONCURRENCY: The maximum limit of concurrent requests, 64 by default.
+
+The state of the controllers is not shared between processes. The promptflow batch engine runs the lines of a
+flow in PF_WORKER_COUNT worker processes, one line at a time per process, so in a deployed flow the concurrency
+of the requests is the worker count, the AIMD limit only applies to the threads of a single process, and the
+token buckets of each process hold its share of the quota. The deployment sets PF_WORKER_COUNT and that share
+from the rate_limit of the evaluator in the evaluation_config.yml.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+RATE_LIMIT_TPM_ENV_VAR = "LLMEVAL_RATE_LIMIT_TPM"
+RATE_LIMIT_RPM_ENV_VAR = "LLMEVAL_RATE_LIMIT_RPM"
+INITIAL_CONCURRENCY_ENV_VAR = "LLMEVAL_INITIAL_CONCURRENCY"
+MAX_CONCURRENCY_ENV_VAR = "LLMEVAL_MAX_CONCURRENCY"
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MAX_RETRIES = 8
+# As the openai SDK, which retries transient errors twice by default.
+DEFAULT_MAX_TRANSIENT_RETRIES = 2
+# Pause of a throttled request without a retry-after header, doubled on each retry.
+DEFAULT_RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 60
+# Backoff of a request failing with a transient error, doubled on each retry, as the openai SDK.
+TRANSIENT_RETRY_SECONDS = 0.5
+MAX_TRANSIENT_RETRY_SECONDS = 8
+# The status codes retried by the openai SDK, besides 429 and the 5xx.
+TRANSIENT_STATUS_CODES = (408, 409)
+# Azure OpenAI counts about this number of characters per token for the rate limits.
+CHARS_PER_TOKEN = 4
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at a rate per minute, thread-safe. A reservation larger than the tokens in the bucket
+    takes the bucket into debt, and the next reservations wait for the debt to be refilled, so the requests are
+    served in order.
+
+    Args:
+        rate_per_minute (float): The tokens added per minute.
+        capacity (float): The tokens the bucket holds, the rate per minute by default.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Takes tokens from the bucket.
+
+        Args:
+            amount (float): The tokens taken, capped to the capacity of the bucket.
+
+        Returns:
+            float: The seconds to wait before using the tokens.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate_per_second)
+
+    def acquire(self, amount: float):
+        """
+        Takes tokens from the bucket, waiting until they are available.
+        """
+        wait_seconds = self.reserve(amount)
+        if wait_seconds > 0:
+            self.sleep(wait_seconds)
+
+
+class AimdConcurrencyLimiter:
+    """
+    Limit of the concurrent requests, with additive increase on success and multiplicative decrease on
+    throttling, thread-safe.
+
+    Args:
+        initial_limit (int): The initial limit of concurrent requests.
+        min_limit (int): The lowest limit.
+        max_limit (int): The highest limit.
+        decrease_factor (float): The factor of the limit on a throttled request.
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_CONCURRENCY, min_limit: int = 1,
+                 max_limit: int = DEFAULT_MAX_CONCURRENCY, decrease_factor: float = 0.5, clock=time.monotonic):
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.clock = clock
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits for a request slot, and for the end of the pause after a throttled request.
+        """
+        with self.condition:
+            while True:
+                pause_seconds = self.paused_until - self.clock()
+                if pause_seconds > 0:
+                    self.condition.wait(pause_seconds)
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                else:
+                    self.condition.wait()
+
+    def release(self, throttled: bool = False, retry_after: float = None, succeeded: bool = True):
+        """
+        Releases a request slot and adapts the limit to the outcome of the request.
+
+        Args:
+            throttled (bool): Whether the request was throttled.
+            retry_after (float): The seconds to wait before the next request, from the response of a throttled
+                request.
+            succeeded (bool): Whether the request succeeded, a failed request leaves the limit as is.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = self.clock()
+            if throttled:
+                # The requests in flight when the quota ran out are throttled together, decrease once per pause.
+                if now >= self.paused_until:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self.paused_until = max(self.paused_until, now + (retry_after or DEFAULT_RETRY_SECONDS))
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Returns whether an error of the openai SDK is a throttled (429) request.
+    """
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Returns whether an error of the openai SDK is transient, a timeout, a connection error or a 5xx response,
+    which the SDK retries when its own retries are enabled.
+    """
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in TRANSIENT_STATUS_CODES or status_code >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def get_retry_after(error: Exception):
+    """
+    Returns the seconds to wait from the retry-after-ms or retry-after headers of a throttled response, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # An HTTP date rather than seconds, fall back to the default backoff.
+        pass
+    return None
+
+
+def estimate_request_tokens(messages: list, max_tokens: int) -> int:
+    """
+    Estimates the tokens of a chat request as the rate limiter of Azure OpenAI counts them, the prompt tokens
+    estimated from the characters plus max_tokens.
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + max_tokens
+
+
+class RateController:
+    """
+    Rate controller of a deployment, see the module docstring.
+
+    Args:
+        tokens_per_minute (float): The tokens per minute, 0 for no limit.
+        requests_per_minute (float): The requests per minute, 0 for no limit.
+        initial_concurrency (int): The initial limit of concurrent requests.
+        max_concurrency (int): The maximum limit of concurrent requests.
+    """
+
+    def __init__(self, tokens_per_minute: float = 0, requests_per_minute: float = 0,
+                 initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, clock=time.monotonic, sleep=time.sleep):
+        self.token_bucket = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep) if tokens_per_minute > 0 else None
+        self.request_bucket = TokenBucket(requests_per_minute, clock=clock, sleep=sleep) \
+            if requests_per_minute > 0 else None
+        self.limiter = AimdConcurrencyLimiter(initial_concurrency, max_limit=max_concurrency, clock=clock)
+        self.clock = clock
+        self.sleep = sleep
+        self.stats_lock = threading.Lock()
+        self.started = None
+        self.requests = 0
+        self.tokens = 0
+        self.throttled_requests = 0
+        self.transient_retries = 0
+
+    def call(self, request, estimated_tokens: int, max_retries: int = DEFAULT_MAX_RETRIES,
+             max_transient_retries: int = DEFAULT_MAX_TRANSIENT_RETRIES):
+        """
+        Sends a request within the rate limits, retrying it when throttled or when it fails with a transient error.
+
+        Args:
+            request (callable): Sends the request and returns the response, raises the error of the openai SDK
+                on a failed request. The SDK must not retry the requests itself.
+            estimated_tokens (int): The tokens of the request counted by the rate limiter of the deployment.
+            max_retries (int): The retries of a throttled request.
+            max_transient_retries (int): The retries of a request failing with a transient error.
+
+        Returns:
+            tuple: The response, the number of throttled retries and the number of transient retries.
+        """
+        attempt = 0
+        transient_attempt = 0
+        while True:
+            if self.request_bucket is not None:
+                self.request_bucket.acquire(1)
+            if self.token_bucket is not None:
+                self.token_bucket.acquire(estimated_tokens)
+            self.limiter.acquire()
+            with self.stats_lock:
+                if self.started is None:
+                    self.started = self.clock()
+            try:
+                response = request()
+            except Exception as e:
+                if not is_throttling_error(e):
+                    self.limiter.release(succeeded=False)
+                    if not is_transient_error(e) or transient_attempt == max_transient_retries:
+                        raise
+                    with self.stats_lock:
+                        self.transient_retries += 1
+                    backoff = min(MAX_TRANSIENT_RETRY_SECONDS, TRANSIENT_RETRY_SECONDS * 2 ** transient_attempt) \
+                        * random.uniform(1, 1.25)
+                    transient_attempt += 1
+                    logging.warning("Request failed with %s, retrying in %.1f seconds", type(e).__name__, backoff)
+                    self.sleep(backoff)
+                    continue
+                retry_after = get_retry_after(e)
+                if retry_after is None:
+                    retry_after = min(MAX_RETRY_SECONDS, DEFAULT_RETRY_SECONDS * 2 ** attempt) * random.uniform(1, 1.5)
+                self.limiter.release(throttled=True, retry_after=retry_after)
+                with self.stats_lock:
+                    self.throttled_requests += 1
+                if attempt == max_retries:
+                    raise
+                logging.warning("Request throttled, retrying in %.1f seconds with a limit of %s concurrent requests",
+                                retry_after, int(self.limiter.limit))
+                attempt += 1
+                continue
+            self.limiter.release()
+            usage = getattr(response, "usage", None)
+            with self.stats_lock:
+                self.requests += 1
+                self.tokens += getattr(usage, "total_tokens", None) or estimated_tokens
+            return response, attempt, transient_attempt
+
+    def get_stats(self) -> dict:
+        """
+        Returns the achieved requests and tokens per minute of the process, since its first request.
+        """
+        with self.stats_lock:
+            elapsed_minutes = (self.clock() - self.started) / 60 if self.started is not None else 0
+            return {
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "throttled_requests": self.throttled_requests,
+                "transient_retries": self.transient_retries,
+                "concurrency_limit": int(self.limiter.limit),
+                "achieved_rpm": self.requests / elapsed_minutes if elapsed_minutes > 0 else 0.0,
+                "achieved_tpm": self.tokens / elapsed_minutes if elapsed_minutes > 0 else 0.0,
+            }
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(deployment_name: str) -> RateController:
+    """
+    Returns the controller of a deployment, shared by the threads of the process and created from the
+    environment variables on first use.
+    """
+    with _controllers_lock:
+        if deployment_name not in _controllers:
+            _controllers[deployment_name] = RateController(
+                float(os.environ.get(RATE_LIMIT_TPM_ENV_VAR, 0)),
+                float(os.environ.get(RATE_LIMIT_RPM_ENV_VAR, 0)),
+                int(os.environ.get(INITIAL_CONCURRENCY_ENV_VAR, DEFAULT_INITIAL_CONCURRENCY)),
+                int(os.environ.get(MAX_CONCURRENCY_ENV_VAR, DEFAULT_MAX_CONCURRENCY)),
+            )
+        return _controllers[deployment_name]
@@ -0,0 +1,53 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Unit tests for context_window.py."""
+import unittest
+
+from context_window import OMITTED_MARKER, count_tokens, split_turns, window_context
+
+
+def format_turns(count: int) -> str:
+    return "".join(f"\nUser:question {i} about my order\nBot:answer {i} about the order\n" for i in range(count))
+
+
+class TestContextWindow(unittest.TestCase):
+    """
+    Unit tests for context_window.py, with the tokens estimated from the characters.
+    """
+
+    def test_context_within_budget(self):
+        """
+        Test that a context within the budget is kept as is.
+        """
+        context = format_turns(3)
+        window = window_context(context, 1000, 50, encoding_name=None)
+        self.assertEqual(window["context"], context)
+        self.assertEqual(window["context_tokens"], window["windowed_context_tokens"])
+        self.assertEqual(window_context(context, 0, encoding_name=None)["context"], context)
+
+    def test_context_keeps_head_and_recent_turns(self):
+        """
+        Test that a long context keeps the first turn and the most recent turns within the budget.
+        """
+        context = format_turns(100)
+        turns = split_turns(context)
+        self.assertEqual(len(turns), 100)
+        window = window_context(context, 100, 20, encoding_name=None)
+        self.assertEqual(window["context_tokens"], count_tokens(context, encoding_name=None))
+        self.assertLessEqual(window["windowed_context_tokens"], 100)
+        self.assertTrue(window["context"].startswith(turns[0]))
+        self.assertTrue(window["context"].endswith(turns[-2] + turns[-1]))
+        self.assertIn(OMITTED_MARKER, window["context"])
+        self.assertNotIn(turns[50], window["context"])
+
+    def test_context_keeps_end_of_long_turn(self):
+        """
+        Test that a most recent turn longer than the budget keeps its end.
+        """
+        context = format_turns(2) + "\nUser:" + "very long question " * 100 + "\nBot:final answer\n"
+        window = window_context(context, 50, 10, encoding_name=None)
+        self.assertLessEqual(window["windowed_context_tokens"], 50)
+        self.assertTrue(window["context"].endswith("\nBot:final answer\n"))
+        with self.assertRaises(ValueError):
+            window_context(context, -1, encoding_name=None)
@@ -0,0 +1,56 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Unit tests for grading_cache.py."""
+import os
+import tempfile
+import time
+import unittest
+
+from grading_cache import DiskGradingCacheStore, get_cache_key
+
+
+class TestGradingCache(unittest.TestCase):
+    """
+    Unit tests for grading_cache.py.
+    """
+
+    def test_cache_key(self):
+        """
+        Test that the key changes with the template, the deployment, the temperature and the inputs only.
+        """
+        inputs = {"question": "Where is my order?", "context": "NA", "answer": "It has been shipped."}
+        key = get_cache_key("template", "gpt-35-turbo", 0, inputs)
+        self.assertEqual(key, get_cache_key("template", "gpt-35-turbo", 0.0, dict(reversed(list(inputs.items())))))
+        self.assertNotEqual(key, get_cache_key("template-v2", "gpt-35-turbo", 0, inputs))
+        self.assertNotEqual(key, get_cache_key("template", "gpt-4", 0, inputs))
+        self.assertNotEqual(key, get_cache_key("template", "gpt-35-turbo", 0.5, inputs))
+        self.assertNotEqual(key, get_cache_key("template", "gpt-35-turbo", 0, {**inputs, "answer": "It is lost."}))
+
+    def test_disk_store(self):
+        """
+        Test that the disk store returns the cached outputs and None on a miss.
+        """
+        with tempfile.TemporaryDirectory() as path:
+            store = DiskGradingCacheStore(path)
+            self.assertIsNone(store.get("ab01"))
+            store.set("ab01", "5")
+            self.assertEqual(store.get("ab01"), "5")
+            self.assertEqual(DiskGradingCacheStore(path).get("ab01"), "5")
+
+    def test_disk_store_lru_eviction(self):
+        """
+        Test that the least recently used entries are evicted beyond max_entries.
+        """
+        with tempfile.TemporaryDirectory() as path:
+            store = DiskGradingCacheStore(path, max_entries=2)
+            for index, key in enumerate(["aa01", "bb02", "cc03"]):
+                store.set(key, str(index))
+                # Set distinct modification times, the eviction orders the entries by them.
+                os.utime(store._get_entry_path(key), (time.time() - 100 + index, time.time() - 100 + index))
+            # Reading the oldest entry makes it the most recently used one.
+            self.assertEqual(store.get("aa01"), "0")
+            self.assertEqual(store.evict(), 1)
+            self.assertEqual(store.get("aa01"), "0")
+            self.assertIsNone(store.get("bb02"))
+            self.assertEqual(store.get("cc03"), "2")
@@ -0,0 +1,124 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Unit tests for rate_controller.py."""
+import unittest
+from types import SimpleNamespace
+
+from rate_controller import AimdConcurrencyLimiter, RateController, TokenBucket, get_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("Too many requests")
+        self.response = SimpleNamespace(headers=headers)
+
+
+class InternalServerError(Exception):
+    status_code = 500
+
+
+class TestRateController(unittest.TestCase):
+    """
+    Unit tests for rate_controller.py, with a fake clock.
+    """
+
+    def test_token_bucket(self):
+        """
+        Test that the bucket waits for the tokens above its rate.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(600, clock=clock, sleep=clock.sleep)
+        self.assertEqual(bucket.reserve(600), 0)
+        self.assertAlmostEqual(bucket.reserve(100), 10)
+        clock.now = 20
+        self.assertAlmostEqual(bucket.reserve(100), 0)
+
+    def test_aimd_limit(self):
+        """
+        Test that the limit grows by one per limit successes and halves once per throttling pause.
+        """
+        clock = FakeClock()
+        limiter = AimdConcurrencyLimiter(initial_limit=4, max_limit=8, clock=clock)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(int(limiter.limit), 5)
+        for _ in range(3):
+            limiter.acquire()
+        for _ in range(3):
+            limiter.release(throttled=True, retry_after=2)
+        self.assertEqual(int(limiter.limit), 2)
+        self.assertEqual(limiter.paused_until, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_retry_after(self):
+        """
+        Test that throttled requests are retried after the retry-after delay and counted.
+        """
+        clock = FakeClock()
+        controller = RateController(clock=clock, sleep=clock.sleep)
+        responses = [RateLimitError({"retry-after-ms": "1500"}), SimpleNamespace(usage=SimpleNamespace(total_tokens=120))]
+
+        def request():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        controller.limiter.condition.wait = lambda timeout=None: clock.sleep(timeout or 0)
+        response, throttled_retries, transient_retries = controller.call(request, estimated_tokens=100)
+        self.assertEqual((throttled_retries, transient_retries), (1, 0))
+        self.assertEqual(response.usage.total_tokens, 120)
+        self.assertEqual(clock.now, 1.5)
+        stats = controller.get_stats()
+        self.assertEqual((stats["requests"], stats["tokens"], stats["throttled_requests"]), (1, 120, 1))
+        self.assertEqual(get_retry_after(RateLimitError({"retry-after": "3"})), 3)
+        self.assertIsNone(get_retry_after(RateLimitError({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})))
+
+    def test_transient_errors(self):
+        """
+        Test that transient errors are retried with backoff apart from the throttled requests, and that the other
+        errors are raised at once.
+        """
+        clock = FakeClock()
+        controller = RateController(clock=clock, sleep=clock.sleep)
+        responses = [InternalServerError("Internal server error"), SimpleNamespace(usage=None)]
+
+        def request():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        initial_limit = controller.limiter.limit
+        _, throttled_retries, transient_retries = controller.call(request, estimated_tokens=100)
+        self.assertEqual((throttled_retries, transient_retries), (0, 1))
+        self.assertTrue(0.5 <= clock.now <= 0.625)
+        # Only the successful retry grows the limit.
+        self.assertEqual(controller.limiter.limit, initial_limit + 1 / initial_limit)
+        stats = controller.get_stats()
+        self.assertEqual((stats["requests"], stats["throttled_requests"], stats["transient_retries"]), (1, 0, 1))
+
+        responses = [InternalServerError("Internal server error")] * 3
+        with self.assertRaises(InternalServerError):
+            controller.call(request, estimated_tokens=100, max_transient_retries=2)
+        self.assertEqual(len(responses), 0)
+
+        responses = [ValueError("Invalid request"), SimpleNamespace(usage=None)]
+        with self.assertRaises(ValueError):
+            controller.call(request, estimated_tokens=100)
+        self.assertEqual(controller.limiter.in_flight, 0)
@@ -0,0 +1,38 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+
+from promptflow.core import tool
+
+
+@tool
+def parse_evaluation_data(evaluation_dataset: list):
+    """
+    Parse the prompt flow input and return the evaluation data with the names of the metrics to score.
+
+    Example of prompt flow input:
+    [
+        {
+            "evaluation_dataset_id": "",
+            "app_id": "",
+            "conversation_id": "",
+            "metadata_id": "",
+            "turn_id": "",
+            "query": "",
+            "query_time": "",
+            "context": "",
+            "response": "",
+            "metric_names": ""
+        }
+    ]
+
+    :param evaluation_dataset: Input to prompt flow.
+    :return: Dictionary with the evaluation data fields and the list of metric names, in the order of the configuration.
+    """
+    if len(evaluation_dataset) > 0:
+        evaluation_data = evaluation_dataset[0]
+        metric_names = [metric["metric_name"] for metric in json.loads(evaluation_data["metric_names"])]
+        return {"evaluation_data": evaluation_data, "metric_names": metric_names}
+    else:
+        raise ValueError("Evaluation data is empty")
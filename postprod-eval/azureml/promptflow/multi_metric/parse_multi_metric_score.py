@@ -0,0 +1,101 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import re
+
+from promptflow.core import tool
+
+
+def load_metric_scores(metric_scores: str) -> dict:
+    """Load the scores returned by the LLM for all the metrics of a turn.
+
+    Args:
+        metric_scores (str): The evaluation result LLM provides, a JSON object such as
+                             {"scores": {"turn_relevance": 5, "coherence": 4}}, possibly surrounded by other text.
+
+    Returns:
+        scores (dict): The raw score of each metric name returned by the LLM.
+    """
+    try:
+        result = json.loads(metric_scores)
+    except json.JSONDecodeError:
+        # Models sometimes wrap the JSON object in a code block or a sentence.
+        start, end = metric_scores.find("{"), metric_scores.rfind("}")
+        result = json.loads(metric_scores[start:end + 1]) if 0 <= start < end else None
+    if isinstance(result, dict) and isinstance(result.get("scores"), dict):
+        result = result["scores"]
+    if not isinstance(result, dict):
+        raise ValueError("No object of scores in the evaluation result")
+    return {str(metric_name): score for metric_name, score in result.items()}
+
+
+def parse_metric_value(raw_score, metric: dict):
+    """Parse the raw score of a metric.
+
+    Args:
+        raw_score: The raw score of the metric returned by the LLM.
+        metric (dict): The metric name, version, type and allowed values.
+
+    Returns:
+        The score, a float for numerical metrics or one of the allowed values for categorical metrics.
+    """
+    if raw_score is None:
+        raise ValueError(f"No score for metric {metric['metric_name']}")
+    if metric.get("metric_type", "numerical") == "categorical":
+        value = str(raw_score).strip()
+        if metric.get("metric_allowed_values") and value not in metric["metric_allowed_values"]:
+            raise ValueError(f"Invalid value {value} for metric {metric['metric_name']}")
+        return value
+    score = str(raw_score)
+    match = re.search(r"\d", score)
+    if match:
+        score = match.group()
+    return float(score)
+
+
+@tool
+def concat_results(evaluation_dataset: dict, metric_scores: str):
+    """Parse the results of the evaluation scores of all the metrics of the evaluator, graded with a single LLM call.
+
+    A missing or invalid score only fails its own metric, which gets a score of 0.
+
+    Args:
+        evaluation_dataset (dict): The evaluation dataset.
+        metric_scores (str): The evaluation result LLM provides, the scores from 1 to 5 of every metric.
+
+    Returns:
+        evaluation_output (list): The parsed results of the evaluation score of each metric appended to the original
+                                  evaluation dataset.
+    """
+    try:
+        scores = load_metric_scores(metric_scores)
+    except Exception as e:
+        logging.error("Parsing error of the metric scores: %s", e)
+        scores = {}
+
+    # Remove metric names dictionary, since it is flattened out in final evaluation output
+    metrics = json.loads(evaluation_dataset.pop("metric_names"))
+
+    evaluation_output = []
+    for metric in metrics:
+        raw_score = scores.get(metric["metric_name"])
+        try:
+            score = parse_metric_value(raw_score, metric)
+        except Exception as e:
+            logging.error("Parsing error of metric %s: %s", metric["metric_name"], e)
+            score = 0
+
+        evaluation_result = dict(evaluation_dataset)
+        evaluation_result["metric_name"] = metric["metric_name"]
+        evaluation_result["metric_version"] = metric["metric_version"]
+        evaluation_result["metric_value"] = score
+        evaluation_result["metric_raw_value"] = str(raw_score) if raw_score is not None else metric_scores
+        evaluation_result["metric_type"] = metric.get("metric_type", "numerical")
+        evaluation_output.append(evaluation_result)
+
+    # Format the evaluation output as a list of dictionaries, one per metric
+    # This is the standard format for all evaluation outputs
+    logging.info("Evaluation output: %s", evaluation_output)
+    return evaluation_output
@@ -0,0 +1,90 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Unit tests for parse_multi_metric_score.py."""
+import json
+import unittest
+
+from parse_multi_metric_score import concat_results
+
+metric_names = [
+    {"metric_name": "turn_relevance", "metric_version": 1.0, "metric_type": "numerical", "metric_allowed_values": []},
+    {"metric_name": "groundedness", "metric_version": 1.0, "metric_type": "numerical", "metric_allowed_values": []},
+    {"metric_name": "coherence", "metric_version": 1.0, "metric_type": "numerical", "metric_allowed_values": []},
+]
+
+evaluation_dataset = {
+    "app_id": 1,
+    "conversation_id": "convers_21",
+    "metadata_id": "a64e2503-43ed-4ea6-be2c-172c75cc6af2",
+    "turn_id": "1706898",
+    "query": "Show me some mobiles under 50k",
+    "query_time": 1706918596203,
+    "response": "Here are some mobiles for you, 1. Samsung galaxy A20G, 2. Oppo 20S 5G, 3. Oneplus 10  ",
+    "context": "NA",
+    "response_time": 1706918596203,
+    "metric_names": json.dumps(metric_names),
+    "evaluation_dataset_id": "eb6d7cc0-135d-409c-a209-eff8c10affb5",
+}
+
+
+class TestParseMultiMetricScore(unittest.TestCase):
+    """
+    Unit tests for parse_multi_metric_score.py.
+    """
+
+    def test_concat_results_valid_input(self):
+        """
+        Test that the function returns one result per metric for valid input.
+        """
+        evaluation_result = '{"scores": {"turn_relevance": 5, "groundedness": 3, "coherence": 4}}'
+        parse_score_result = concat_results(evaluation_dataset.copy(), evaluation_result)
+        self.assertEqual(len(parse_score_result), 3)
+        self.assertEqual([result["metric_name"] for result in parse_score_result],
+                         ["turn_relevance", "groundedness", "coherence"])
+        self.assertEqual([result["metric_value"] for result in parse_score_result], [5.0, 3.0, 4.0])
+        self.assertEqual([result["metric_raw_value"] for result in parse_score_result], ["5", "3", "4"])
+        for result in parse_score_result:
+            self.assertEqual(result["evaluation_dataset_id"], evaluation_dataset["evaluation_dataset_id"])
+            self.assertEqual(result["metric_type"], "numerical")
+            self.assertNotIn("metric_names", result)
+
+    def test_concat_results_missing_metric(self):
+        """
+        Test that a missing score only fails its own metric.
+        """
+        evaluation_result = 'Here are the scores: {"scores": {"turn_relevance": 5, "coherence": "four"}}'
+        with self.assertLogs(level="ERROR") as log_context:
+            parse_score_result = concat_results(evaluation_dataset.copy(), evaluation_result)
+
+        self.assertTrue(any("Parsing error of metric groundedness" in log for log in log_context.output))
+        self.assertTrue(any("Parsing error of metric coherence" in log for log in log_context.output))
+        self.assertEqual([result["metric_value"] for result in parse_score_result], [5.0, 0, 0])
+
+    def test_concat_results_invalid_input(self):
+        """
+        Test that the function returns 0 as final score of every metric for invalid input.
+        """
+        evaluation_result = "not a json object"
+        with self.assertLogs(level="ERROR") as log_context:
+            parse_score_result = concat_results(evaluation_dataset.copy(), evaluation_result)
+
+        self.assertTrue(any("Parsing error of the metric scores" in log for log in log_context.output))
+        self.assertEqual(len(parse_score_result), 3)
+        self.assertEqual([result["metric_value"] for result in parse_score_result], [0, 0, 0])
+        self.assertEqual(parse_score_result[0]["metric_raw_value"], evaluation_result)
+
+    def test_concat_results_categorical_metric(self):
+        """
+        Test that categorical metrics keep their allowed values.
+        """
+        dataset = evaluation_dataset.copy()
+        dataset["metric_names"] = json.dumps([
+            {"metric_name": "turn_relevance", "metric_version": 1.0, "metric_type": "numerical",
+             "metric_allowed_values": []},
+            {"metric_name": "tone", "metric_version": 1.0, "metric_type": "categorical",
+             "metric_allowed_values": ["polite", "neutral", "rude"]},
+        ])
+        parse_score_result = concat_results(dataset, '{"turn_relevance": 2, "tone": "polite"}')
+        self.assertEqual(parse_score_result[1]["metric_value"], "polite")
+        self.assertEqual(parse_score_result[1]["metric_type"], "categorical")
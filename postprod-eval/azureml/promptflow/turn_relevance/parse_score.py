@@ -11,13 +11,17 @@ from promptflow.core import tool
 
 
 @tool
-def concat_results(evaluation_dataset: dict, relevance_score: str):
+def concat_results(evaluation_dataset: dict, relevance_score: str, grading_cache_hit: bool = False,
+                   llm_call: dict = None):
     """Parse the results of the evaluation score for Turn Relevance.
 
     Args:
         evaluation_dataset (dict): The evaluation dataset.
         relevance_score (str): The evaluation result LLM provides, possibly
                                contains values from 1 to 5.
+        grading_cache_hit (bool): Whether the evaluation result comes from the grading cache.
+        llm_call (dict): The tokens, throttled and transient retries and times of the LLM call, None on a grading
+                         cache hit.
 
     Returns:
         evaluation_output (list): The parsed results of the evaluation score appended to the original evaluation dataset.
@@ -49,6 +53,10 @@ def concat_results(evaluation_dataset: dict, relevance_score: str):
     evaluation_dataset["metric_value"] = score_list[0].get("score", 0)
     evaluation_dataset["metric_raw_value"] = relevance_score
     evaluation_dataset["metric_type"] = "numerical"
+    evaluation_dataset["grading_cache_hit"] = grading_cache_hit
+    if llm_call:
+        for field in ["total_tokens", "throttled_retries", "transient_retries", "request_start", "request_end"]:
+            evaluation_dataset[f"llm_{field}"] = llm_call.get(field)
 
     # Format the evaluation output as a list of dictionaries
     # This is the standard format for all evaluation outputs
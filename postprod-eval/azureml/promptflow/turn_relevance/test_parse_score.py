@@ -58,3 +58,27 @@ class TestParseScore(unittest.TestCase):
         self.assertTrue(any(expected_log_message in log for log in log_context.output))
         self.assertEqual(parse_score_result[0]["metric_name"], "turn_relevance")
         self.assertEqual(parse_score_result[0]["metric_value"], 0)
+
+    def test_concat_results_grading_cache_hit(self):
+        """
+        Test that the output records whether the evaluation result comes from the grading cache.
+        """
+        parse_score_result = concat_results(evaluation_dataset.copy(), "4")
+        self.assertFalse(parse_score_result[0]["grading_cache_hit"])
+        parse_score_result = concat_results(evaluation_dataset.copy(), "4", grading_cache_hit=True)
+        self.assertTrue(parse_score_result[0]["grading_cache_hit"])
+        self.assertEqual(parse_score_result[0]["metric_value"], 4.0)
+
+    def test_concat_results_llm_call(self):
+        """
+        Test that the output records the tokens and times of the LLM call.
+        """
+        llm_call = {"output": "4", "total_tokens": 812, "throttled_retries": 1, "transient_retries": 2,
+                    "request_start": 1706918596.2, "request_end": 1706918597.5}
+        parse_score_result = concat_results(evaluation_dataset.copy(), "4", llm_call=llm_call)
+        self.assertEqual(parse_score_result[0]["llm_total_tokens"], 812)
+        self.assertEqual(parse_score_result[0]["llm_throttled_retries"], 1)
+        self.assertEqual(parse_score_result[0]["llm_transient_retries"], 2)
+        self.assertEqual(parse_score_result[0]["llm_request_end"], 1706918597.5)
+        parse_score_result = concat_results(evaluation_dataset.copy(), "4", grading_cache_hit=True)
+        self.assertNotIn("llm_total_tokens", parse_score_result[0])
@@ -0,0 +1,56 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+
+from promptflow.core import tool
+
+from context_window import DEFAULT_ENCODING_NAME, window_context
+
+
+@tool
+def parse_evaluation_data(evaluation_dataset: list, context_max_tokens: int = 1000, context_head_tokens: int = 100,
+                          encoding_name: str = DEFAULT_ENCODING_NAME):
+    """
+    Parse the prompt flow input and return the list of turns to grade with a single LLM call, with the context
+    of each turn fitted into a token budget.
+
+    Example of prompt flow input, with one item per turn:
+    [
+        {
+            "evaluation_dataset_id": "",
+            "app_id": "",
+            "conversation_id": "",
+            "metadata_id": "",
+            "turn_id": "",
+            "query": "",
+            "query_time": "",
+            "context": "",
+            "response": "",
+            "metric_names": ""
+        }
+    ]
+
+    :param evaluation_dataset: Input to prompt flow.
+    :param context_max_tokens: The token budget of the context of each turn, 0 to keep the contexts as is.
+    :param context_head_tokens: The tokens of the budget kept for the beginning of the conversation.
+    :param encoding_name: The tiktoken encoding of the model.
+    :return: List of dictionaries with the evaluation data fields of each turn, with the number of tokens of the
+        original context (context_tokens) and of the windowed context (windowed_context_tokens).
+    """
+    if len(evaluation_dataset) > 0:
+        turns = []
+        for item in evaluation_dataset:
+            window = window_context(item.get("context") or "", context_max_tokens, context_head_tokens,
+                                    encoding_name)
+            turn = dict(item)
+            if window["windowed_context_tokens"] < window["context_tokens"]:
+                logging.info("Windowed the context of turn %s from %s to %s tokens", item.get("turn_id"),
+                             window["context_tokens"], window["windowed_context_tokens"])
+                turn["context"] = window["context"]
+            turn["context_tokens"] = window["context_tokens"]
+            turn["windowed_context_tokens"] = window["windowed_context_tokens"]
+            turns.append(turn)
+        return turns
+    else:
+        raise ValueError("Evaluation data is empty")
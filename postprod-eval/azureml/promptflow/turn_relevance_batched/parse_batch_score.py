@@ -0,0 +1,87 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import re
+
+from promptflow.core import tool
+
+
+def load_scores(relevance_scores: str) -> dict:
+    """Load the scores returned by the LLM for a batch of items.
+
+    Args:
+        relevance_scores (str): The evaluation result LLM provides, a JSON object such as
+                                {"scores": [{"id": 1, "stars": 5}, {"id": 2, "stars": 3}]},
+                                possibly surrounded by other text.
+
+    Returns:
+        scores (dict): The raw score of each item id returned by the LLM.
+    """
+    try:
+        result = json.loads(relevance_scores)
+    except json.JSONDecodeError:
+        # Models sometimes wrap the JSON object in a code block or a sentence.
+        start, end = relevance_scores.find("{"), relevance_scores.rfind("}")
+        result = json.loads(relevance_scores[start:end + 1]) if 0 <= start < end else None
+    if isinstance(result, dict):
+        result = result.get("scores")
+    if not isinstance(result, list):
+        raise ValueError("No list of scores in the evaluation result")
+    scores = {}
+    for item in result:
+        if isinstance(item, dict) and "id" in item:
+            scores[str(item["id"])] = item.get("stars", item.get("score"))
+    return scores
+
+
+@tool
+def concat_results(evaluation_dataset: list, relevance_scores: str):
+    """Parse the results of the evaluation scores for Turn Relevance of a batch of turns.
+
+    Each score is mapped back to its turn by its id, the position of the turn in the batch starting at 1.
+    A missing or invalid score only fails its own turn, which gets a score of 0.
+
+    Args:
+        evaluation_dataset (list): The evaluation dataset of each turn of the batch.
+        relevance_scores (str): The evaluation result LLM provides, the scores from 1 to 5 of every turn.
+
+    Returns:
+        evaluation_output (list): The parsed results of the evaluation score appended to the evaluation dataset of
+                                  each turn.
+    """
+    try:
+        scores = load_scores(relevance_scores)
+    except Exception as e:
+        logging.error("Parsing error of the batch: %s", e)
+        scores = {}
+
+    evaluation_output = []
+    for index, item in enumerate(evaluation_dataset, start=1):
+        raw_score = scores.get(str(index))
+        try:
+            if raw_score is None:
+                raise ValueError(f"No score for item {index}")
+            score = str(raw_score)
+            match = re.search(r"\d", score)
+            if match:
+                score = match.group()
+            score = float(score)
+        except Exception as e:
+            logging.error("Parsing error of item %s: %s", index, e)
+            score = 0
+
+        evaluation_result = dict(item)
+        metrics = json.loads(evaluation_result.pop("metric_names"))
+        evaluation_result["metric_name"] = metrics[0]["metric_name"]
+        evaluation_result["metric_version"] = metrics[0]["metric_version"]
+        evaluation_result["metric_value"] = score
+        evaluation_result["metric_raw_value"] = str(raw_score) if raw_score is not None else relevance_scores
+        evaluation_result["metric_type"] = "numerical"
+        evaluation_output.append(evaluation_result)
+
+    # Format the evaluation output as a list of dictionaries, one per turn
+    # This is the standard format for all evaluation outputs
+    logging.info("Evaluation output: %s", evaluation_output)
+    return evaluation_output
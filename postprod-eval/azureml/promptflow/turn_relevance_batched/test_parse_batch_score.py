@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Unit tests for parse_batch_score.py."""
+import unittest
+
+from parse_batch_score import concat_results
+
+evaluation_dataset = [
+    {
+        "app_id": 1,
+        "conversation_id": "convers_21",
+        "metadata_id": "a64e2503-43ed-4ea6-be2c-172c75cc6af2",
+        "turn_id": "1706898",
+        "query": "Show me some mobiles under 50k",
+        "query_time": 1706918596203,
+        "response": "Here are some mobiles for you, 1. Samsung galaxy A20G, 2. Oppo 20S 5G, 3. Oneplus 10  ",
+        "context": "NA",
+        "response_time": 1706918596203,
+        "metric_names": '[{"metric_name": "turn_relevance", "metric_version": 1.0, "metric_allowed_values": []}]',
+        "evaluation_dataset_id": "eb6d7cc0-135d-409c-a209-eff8c10affb5",
+    },
+    {
+        "app_id": 1,
+        "conversation_id": "convers_23",
+        "metadata_id": "a64e2503-43ed-4ea6-be2c-172c75cc6af2",
+        "turn_id": "1706898",
+        "query": "Can you tell me who won the last world cup cricket?",
+        "query_time": 1706918596203,
+        "response": "I don't have answer for this, I am a Retails Bot",
+        "context": "NA",
+        "response_time": 1706918596213,
+        "metric_names": '[{"metric_name": "turn_relevance", "metric_version": 1.0, "metric_allowed_values": []}]',
+        "evaluation_dataset_id": "eb6d7cc0-6335-401c-a209-eff8c10affb5",
+    },
+]
+
+
+class TestParseBatchScore(unittest.TestCase):
+    """
+    Unit tests for parse_batch_score.py.
+    """
+
+    def test_concat_results_valid_input(self):
+        """
+        Test that each score is mapped back to its turn by id.
+        """
+        evaluation_result = '{"scores": [{"id": 2, "stars": 1}, {"id": 1, "stars": 5}]}'
+        parse_score_result = concat_results([item.copy() for item in evaluation_dataset], evaluation_result)
+        self.assertEqual(len(parse_score_result), 2)
+        self.assertEqual(parse_score_result[0]["evaluation_dataset_id"], evaluation_dataset[0]["evaluation_dataset_id"])
+        self.assertEqual(parse_score_result[0]["metric_name"], "turn_relevance")
+        self.assertEqual(parse_score_result[0]["metric_value"], 5.0)
+        self.assertEqual(parse_score_result[0]["metric_raw_value"], "5")
+        self.assertEqual(parse_score_result[1]["metric_value"], 1.0)
+        self.assertNotIn("metric_names", parse_score_result[1])
+
+    def test_concat_results_wrapped_json(self):
+        """
+        Test that a JSON object surrounded by other text is parsed.
+        """
+        evaluation_result = ('Here are the scores:\n```json\n'
+                             '{"scores": [{"id": 1, "stars": 4}, {"id": 2, "stars": "3 stars"}]}\n```')
+        parse_score_result = concat_results([item.copy() for item in evaluation_dataset], evaluation_result)
+        self.assertEqual(parse_score_result[0]["metric_value"], 4.0)
+        self.assertEqual(parse_score_result[1]["metric_value"], 3.0)
+
+    def test_concat_results_missing_item(self):
+        """
+        Test that a missing or invalid score only fails its own turn.
+        """
+        evaluation_result = '{"scores": [{"id": 1, "stars": 4}, {"id": 2, "stars": "not a number"}]}'
+        with self.assertLogs(level="ERROR") as log_context:
+            parse_score_result = concat_results([item.copy() for item in evaluation_dataset], evaluation_result)
+
+        self.assertTrue(any("Parsing error of item 2" in log for log in log_context.output))
+        self.assertEqual(parse_score_result[0]["metric_value"], 4.0)
+        self.assertEqual(parse_score_result[1]["metric_value"], 0)
+
+        with self.assertLogs(level="ERROR"):
+            parse_score_result = concat_results(
+                [item.copy() for item in evaluation_dataset], '{"scores": [{"id": 1, "stars": 2}]}'
+            )
+        self.assertEqual(parse_score_result[0]["metric_value"], 2.0)
+        self.assertEqual(parse_score_result[1]["metric_value"], 0)
+
+    def test_concat_results_invalid_input(self):
+        """
+        Test that every turn gets 0 as final score when the result cannot be parsed.
+        """
+        evaluation_result = "not a JSON object"
+        with self.assertLogs(level="ERROR") as log_context:
+            parse_score_result = concat_results([item.copy() for item in evaluation_dataset], evaluation_result)
+
+        self.assertTrue(any("Parsing error of the batch" in log for log in log_context.output))
+        self.assertEqual(len(parse_score_result), 2)
+        self.assertEqual([result["metric_value"] for result in parse_score_result], [0, 0])
+        self.assertEqual(parse_score_result[0]["metric_raw_value"], evaluation_result)
@@ -0,0 +1,18 @@
+-- Copyright (c) Microsoft Corporation.
+-- Licensed under the MIT License.
+
+Create table AGG_DAILY_EVALUATION_METRIC(
+metric_date DATE NOT NULL,
+metric_id INT FOREIGN KEY(metric_id) REFERENCES DIM_METRIC(metric_id) NOT NULL,
+metric_version Varchar(255) NOT NULL,
+app_name Varchar(255) NOT NULL,
+metadata_id Varchar(255) NOT NULL,
+metric_count INT NOT NULL,
+metric_sum FLOAT,
+metric_min FLOAT,
+metric_max FLOAT,
+metric_histogram Varchar(MAX),
+created_date DATETIME NOT NULL DEFAULT GETDATE(),
+updated_date DATETIME NOT NULL DEFAULT GETDATE(),
+updated_by VARCHAR(255) NOT NULL,
+PRIMARY KEY (metric_date, metric_id, app_name, metadata_id))
\ No newline at end of file
@@ -15,4 +15,5 @@ fact_creation_time DATETIME,
 created_date DATETIME NOT NULL DEFAULT GETDATE(),
 created_by VARCHAR(255) NOT NULL,
 updated_date DATETIME NOT NULL DEFAULT GETDATE(),
-updated_by VARCHAR(255) NOT NULL)
\ No newline at end of file
+updated_by VARCHAR(255) NOT NULL,
+app_name Varchar(255) NULL)
\ No newline at end of file
@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Benchmark the lookup of a conversation in the gold zone fact table, with the conversation index of
+ADLSHandler.read_conversation and with a filtered scan of the whole fact table.
+
+The fact table is written one day at a time with FACT_TABLE_LAYOUT, as the daily transformation runs do.
+
+Usage:
+    python conversation_lookup_benchmark.py --days 365 --rows_per_day 20000 --output_path /tmp/lookup_benchmark
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from llmevalgrader.common.adls_handler import FACT_TABLE_LAYOUT, ADLSHandler
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("conversation_lookup_benchmark")
+
+TURNS_PER_CONVERSATION = 10
+LOOKUPS = 20
+START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False, description="parse user arguments")
+    parser.add_argument("--days", type=int, default=365, help="Number of day partitions")
+    parser.add_argument("--rows_per_day", type=int, default=20000, help="Number of fact rows per day")
+    parser.add_argument("--output_path", type=str, default=None, help="Folder of the fact table")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def generate_fact_data(day: int, row_count: int) -> pd.DataFrame:
+    """
+    Generates the fact rows of a day, the conversation and llm rows of each turn interleaved.
+    """
+    day_start = START_DATE + timedelta(days=day)
+    seconds_per_row = 24 * 3600 / row_count
+    turns = [i // 2 for i in range(row_count)]
+    return pd.DataFrame({
+        "conversation_id": [f"day{day}-conversation-{turn // TURNS_PER_CONVERSATION}" for turn in turns],
+        "turn_id": [str(turn % TURNS_PER_CONVERSATION) for turn in turns],
+        "query": [f"What is the status of order {turn}?" for turn in turns],
+        "response": [f"Order {turn} has been shipped." for turn in turns],
+        "timestamp": [day_start + timedelta(seconds=i * seconds_per_row) for i in range(row_count)],
+        "app_type": pd.Categorical(["conversation" if i % 2 == 0 else "llm" for i in range(row_count)]),
+        "app_name": pd.Categorical(["sample-chatbot"] * row_count),
+        "metadata_id": [str(turn % 6) for turn in turns],
+    })
+
+
+def main():
+    args = parse_args()
+    fact_path = os.path.join(args.output_path or tempfile.mkdtemp(prefix="lookup_benchmark_"), "fact")
+    # The fact table is appended to, start from an empty folder.
+    shutil.rmtree(fact_path, ignore_errors=True)
+    adls_handler = ADLSHandler()
+    for day in range(args.days):
+        adls_handler.write_fact_table(fact_path, generate_fact_data(day, args.rows_per_day), layout=FACT_TABLE_LAYOUT)
+
+    conversations_per_day = args.rows_per_day // 2 // TURNS_PER_CONVERSATION
+    random.seed(0)
+    conversation_ids = [f"day{random.randrange(args.days)}-conversation-{random.randrange(conversations_per_day)}"
+                        for _ in range(LOOKUPS)]
+    index_seconds = []
+    scan_seconds = []
+    for conversation_id in conversation_ids:
+        start = time.perf_counter()
+        df_indexed = adls_handler.read_conversation(fact_path, conversation_id)
+        index_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        df_scanned = pd.read_parquet(fact_path, filters=[("conversation_id", "==", conversation_id)])
+        scan_seconds.append(time.perf_counter() - start)
+        if len(df_indexed) != len(df_scanned) or len(df_indexed) != 2 * TURNS_PER_CONVERSATION:
+            raise ValueError(f"Conversation {conversation_id}: {len(df_indexed)} indexed rows, "
+                             f"{len(df_scanned)} scanned rows")
+
+    index_ms = 1000 * sorted(index_seconds)[len(index_seconds) // 2]
+    scan_ms = 1000 * sorted(scan_seconds)[len(scan_seconds) // 2]
+    logger.info(f"{args.days} days of {args.rows_per_day} rows, median of {LOOKUPS} lookups: "
+                f"index {index_ms:.1f} ms, scan {scan_ms:.1f} ms, speedup {scan_ms / index_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
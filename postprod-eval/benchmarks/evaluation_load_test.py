@@ -0,0 +1,199 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Load test of the evaluation pipeline, prep_data, the turn_relevance flow and write_metrics, against the
+stand-in chat completions server of stub_aoai_server.py, without network access or Azure OpenAI quota.
+
+Synthetic conversations are prepared with the functions of the prep data component, the evaluation datasets
+are run through the flow with the prompt flow batch engine, with one worker process per concurrent line as in the
+deployed pipeline, and the flow outputs are read with the write metrics component, without writing to the
+database or to mlflow. The test reports the rows per second, the p50, p95 and p99 latencies of the LLM calls,
+retries included, and the throttled and transient retries.
+
+Usage:
+    python evaluation_load_test.py --rows 2000 --concurrency 16 --latency_median_ms 400 --throttle_rate 0.02
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.evaluation.conversation_context import build_context
+
+from stub_aoai_server import StubAzureOpenAIServer
+
+POSTPROD_EVAL_PATH = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(POSTPROD_EVAL_PATH / "azureml" / "pipeline" / "components" / "code"))
+import prep_data  # noqa: E402
+import write_metrics  # noqa: E402
+
+logger = get_logger("evaluation_load_test")
+
+FLOW_PATH = POSTPROD_EVAL_PATH / "azureml" / "promptflow" / "turn_relevance"
+CONNECTION_NAME = "azure_open_ai_connection"
+TURNS_PER_CONVERSATION = 5
+START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+METRIC_NAMES = [{"metric_name": "turn_relevance", "metric_version": 1.0, "metric_type": "numerical",
+                 "metric_allowed_values": []}]
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False, description="parse user arguments")
+    parser.add_argument("--rows", type=int, default=2000, help="Number of evaluated turns")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="Number of lines run at the same time, the worker processes of the batch engine")
+    parser.add_argument("--server_url", type=str, default=None,
+                        help="URL of a running stand-in server, one is started in process by default")
+    parser.add_argument("--latency_median_ms", type=float, default=400, help="Median latency of the server")
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="Sigma of the log-normal latency")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Rate of server error responses")
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Rate of throttled responses")
+    parser.add_argument("--server_tokens_per_minute", type=int, default=0,
+                        help="Tokens per minute of the stand-in deployment, 0 for no limit")
+    parser.add_argument("--rate_limit_tpm", type=int, default=0,
+                        help="Tokens per minute of the client-side rate controllers, split between the workers, "
+                             "0 for no limit")
+    parser.add_argument("--output_path", type=str, default=None, help="Folder of the prepped data and flow outputs")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def generate_evaluation_datasets(row_count: int) -> pd.DataFrame:
+    """
+    Generates the evaluation datasets of synthetic conversations, as the prep data component writes them.
+    """
+    turns = []
+    for i in range(row_count):
+        conversation, turn = divmod(i, TURNS_PER_CONVERSATION)
+        for app_type in ["conversation", "llm"]:
+            turns.append({
+                "conversation_id": f"conversation-{conversation}",
+                "turn_id": str(turn),
+                "query": f"What is the status of order {conversation}, and when will item {turn} arrive?",
+                "response": f"Order {conversation} has been shipped, item {turn} arrives in {turn + 2} days.",
+                "timestamp": START_DATE + timedelta(seconds=10 * i + (app_type == "llm")),
+                "app_type": app_type,
+                "app_name": "sample-chatbot",
+                "metadata_id": str(turn % 6),
+                "evaluation_dataset_id": f"{i:012d}-{app_type}",
+            })
+    fact_df = pd.DataFrame(turns)
+    eval_fact_df = fact_df[fact_df["app_type"] == "llm"].copy()
+    eval_fact_df["metric_names"] = json.dumps(METRIC_NAMES)
+    eval_fact_df = build_context(eval_fact_df, fact_df)
+    eval_fact_df["timestamp"] = eval_fact_df["timestamp"].astype(str)
+    eval_fact_df = prep_data.fill_missing_text_values(eval_fact_df)
+    return prep_data.format_dataframe_output(eval_fact_df)
+
+
+def stage_flow(flow_path: Path, staging_path: Path) -> Path:
+    """
+    Copies a flow with its additional includes into a folder, as prompt flow does before running it.
+
+    Returns:
+        Path: The flow file of the staged flow.
+    """
+    shutil.copytree(flow_path, staging_path, ignore=shutil.ignore_patterns("__pycache__", "test_*"))
+    flow_file = staging_path / "flow.dag.yaml"
+    flow = yaml.safe_load(flow_file.read_text())
+    for include in flow.pop("additional_includes", []):
+        shutil.copy(flow_path / include, staging_path)
+    flow_file.write_text(yaml.safe_dump(flow, sort_keys=False))
+    return flow_file
+
+
+def get_percentile(values: list, percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))] if values else 0.0
+
+
+def main():
+    args = parse_args()
+    output_path = Path(args.output_path or tempfile.mkdtemp(prefix="evaluation_load_test_"))
+    shutil.rmtree(output_path, ignore_errors=True)
+    for folder in ["prepped", "flow_outputs"]:
+        (output_path / folder).mkdir(parents=True)
+
+    server = None
+    server_url = args.server_url
+    if server_url is None:
+        server = StubAzureOpenAIServer(("127.0.0.1", 0), args.latency_median_ms, args.latency_sigma,
+                                       args.error_rate, args.throttle_rate, args.server_tokens_per_minute)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        server_url = f"http://127.0.0.1:{server.server_port}"
+
+    # Every turn is graded by the server, and each worker process gets its share of the rate limit, as the
+    # deployment sets it, see deploy_evaluation_pipeline.get_flow_environment_variables.
+    os.environ["LLMEVAL_GRADING_CACHE"] = "none"
+    os.environ["LLMEVAL_RATE_LIMIT_TPM"] = str(args.rate_limit_tpm / args.concurrency)
+
+    from promptflow.batch import BatchEngine
+
+    start = time.perf_counter()
+    evaluation_datasets = generate_evaluation_datasets(args.rows)
+    prep_data.write_filtered_parquet_to_evaluation_zone(evaluation_datasets, output_path / "prepped")
+    prep_seconds = time.perf_counter() - start
+
+    flow_file = stage_flow(FLOW_PATH, output_path / "flow")
+    batch_engine = BatchEngine(
+        flow_file,
+        flow_file.parent,
+        connections={CONNECTION_NAME: {"type": "AzureOpenAIConnection", "value": {
+            "api_base": server_url, "api_key": "stub", "api_type": "azure", "api_version": "2024-02-01"
+        }}},
+        worker_count=args.concurrency,
+    )
+    start = time.perf_counter()
+    batch_result = batch_engine.run(
+        input_dirs={"data": str(output_path / "prepped")},
+        inputs_mapping={"evaluation_dataset": "${data.evaluation_dataset}"},
+        output_dir=output_path / "batch_outputs",
+    )
+    flow_seconds = time.perf_counter() - start
+    shutil.copy(output_path / "batch_outputs" / "output.jsonl",
+                output_path / "flow_outputs" / "parallel_run_step.jsonl")
+
+    start = time.perf_counter()
+    # Only the flow outputs are read, write_metrics is not connected to the database, and its run metrics are
+    # collected rather than logged to mlflow.
+    run_metrics = {}
+    write_metrics.mlflow_log_metric = run_metrics.__setitem__
+    metrics_processor = write_metrics.MetricsProcessor.__new__(write_metrics.MetricsProcessor)
+    eval_metrics_raw_data = metrics_processor.read_metrics(output_path / "prepped", output_path / "flow_outputs")
+    read_seconds = time.perf_counter() - start
+
+    llm_calls = [row for row in eval_metrics_raw_data if row.get("llm_request_start") and row.get("llm_request_end")]
+    latencies = [row["llm_request_end"] - row["llm_request_start"] for row in llm_calls]
+    throttled_retries = sum(row.get("llm_throttled_retries") or 0 for row in llm_calls)
+    transient_retries = sum(row.get("llm_transient_retries") or 0 for row in llm_calls)
+    logger.info(f"prep_data {prep_seconds:.2f}s, flow {flow_seconds:.2f}s, write_metrics read {read_seconds:.2f}s")
+    logger.info(f"{batch_result.completed_lines} of {batch_result.total_lines} rows evaluated by "
+                f"{args.concurrency} workers: {batch_result.completed_lines / flow_seconds:.1f} rows/s, "
+                f"LLM call latency p50 {get_percentile(latencies, 50):.3f}s, p95 {get_percentile(latencies, 95):.3f}s, "
+                f"p99 {get_percentile(latencies, 99):.3f}s, {throttled_retries} throttled retries, "
+                f"{transient_retries} transient retries")
+    logger.info(f"write_metrics run metrics: {run_metrics}")
+    if server is not None:
+        logger.info(f"Server: {server.stats}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
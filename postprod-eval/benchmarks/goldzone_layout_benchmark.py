@@ -0,0 +1,163 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Benchmark the parquet layouts of the gold zone fact table: file size, write time and scan time.
+
+A synthetic fact table of several apps is written once per layout, one write per app as the transformation
+pipeline does, under the day partitions of ADLSHandler.write_fact_table. Each layout is then scanned with
+the filters of prep_data, app_name and app_type over the date range, and with a conversation lookup.
+
+Usage:
+    python goldzone_layout_benchmark.py --rows 1000000 --apps 4 --output_path /tmp/layout_benchmark
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from llmevalgrader.common.adls_handler import FACT_TABLE_LAYOUT, ADLSHandler
+from llmevalgrader.common.entities import ParquetLayout
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("goldzone_layout_benchmark")
+
+TURNS_PER_CONVERSATION = 5
+DAYS = 7
+SCAN_REPEATS = 3
+START_DATE = datetime(2024, 1, 1)
+DICTIONARY_COLUMNS = ["app_name", "app_type", "conversation_id", "turn_id", "metadata_id"]
+SORT_COLUMNS = ["app_name", "app_type", "conversation_id", "turn_id"]
+# None writes with the pandas defaults, as before the layouts.
+LAYOUTS = {
+    "default": None,
+    "sorted-snappy": ParquetLayout(sort_columns=SORT_COLUMNS),
+    "sorted-zstd-1": ParquetLayout(sort_columns=SORT_COLUMNS, compression="zstd", compression_level=1),
+    "sorted-zstd-3": ParquetLayout(sort_columns=SORT_COLUMNS, compression="zstd", compression_level=3),
+    "sorted-zstd-9": ParquetLayout(sort_columns=SORT_COLUMNS, compression="zstd", compression_level=9),
+    "sorted-zstd-3-rg-10k": ParquetLayout(sort_columns=SORT_COLUMNS, row_group_size=10000,
+                                          compression="zstd", compression_level=3),
+    "sorted-zstd-3-rg-100k-dict": ParquetLayout(sort_columns=SORT_COLUMNS, row_group_size=100000,
+                                                compression="zstd", compression_level=3,
+                                                dictionary_columns=DICTIONARY_COLUMNS),
+    "tuned": FACT_TABLE_LAYOUT,
+}
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False, description="parse user arguments")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of fact rows over all the apps")
+    parser.add_argument("--apps", type=int, default=4, help="Number of apps writing to the fact table")
+    parser.add_argument("--output_path", type=str, default=None, help="Folder of the fact tables")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def generate_fact_data(app_index: int, row_count: int) -> pd.DataFrame:
+    """
+    Generates the fact rows of an app in arrival order, the conversation and llm rows of each turn interleaved.
+
+    Args:
+        app_index (int): The index of the app.
+        row_count (int): Number of rows to generate.
+
+    Returns:
+        pd.DataFrame: The fact rows, with the columns of the gold zone fact table.
+    """
+    seconds_per_row = DAYS * 24 * 3600 / row_count
+    turns = [i // 2 for i in range(row_count)]
+    app_types = ["conversation" if i % 2 == 0 else "llm" for i in range(row_count)]
+    return pd.DataFrame({
+        "conversation_id": [f"app{app_index}-conversation-{turn // TURNS_PER_CONVERSATION}" for turn in turns],
+        "turn_id": [str(turn % TURNS_PER_CONVERSATION) for turn in turns],
+        "query": [f"What is the status of order {turn}?" for turn in turns],
+        "response": [f"Order {turn} has been shipped on day {turn % 28}." for turn in turns],
+        "context": [None if app_type == "conversation" else "User: hello\nBot: hi, how can I help?\n" * 3
+                    for app_type in app_types],
+        "timestamp": [START_DATE + timedelta(seconds=i * seconds_per_row) for i in range(row_count)],
+        "app_type": pd.Categorical(app_types),
+        "app_name": pd.Categorical([f"app-{app_index}"] * row_count),
+        "prompt_tokens": pd.array([None if app_type == "conversation" else 100 + turn % 50
+                                   for turn, app_type in zip(turns, app_types)], dtype="Int64"),
+        "metadata_id": [str(turn % 6) for turn in turns],
+        "evaluation_dataset_id": [f"{app_index}-{i:012d}" for i in range(row_count)],
+    })
+
+
+def get_folder_size_mb(path: str) -> float:
+    """
+    Returns the total size of the files under a folder in MB.
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, file_name)) for root, _, file_names in os.walk(path)
+        for file_name in file_names
+    ) / 1024 / 1024
+
+
+def measure_scan(fact_path: str, filters: list) -> tuple:
+    """
+    Reads the fact table of the benchmark period with filters, as prep_data does.
+
+    Returns:
+        tuple: The best elapsed time over SCAN_REPEATS reads in seconds and the number of rows read.
+    """
+    adls_handler = ADLSHandler()
+    elapsed = []
+    for _ in range(SCAN_REPEATS):
+        start = time.perf_counter()
+        df_fact = adls_handler.read_fact_table(
+            fact_path, START_DATE, START_DATE + timedelta(days=DAYS - 1), filters=filters
+        )
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed), len(df_fact)
+
+
+def main():
+    args = parse_args()
+    output_path = args.output_path or tempfile.mkdtemp(prefix="layout_benchmark_")
+    rows_per_app = args.rows // args.apps
+    fact_data = [generate_fact_data(app_index, rows_per_app) for app_index in range(args.apps)]
+    prep_data_filters = [("app_name", "==", "app-0"), ("app_type", "==", "llm")]
+    lookup_filters = [("app_name", "==", "app-0"), ("conversation_id", "==", f"app0-conversation-{rows_per_app // 20}")]
+
+    adls_handler = ADLSHandler()
+    results = {}
+    for layout_name, layout in LAYOUTS.items():
+        fact_path = os.path.join(output_path, layout_name)
+        # The fact table is appended to, start from an empty folder.
+        shutil.rmtree(fact_path, ignore_errors=True)
+        start = time.perf_counter()
+        for df_fact in fact_data:
+            adls_handler.write_fact_table(fact_path, df_fact.copy(), layout=layout)
+        write_seconds = time.perf_counter() - start
+        prep_data_seconds, prep_data_rows = measure_scan(fact_path, prep_data_filters)
+        lookup_seconds, lookup_rows = measure_scan(fact_path, lookup_filters)
+        results[layout_name] = {
+            "size_mb": get_folder_size_mb(fact_path),
+            "write_seconds": write_seconds,
+            "prep_data_seconds": prep_data_seconds,
+            "lookup_seconds": lookup_seconds,
+        }
+        logger.info(f"{layout_name}: {results[layout_name]['size_mb']:.1f} MB, write {write_seconds:.2f}s, "
+                    f"prep_data scan {prep_data_seconds:.3f}s ({prep_data_rows} rows), "
+                    f"conversation lookup {lookup_seconds:.3f}s ({lookup_rows} rows)")
+
+    baseline = results["default"]
+    for layout_name, result in results.items():
+        logger.info(f"{layout_name}: size ratio {result['size_mb'] / baseline['size_mb']:.2f}, "
+                    f"prep_data scan speedup {baseline['prep_data_seconds'] / result['prep_data_seconds']:.2f}x, "
+                    f"lookup speedup {baseline['lookup_seconds'] / result['lookup_seconds']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Benchmark FACT_EVALUATION_METRIC merge latency with and without the schema migrations.
+
+Seeds the embedded SQLite backend with a number of existing fact rows, then measures the latency of
+merging a batch of new rows before and after SchemaMigrator adds the unique index on the merge key.
+
+Usage:
+    python merge_latency_benchmark.py --existing_rows 10000000 --merge_rows 1000 --database_path /tmp/merge.db
+"""
+import argparse
+import datetime
+import time
+from uuid import uuid4
+
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.entities import FactEvaluationMetric
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.common.schema_migrations import SchemaMigrator
+from llmevalgrader.common.sql_dialect import SqliteDialect
+
+logger = get_logger("merge_latency_benchmark")
+
+SEED_BATCH_SIZE = 100000
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False, description="parse user arguments")
+    parser.add_argument("--existing_rows", type=int, default=10000000, help="Number of rows already in the table")
+    parser.add_argument("--merge_rows", type=int, default=1000, help="Number of rows merged per measurement")
+    parser.add_argument("--database_path", type=str, default=":memory:", help="SQLite database file")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def seed_fact_table(db_handler: DBHandler, row_count: int):
+    """
+    Inserts row_count synthetic rows into FACT_EVALUATION_METRIC with plain inserts.
+    """
+    query = "INSERT INTO FACT_EVALUATION_METRIC (metric_id, evaluation_dataset_id, metric_numeric_value, \
+             fact_creation_time, created_by, updated_by) VALUES (1, ?, ?, ?, 'benchmark', 'benchmark')"
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for offset in range(0, row_count, SEED_BATCH_SIZE):
+        batch = [(str(uuid4()), float(i % 5 + 1), now) for i in range(min(SEED_BATCH_SIZE, row_count - offset))]
+        db_handler.conn.executemany(query, batch)
+        db_handler.conn.commit()
+
+
+def measure_merge(db_handler: DBHandler, row_count: int) -> float:
+    """
+    Merges row_count new fact rows and returns the elapsed time in seconds.
+    """
+    now = datetime.datetime.now()
+    rows = [
+        FactEvaluationMetric(
+            metric_id=1,
+            evaluation_dataset_id=str(uuid4()),
+            conversation_id=None,
+            metadata_id=None,
+            evaluator_metadata=None,
+            metric_numeric_value=3.0,
+            metric_str_value=None,
+            metric_raw_value="3",
+            fact_creation_time=now.strftime("%Y-%m-%d %H:%M:%S"),
+            created_by="benchmark",
+            updated_by="benchmark",
+            updated_date=now,
+        )
+        for _ in range(row_count)
+    ]
+    start = time.perf_counter()
+    db_handler.upsert_into_table("FACT_EVALUATION_METRIC", rows, {"evaluation_dataset_id", "metric_id"}, True)
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    db_handler = DBHandler(key_vault_url=None, dialect=SqliteDialect(args.database_path))
+    db_handler.init_db_connection()
+    db_handler.execute_non_query(
+        "INSERT INTO DIM_METRIC (metric_name, metric_version, metric_type, evaluator_name, evaluator_type) \
+         VALUES ('turn_relevance', '1.0', 'numerical', 'turn_relevance', 'llm')"
+    )
+
+    logger.info(f"Seeding FACT_EVALUATION_METRIC with {args.existing_rows} rows...")
+    seed_fact_table(db_handler, args.existing_rows)
+
+    elapsed = measure_merge(db_handler, args.merge_rows)
+    logger.info(f"Without migrations: merged {args.merge_rows} rows in {elapsed:.3f}s "
+                f"({elapsed / args.merge_rows * 1000:.3f} ms/row)")
+
+    start = time.perf_counter()
+    SchemaMigrator(db_handler).apply(include=[4, 5])
+    logger.info(f"Migrations applied in {time.perf_counter() - start:.2f}s")
+
+    elapsed = measure_merge(db_handler, args.merge_rows)
+    logger.info(f"With migrations: merged {args.merge_rows} rows in {elapsed:.3f}s "
+                f"({elapsed / args.merge_rows * 1000:.3f} ms/row)")
+    db_handler.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Local stand-in of the Azure OpenAI chat completions API, to load test the evaluation flows without network
+access or Azure OpenAI quota.
+
+The server answers POST /openai/deployments/<deployment>/chat/completions with:
+    - a latency drawn from a log-normal distribution of a median and a sigma,
+    - a deterministic score from 1 to 5, a hash of the messages, so that runs can be compared,
+    - throttled (429) responses with a retry-after-ms header, injected at a rate and when the requests exceed
+      the tokens per minute of the deployment, counted as Azure OpenAI does with prompt tokens plus max_tokens,
+    - server errors (500), injected at a rate.
+
+Usage:
+    python stub_aoai_server.py --port 8000 --latency_median_ms 400 --latency_sigma 0.5 --throttle_rate 0.02
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("stub_aoai_server")
+
+CHARS_PER_TOKEN = 4
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False, description="parse user arguments")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host of the server")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the server")
+    parser.add_argument("--latency_median_ms", type=float, default=400, help="Median latency of a response")
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="Sigma of the log-normal latency")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Rate of server error responses")
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Rate of throttled responses")
+    parser.add_argument("--tokens_per_minute", type=int, default=0,
+                        help="Tokens per minute of the deployment, above which requests are throttled, 0 for no limit")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency and injected errors")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def get_score(messages: list) -> int:
+    """
+    Returns the deterministic score of a request, from 1 to 5.
+    """
+    content = json.dumps(messages, sort_keys=True).encode("utf-8")
+    return int(hashlib.sha256(content).hexdigest(), 16) % 5 + 1
+
+
+class StubAzureOpenAIServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server of the stand-in chat completions API, see the module docstring.
+
+    Args:
+        server_address (tuple): The host and port.
+        latency_median_ms (float): The median latency of a response.
+        latency_sigma (float): The sigma of the log-normal latency, 0 for a constant latency.
+        error_rate (float): The rate of server error responses.
+        throttle_rate (float): The rate of throttled responses.
+        tokens_per_minute (int): The tokens per minute above which requests are throttled, 0 for no limit.
+        seed (int): The seed of the latency and injected errors.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple, latency_median_ms: float = 400, latency_sigma: float = 0.5,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, tokens_per_minute: int = 0, seed: int = 0):
+        super().__init__(server_address, StubAzureOpenAIRequestHandler)
+        self.latency_median_ms = latency_median_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.tokens_per_minute = tokens_per_minute
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Tokens of the requests of the current minute window, as the rate limiter of Azure OpenAI counts them.
+        self.window_start = time.monotonic()
+        self.window_tokens = 0
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+    def draw_outcome(self, request_tokens: int) -> tuple:
+        """
+        Draws the outcome of a request.
+
+        Returns:
+            tuple: The status code, the latency in seconds and the retry-after delay in seconds of a throttled
+                request.
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            latency = self.latency_median_ms / 1000 * math.exp(self.latency_sigma * self.random.gauss(0, 1))
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start, self.window_tokens = now, 0
+            if self.tokens_per_minute > 0 and self.window_tokens + request_tokens > self.tokens_per_minute:
+                self.stats["throttled"] += 1
+                return 429, 0.01, self.window_start + 60 - now
+            if self.random.random() < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return 429, 0.01, 1.0
+            if self.random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 500, latency, None
+            self.window_tokens += request_tokens
+            return 200, latency, None
+
+
+class StubAzureOpenAIRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the chat completions requests of StubAzureOpenAIServer.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # The access log of every request would slow down the load test.
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict = None):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if "/chat/completions" not in self.path:
+            self.send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+        messages = request.get("messages", [])
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // CHARS_PER_TOKEN
+        status, latency, retry_after = self.server.draw_outcome(prompt_tokens + request.get("max_tokens", 0))
+        time.sleep(latency)
+        if status == 429:
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                           {"retry-after-ms": str(int(retry_after * 1000)), "retry-after": str(math.ceil(retry_after))})
+            return
+        if status != 200:
+            self.send_json(status, {"error": {"code": str(status), "message": "Injected server error"}})
+            return
+        score = str(get_score(messages))
+        self.send_json(200, {
+            "id": f"chatcmpl-stub-{self.server.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": score}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 1, "total_tokens": prompt_tokens + 1},
+        })
+
+
+def main():
+    args = parse_args()
+    server = StubAzureOpenAIServer(
+        (args.host, args.port), args.latency_median_ms, args.latency_sigma, args.error_rate, args.throttle_rate,
+        args.tokens_per_minute, args.seed,
+    )
+    logger.info(f"Serving the stand-in chat completions API on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Benchmark the pandas and Arrow transformation engines on synthetic Azure Monitor logs.
+
+Each engine runs in its own process, from the raw logs to the gold zone parquet files, so that the peak
+resident memory of the process can be compared. The gold zone tables written by both engines are then
+checked for equality, apart from the generated evaluation_dataset_id and metadata_id values.
+
+With --parse_workers, both engines are also run with the Properties parsed by that number of processes.
+
+Usage:
+    python transformation_engine_benchmark.py --rows 200000 --parse_workers 8 --output_path /tmp/engine_benchmark
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+from llmevalgrader.common.adls_handler import ADLSHandler
+from llmevalgrader.common.config_handler import get_transformer_info
+from llmevalgrader.common.entities import TransformationDTO
+from llmevalgrader.common.get_secret import SECRET_BACKEND_ENV_VAR, get_secret_env_var_name
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.transformation import arrow_engine
+from llmevalgrader.transformation.goldzone_prep import create_goldzone_tables
+from llmevalgrader.transformation.sampling import simple_sample
+from llmevalgrader.transformation.transform import DataTransformer
+
+logger = get_logger("transformation_engine_benchmark")
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "azureml", "pipeline", "config", "transformation_config.yml"
+)
+TURNS_PER_CONVERSATION = 5
+ARROW_CHUNK_SIZE = 10000
+MODELS = ["gpt-4", "gpt-35-turbo"]
+INTENTS = ["order_status", "returns", "greeting"]
+
+
+def parse_args():
+    """
+    Parses the user arguments.
+
+    Returns:
+        argparse.Namespace: The parsed user arguments.
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False, description="parse user arguments")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of log rows per mapping")
+    parser.add_argument("--output_path", type=str, default=None, help="Folder of the gold zone outputs")
+    parser.add_argument("--engine", type=str, default=None, choices=["pandas", "arrow"],
+                        help="Run a single engine in this process, used by the benchmark itself")
+    parser.add_argument("--parse_workers", type=int, default=0,
+                        help="Also run both engines with this number of Properties parsing processes")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def get_current_rss_mb() -> float:
+    """
+    Returns the current resident memory of the process in MB, read from /proc on Linux.
+    """
+    with open("/proc/self/status", "r") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def generate_llm_response(i: int, time_generated: datetime) -> str:
+    """
+    Generates the llm_response payload of a row. One row in 100 has no usage and one in 1000 is malformed.
+    """
+    if i % 1000 == 999:
+        return '{"choices": ['
+    payload = {
+        "id": f"chatcmpl-{i}",
+        "created": int(time_generated.timestamp()) - 2,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": f"Order {i} has been shipped."}}],
+    }
+    if i % 100 != 99:
+        payload["usage"] = {"prompt_tokens": 100 + i % 50, "completion_tokens": 10, "total_tokens": 110 + i % 50}
+    return json.dumps(payload)
+
+
+def generate_logs(mapping_name: str, row_count: int, first_row: int = 0) -> list:
+    """
+    Generates synthetic log rows for a mapping, as returned by Azure Monitor.
+
+    Args:
+        mapping_name (str): The Message of the rows, conversation_data or llm_data.
+        row_count (int): Number of rows to generate.
+        first_row (int): The index of the first row.
+
+    Returns:
+        list: The TimeGenerated, Message and Properties of each row.
+    """
+    start_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(first_row, first_row + row_count):
+        properties = {
+            "conversation_id": f"conversation-{i // TURNS_PER_CONVERSATION}",
+            "turn_id": str(i % TURNS_PER_CONVERSATION),
+            "query": f"What is the status of order {i}?",
+            "response": f"Order {i} has been shipped.",
+        }
+        if mapping_name == "llm_data":
+            properties.update({
+                "context": "User: hello\nBot: hi, how can I help?\n" * 3,
+                "model": MODELS[i % len(MODELS)],
+                "intent": INTENTS[(i // TURNS_PER_CONVERSATION) % len(INTENTS)],
+                "llm_response": generate_llm_response(i, start_time + timedelta(seconds=i)),
+            })
+        rows.append((start_time + timedelta(seconds=i), mapping_name, json.dumps(properties)))
+    return rows
+
+
+def get_run_name(engine: str, parse_workers: int) -> str:
+    """
+    Returns the name of a benchmark run, also the folder of its gold zone tables.
+    """
+    return f"{engine}-{parse_workers}-workers" if parse_workers > 1 else engine
+
+
+def run_engine(engine: str, row_count: int, output_path: str, parse_workers: int = 0):
+    """
+    Runs the transformation and gold zone preparation of one engine and writes the gold zone tables.
+
+    Args:
+        engine (str): pandas or arrow.
+        row_count (int): Number of log rows per mapping.
+        output_path (str): The folder of the gold zone tables.
+        parse_workers (int): Number of Properties parsing processes, 0 to parse in the process.
+    """
+    transformer_info = get_transformer_info(CONFIG_PATH)[0]
+    os.environ[SECRET_BACKEND_ENV_VAR] = "env"
+    os.environ[get_secret_env_var_name(transformer_info.data_source.workspace_id_secret_key)] = "benchmark"
+    transformer_class = arrow_engine.ArrowDataTransformer if engine == "arrow" else DataTransformer
+    transformer = transformer_class(
+        start_date=datetime(2024, 1, 1),
+        end_date=datetime(2024, 2, 1),
+        key_vault_url="https://benchmark.vault.azure.net/",
+        data_source=transformer_info.data_source,
+        mappings=transformer_info.mapping_list,
+        chatbot_name=transformer_info.chatbot_name,
+        parse_workers=parse_workers,
+    )
+    transformation_dtos = []
+    columns = ["TimeGenerated", "Message", "Properties"]
+    for mapping in transformer_info.mapping_list.mappings:
+        if engine == "arrow":
+            # Build the table in chunks, as the rows of each query slice are converted in get_logs_by_time_range.
+            chunks = []
+            for chunk_start in range(0, row_count, ARROW_CHUNK_SIZE):
+                rows = generate_logs(mapping.name, min(ARROW_CHUNK_SIZE, row_count - chunk_start), chunk_start)
+                chunks.append(pa.table({column: pa.array([row[index] for row in rows])
+                                        for index, column in enumerate(columns)}))
+            data = pa.concat_tables(chunks)
+        else:
+            data = pd.DataFrame(generate_logs(mapping.name, row_count), columns=columns)
+        transformation_dtos.append(TransformationDTO(name=mapping.name, mapping=mapping, data=data))
+    input_rss_mb = get_current_rss_mb()
+
+    start = time.perf_counter()
+    transformation_dtos = transformer.transform_data(transformation_dtos)
+    transformation_dtos = transformer.clean_data(transformation_dtos)
+    transformation_dtos = transformer.add_optional_extra_columns(
+        transformation_dtos, "app_name", transformer_info.chatbot_name
+    )
+    concat_data = transformer.concat_data(transformation_dtos)
+    concat_data = transformer.fill_missing_values(concat_data)
+    del transformation_dtos
+    if engine == "arrow":
+        sampled_data = arrow_engine.simple_sample(concat_data)
+        fact_data, metadata, conversation = arrow_engine.create_goldzone_tables(sampled_data, None, None, None)
+    else:
+        sampled_data = simple_sample(concat_data)
+        fact_data, metadata, conversation = create_goldzone_tables(
+            sampled_data, pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        )
+    adls_handler = ADLSHandler()
+    adls_handler.write_fact_table(os.path.join(output_path, "fact"), fact_data)
+    adls_handler.write_dim_table(output_path, "dim_metadata.parquet", metadata)
+    adls_handler.write_dim_table(output_path, "dim_conversation.parquet", conversation)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"engine": engine, "parse_workers": parse_workers, "seconds": elapsed, "input_rss_mb": input_rss_mb, "peak_rss_mb": peak_rss_mb}))
+
+
+def read_goldzone_tables(output_path: str) -> tuple:
+    """
+    Reads the gold zone tables written by an engine, with metadata_id replaced by its model and intent.
+
+    Args:
+        output_path (str): The folder of the gold zone tables.
+
+    Returns:
+        tuple: The fact, metadata and conversation DataFrames.
+    """
+    adls_handler = ADLSHandler()
+    fact_data = pd.read_parquet(os.path.join(output_path, "fact"))
+    metadata = adls_handler.read_dim_table(output_path, "dim_metadata.parquet")
+    conversation = adls_handler.read_dim_table(output_path, "dim_conversation.parquet")
+    metadata_keys = metadata.set_index("metadata_id")
+    fact_data["model"] = fact_data["metadata_id"].map(metadata_keys["model"]).astype(str)
+    fact_data["intent"] = fact_data["metadata_id"].map(metadata_keys["intent"]).astype(str)
+    fact_data = fact_data.drop(columns=["metadata_id", "evaluation_dataset_id"])
+    fact_data = fact_data.astype({column: str for column in ["app_name", "app_type", "year", "month", "day"]})
+    fact_data = fact_data.sort_values(["conversation_id", "turn_id", "app_type"]).reset_index(drop=True)
+    metadata = metadata.drop(columns=["metadata_id"]).astype(str).reset_index(drop=True)
+    return fact_data, metadata, conversation.reset_index(drop=True)
+
+
+def main():
+    args = parse_args()
+    output_path = args.output_path or tempfile.mkdtemp(prefix="engine_benchmark_")
+    if args.engine is not None:
+        run_name = get_run_name(args.engine, args.parse_workers)
+        # The fact table is appended to, start from an empty folder.
+        shutil.rmtree(os.path.join(output_path, run_name), ignore_errors=True)
+        run_engine(args.engine, args.rows, os.path.join(output_path, run_name), args.parse_workers)
+        return
+
+    runs = [("pandas", 0), ("arrow", 0)]
+    if args.parse_workers > 1:
+        runs += [("pandas", args.parse_workers), ("arrow", args.parse_workers)]
+    results = {}
+    for engine, parse_workers in runs:
+        run_name = get_run_name(engine, parse_workers)
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--engine", engine, "--rows", str(args.rows),
+             "--output_path", output_path, "--parse_workers", str(parse_workers)],
+            check=True, capture_output=True, text=True,
+        )
+        results[run_name] = json.loads(process.stdout.strip().splitlines()[-1])
+        logger.info(f"{run_name}: {results[run_name]['seconds']:.2f}s, RSS with the input logs "
+                    f"{results[run_name]['input_rss_mb']:.0f} MB, peak RSS {results[run_name]['peak_rss_mb']:.0f} MB")
+
+    baseline = results["pandas"]
+    baseline_tables = read_goldzone_tables(os.path.join(output_path, "pandas"))
+    for run_name, result in results.items():
+        for baseline_table, table in zip(baseline_tables, read_goldzone_tables(os.path.join(output_path, run_name))):
+            pd.testing.assert_frame_equal(baseline_table, table, check_dtype=False, check_categorical=False)
+        logger.info(f"{run_name}: gold zone tables equal to pandas, "
+                    f"speedup {baseline['seconds'] / result['seconds']:.2f}x, "
+                    f"peak RSS ratio {result['peak_rss_mb'] / baseline['peak_rss_mb']:.2f}, "
+                    f"peak RSS over the input ratio {(result['peak_rss_mb'] - result['input_rss_mb']) / (baseline['peak_rss_mb'] - baseline['input_rss_mb']):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,42 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import os
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Union
 from glob import glob
+from uuid import uuid4
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from llmevalgrader.common.entities import ParquetLayout
 from llmevalgrader.common.logger import get_logger
 
 logger = get_logger("adls_handler")
 
+# Layout of the gold zone fact files: rows sorted by conversation within each day partition, so that
+# the app_name statistics of the row groups skip other apps and the turns of a conversation are contiguous.
+FACT_TABLE_LAYOUT = ParquetLayout(
+    sort_columns=["app_name", "app_type", "conversation_id", "turn_id"],
+    row_group_size=100000,
+    compression="zstd",
+    compression_level=3,
+    dictionary_columns=["app_name", "app_type", "conversation_id", "turn_id", "metadata_id"],
+)
+# The conversation index is stored under the fact table, in a folder ignored by the parquet dataset readers.
+CONVERSATION_INDEX_FOLDER = "_index"
+CONVERSATION_INDEX_SCHEMA = pa.schema([
+    ("conversation_id", pa.string()),
+    ("file", pa.string()),
+    ("row_group", pa.int32()),
+])
+# Row groups of the index files, small enough for a lookup to read a single one.
+CONVERSATION_INDEX_ROW_GROUP_SIZE = 10000
+# The index parts written by write_fact_table are merged into a single file beyond this number.
+MAX_CONVERSATION_INDEX_PARTS = 16
+
 class ADLSHandler:
     """
     A class that provides methods for handling Azure Data Lake Storage operations.
@@ -21,14 +48,35 @@ class ADLSHandler:
         read_dim_table(dim_output_path: str, dim_file_name: str) -> pd.DataFrame:
             Read a dimension table from the specified path.
 
-        read_fact_table(fact_output_path: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        read_fact_table(fact_output_path: str, start_date: datetime, end_date: datetime, filters: list) -> pd.DataFrame:
             Read the fact table from the specified output path within the specified date range.
 
+        read_dim_arrow_table(dim_output_path: str, dim_file_name: str) -> pa.Table:
+            Read a dimension table from the specified path as an Arrow table.
+
+        read_fact_arrow_table(fact_output_path: str, start_date: datetime, end_date: datetime, filters: list) -> pa.Table:
+            Read the fact table within the specified date range as an Arrow table.
+
         write_dim_table(dim_output_path: str, dim_file_name: str, df_dim_table: pd.DataFrame) -> None:
             Write the dimension table to the specified output path.
 
-        write_fact_table(fact_output_path: str, df_fact_table: pd.DataFrame) -> None:
-            Write the fact table to the specified output path in Parquet format.
+        write_fact_table(fact_output_path: str, df_fact_table: pd.DataFrame, layout: ParquetLayout) -> None:
+            Write the fact table to the specified output path in Parquet format, with an optional file layout.
+
+        build_conversation_index(fact_output_path: str) -> None:
+            Rebuild the conversation index from all the files of the fact table.
+
+        compact_conversation_index(fact_output_path: str) -> None:
+            Merge the parts of the conversation index into a single file.
+
+        read_conversation(fact_output_path: str, conversation_id: str) -> pd.DataFrame:
+            Read the rows of a conversation with the conversation index.
+
+        write_fact_archive(archive_output_path: str, df_archive: pd.DataFrame, time_column: str, batch_index: int) -> None:
+            Write a batch of archived rows to the specified output path, partitioned by year and month.
+
+        read_fact_archive(archive_output_path: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+            Read the archived rows of the months within the specified date range.
     """
 
     def __init__(self):
@@ -83,7 +131,7 @@ class ADLSHandler:
         return df_dim_table
 
     def read_fact_table(self, fact_output_path: str, start_date: datetime,
-                        end_date: datetime) -> pd.DataFrame:
+                        end_date: datetime, filters: list = None) -> pd.DataFrame:
         """
         Read the fact table from the specified output path within the specified date range.
 
@@ -91,6 +139,9 @@ class ADLSHandler:
             fact_output_path (str): The output path where the fact table is located.
             start_date (datetime): The start date of the evaluation period.
             end_date (datetime): The end date of the evaluation period.
+            filters (list, optional): Row filters in the pyarrow format, e.g. [("app_name", "==", "sample-chatbot")].
+                They are checked against the row group statistics, so that row groups without matching rows
+                are not read.
 
         Returns:
             pd.DataFrame: The fact table.
@@ -100,12 +151,55 @@ class ADLSHandler:
             if len(valid_paths) == 0:
                 logger.error(f"No data files found for fact table for date range {start_date} to {end_date}")
                 raise FileNotFoundError(f"No data files found for fact table for date range {start_date} to {end_date}")
-            df_fact_table = pd.concat([pd.read_parquet(f) for f in valid_paths])
+            df_fact_table = pd.concat([pd.read_parquet(f, filters=filters) for f in valid_paths])
             return df_fact_table
         except Exception as e:
             logger.error(f"Failed to read fact table from {fact_output_path}: {e}")
             raise e
 
+    def read_dim_arrow_table(self, dim_output_path: str, dim_file_name: str) -> pa.Table:
+        """
+        Read a dimension table from the specified path as an Arrow table.
+
+        Parameters:
+            dim_output_path (str): The path to the dimension table.
+            dim_file_name (str): The name of the dimension table file.
+
+        Returns:
+            pa.Table: The dimension table.
+        """
+        try:
+            return pq.read_table(f"{dim_output_path}/{dim_file_name}")
+        except Exception as e:
+            logger.error(f"Failed to read dim table file {dim_file_name} from {dim_output_path}: {e}")
+            raise e
+
+    def read_fact_arrow_table(self, fact_output_path: str, start_date: datetime, end_date: datetime,
+                              filters: list = None) -> pa.Table:
+        """
+        Read the fact table from the specified output path within the specified date range as an Arrow table.
+
+        Parameters:
+            fact_output_path (str): The output path where the fact table is located.
+            start_date (datetime): The start date of the evaluation period.
+            end_date (datetime): The end date of the evaluation period.
+            filters (list, optional): Row filters in the pyarrow format, see read_fact_table.
+
+        Returns:
+            pa.Table: The fact table.
+        """
+        try:
+            valid_paths = self.get_eval_fact_partition_paths(fact_output_path, start_date, end_date)
+            if len(valid_paths) == 0:
+                logger.error(f"No data files found for fact table for date range {start_date} to {end_date}")
+                raise FileNotFoundError(f"No data files found for fact table for date range {start_date} to {end_date}")
+            return pa.concat_tables(
+                [pq.read_table(f, filters=filters) for f in valid_paths], promote_options="permissive"
+            )
+        except Exception as e:
+            logger.error(f"Failed to read fact table from {fact_output_path}: {e}")
+            raise e
+
     def read_task_tracker_fact_table(self, task_tracker_fact_path: str, batch_id: str) -> pd.DataFrame:
         """
         Read the fact table from the specified output path within the specified date range.
@@ -128,40 +222,310 @@ class ADLSHandler:
             logger.error(f"Failed to read fact table from {task_tracker_fact_path}: {e}")
             raise e
 
-    def write_dim_table(self, dim_output_path: str, dim_file_name: str, df_dim_table: pd.DataFrame, ) -> None:
+    def write_dim_table(self, dim_output_path: str, dim_file_name: str,
+                        df_dim_table: Union[pd.DataFrame, pa.Table], ) -> None:
         """
         Write the dimension table to the specified output path.
 
         Parameters:
             dim_output_path (str): The output path where the dimension table will be written.
             dim_file_name (str): The name of the dimension table file.
-            df_dim_table (pd.DataFrame): The dimension table DataFrame to be written.
+            df_dim_table (Union[pd.DataFrame, pa.Table]): The dimension table DataFrame or Arrow table to be written.
 
         Returns:
             None
         """
         try:
+            if isinstance(df_dim_table, pa.Table):
+                pq.write_table(df_dim_table, f"{dim_output_path}/{dim_file_name}")
+                return
             df_dim_table.to_parquet(f"{dim_output_path}/{dim_file_name}", index=False)
         except Exception as e:
             logger.error(f"Failed to write dim table file {dim_file_name} to {dim_output_path}: {e}")
             raise e
 
-    def write_fact_table(self, fact_output_path: str, df_fact_table: pd.DataFrame) -> None:
+    def write_fact_table(self, fact_output_path: str, df_fact_table: Union[pd.DataFrame, pa.Table],
+                         layout: ParquetLayout = None) -> None:
         """
-        Write the fact table to the specified output path in Parquet format.
+        Write the fact table to the specified output path in Parquet format, and add the written files to the
+        conversation index of the fact table. The index is built from all the fact files when it does not exist.
 
         Parameters:
             fact_output_path (str): The output path where the fact table will be written.
-            df_fact_table (pd.DataFrame): The fact table DataFrame to be written.
+            df_fact_table (Union[pd.DataFrame, pa.Table]): The fact table DataFrame or Arrow table to be written.
+            layout (ParquetLayout, optional): The layout of the files, e.g. FACT_TABLE_LAYOUT. The rows are sorted
+                by the layout's sort columns before being split into the day partitions, so that they are sorted
+                within each partition. Defaults to the layout of the parquet writer.
 
         Returns:
             None
         """
+        written_paths = []
+
+        def file_visitor(written_file):
+            written_paths.append(written_file.path)
+
         try:
-            df_fact_table["year"] = df_fact_table["timestamp"].dt.year
-            df_fact_table["month"] = df_fact_table["timestamp"].dt.month
-            df_fact_table["day"] = df_fact_table["timestamp"].dt.day
-            df_fact_table.to_parquet(f"{fact_output_path}", partition_cols=["year", "month", "day"], index=False)
+            if isinstance(df_fact_table, pa.Table):
+                timestamps = df_fact_table["timestamp"]
+                df_fact_table = df_fact_table.append_column("year", pc.year(timestamps)) \
+                    .append_column("month", pc.month(timestamps)) \
+                    .append_column("day", pc.day(timestamps))
+                if layout is None:
+                    pq.write_to_dataset(df_fact_table, f"{fact_output_path}", partition_cols=["year", "month", "day"],
+                                        file_visitor=file_visitor)
+            else:
+                df_fact_table["year"] = df_fact_table["timestamp"].dt.year
+                df_fact_table["month"] = df_fact_table["timestamp"].dt.month
+                df_fact_table["day"] = df_fact_table["timestamp"].dt.day
+                if layout is None:
+                    df_fact_table.to_parquet(f"{fact_output_path}", partition_cols=["year", "month", "day"], index=False,
+                                             file_visitor=file_visitor)
+                else:
+                    df_fact_table = pa.Table.from_pandas(df_fact_table, preserve_index=False)
+            if layout is not None:
+                self._write_fact_table_with_layout(fact_output_path, df_fact_table, layout, file_visitor)
         except Exception as e:
             logger.error(f"Failed to write fact table to {fact_output_path}: {e}")
             raise e
+        if not os.path.isdir(os.path.join(fact_output_path, CONVERSATION_INDEX_FOLDER)):
+            self.build_conversation_index(fact_output_path)
+        else:
+            self._write_conversation_index_part(fact_output_path, written_paths)
+
+    def _write_fact_table_with_layout(self, fact_output_path: str, df_fact_table: pa.Table, layout: ParquetLayout,
+                                      file_visitor) -> None:
+        """
+        Write the fact table, with its day partition columns, in the given layout.
+        """
+        sort_columns = [column for column in layout.sort_columns if column in df_fact_table.column_names]
+        if sort_columns:
+            # Dictionary columns cannot be sorted by Arrow, they are sorted by their decoded values.
+            sort_keys = pa.table({
+                column: df_fact_table[column].cast(df_fact_table[column].type.value_type)
+                if pa.types.is_dictionary(df_fact_table[column].type) else df_fact_table[column]
+                for column in sort_columns
+            })
+            df_fact_table = df_fact_table.take(
+                pc.sort_indices(sort_keys, sort_keys=[(column, "ascending") for column in sort_columns])
+            )
+        logger.info(f"Writing {df_fact_table.num_rows} fact rows with layout {layout.to_dict()}")
+        pq.write_to_dataset(
+            df_fact_table,
+            f"{fact_output_path}",
+            partition_cols=["year", "month", "day"],
+            preserve_order=True,
+            file_visitor=file_visitor,
+            **layout.to_write_options(),
+        )
+
+    def _get_conversation_index_entries(self, fact_output_path: str, file_paths: List[str]) -> pa.Table:
+        """
+        Get the conversation index entries of fact files: the conversations of each row group of each file.
+
+        Parameters:
+            fact_output_path (str): The path of the fact table.
+            file_paths (List[str]): The paths of the fact files.
+
+        Returns:
+            pa.Table: The entries, with the paths of the files relative to the fact table, sorted by conversation_id.
+        """
+        entries = []
+        for file_path in file_paths:
+            parquet_file = pq.ParquetFile(file_path)
+            relative_path = os.path.relpath(file_path, fact_output_path)
+            for row_group in range(parquet_file.num_row_groups):
+                conversation_ids = parquet_file.read_row_group(row_group, columns=["conversation_id"])["conversation_id"]
+                if pa.types.is_dictionary(conversation_ids.type):
+                    conversation_ids = conversation_ids.cast(conversation_ids.type.value_type)
+                conversation_ids = pc.unique(conversation_ids.cast(pa.string())).drop_null()
+                entries.append(pa.table({
+                    "conversation_id": conversation_ids,
+                    "file": pa.repeat(pa.scalar(relative_path), len(conversation_ids)),
+                    "row_group": pa.repeat(pa.scalar(row_group, pa.int32()), len(conversation_ids)),
+                }, schema=CONVERSATION_INDEX_SCHEMA))
+        if len(entries) == 0:
+            return CONVERSATION_INDEX_SCHEMA.empty_table()
+        return pa.concat_tables(entries).sort_by([("conversation_id", "ascending")])
+
+    def _write_conversation_index_file(self, fact_output_path: str, entries: pa.Table, prefix: str) -> str:
+        """
+        Write conversation index entries to a new file of the index folder and return its path.
+        """
+        index_path = os.path.join(fact_output_path, CONVERSATION_INDEX_FOLDER)
+        os.makedirs(index_path, exist_ok=True)
+        file_path = os.path.join(index_path, f"{prefix}-{uuid4().hex}.parquet")
+        pq.write_table(entries, file_path, row_group_size=CONVERSATION_INDEX_ROW_GROUP_SIZE, compression="zstd")
+        return file_path
+
+    def _write_conversation_index_part(self, fact_output_path: str, file_paths: List[str]) -> None:
+        """
+        Add the entries of newly written fact files to the conversation index, as a new index part.
+        """
+        try:
+            entries = self._get_conversation_index_entries(fact_output_path, file_paths)
+            self._write_conversation_index_file(fact_output_path, entries, "part")
+            logger.info(f"Indexed {entries.num_rows} conversation row groups of {len(file_paths)} fact files")
+        except Exception as e:
+            logger.error(f"Failed to update the conversation index of {fact_output_path}: {e}")
+            raise e
+        if len(glob(os.path.join(fact_output_path, CONVERSATION_INDEX_FOLDER, "*.parquet"))) > MAX_CONVERSATION_INDEX_PARTS:
+            self.compact_conversation_index(fact_output_path)
+
+    def _replace_conversation_index(self, fact_output_path: str, entries: pa.Table, replaced_paths: List[str]) -> None:
+        """
+        Write the entries as a single index file, then remove the replaced index files.
+        """
+        self._write_conversation_index_file(fact_output_path, entries, "compacted")
+        for replaced_path in replaced_paths:
+            os.remove(replaced_path)
+
+    def build_conversation_index(self, fact_output_path: str) -> None:
+        """
+        Rebuild the conversation index from all the files of the fact table, e.g. for a fact table written
+        before the index existed.
+
+        Parameters:
+            fact_output_path (str): The path of the fact table.
+
+        Returns:
+            None
+        """
+        try:
+            replaced_paths = glob(os.path.join(fact_output_path, CONVERSATION_INDEX_FOLDER, "*.parquet"))
+            file_paths = glob(os.path.join(fact_output_path, "year=*", "month=*", "day=*", "*.parquet"))
+            entries = self._get_conversation_index_entries(fact_output_path, file_paths)
+            self._replace_conversation_index(fact_output_path, entries, replaced_paths)
+            logger.info(f"Built the conversation index of {len(file_paths)} fact files with {entries.num_rows} entries")
+        except Exception as e:
+            logger.error(f"Failed to build the conversation index of {fact_output_path}: {e}")
+            raise e
+
+    def compact_conversation_index(self, fact_output_path: str) -> None:
+        """
+        Merge the parts of the conversation index into a single file sorted by conversation_id, so that a lookup
+        reads a single row group of a single index file. Entries of fact files that no longer exist are dropped.
+
+        Parameters:
+            fact_output_path (str): The path of the fact table.
+
+        Returns:
+            None
+        """
+        try:
+            replaced_paths = glob(os.path.join(fact_output_path, CONVERSATION_INDEX_FOLDER, "*.parquet"))
+            entries = pa.concat_tables(
+                [pq.read_table(replaced_path, schema=CONVERSATION_INDEX_SCHEMA) for replaced_path in replaced_paths]
+            )
+            existing_files = [file for file in pc.unique(entries["file"]).to_pylist()
+                              if os.path.exists(os.path.join(fact_output_path, file))]
+            entries = entries.filter(pc.is_in(entries["file"], pa.array(existing_files, pa.string()))) \
+                .sort_by([("conversation_id", "ascending")])
+            self._replace_conversation_index(fact_output_path, entries, replaced_paths)
+            logger.info(f"Compacted {len(replaced_paths)} conversation index files into {entries.num_rows} entries")
+        except Exception as e:
+            logger.error(f"Failed to compact the conversation index of {fact_output_path}: {e}")
+            raise e
+
+    def read_conversation(self, fact_output_path: str, conversation_id: str) -> pd.DataFrame:
+        """
+        Read the rows of a conversation, in time order. Only the row groups of the fact files listed for the
+        conversation in the conversation index are read. Without an index, the whole fact table is scanned.
+
+        Parameters:
+            fact_output_path (str): The path of the fact table.
+            conversation_id (str): The ID of the conversation.
+
+        Returns:
+            pd.DataFrame: The rows of the conversation, of every app type.
+        """
+        try:
+            index_paths = glob(os.path.join(fact_output_path, CONVERSATION_INDEX_FOLDER, "*.parquet"))
+            if len(index_paths) == 0:
+                logger.warning(f"No conversation index in {fact_output_path}, scanning the fact table")
+                return pd.read_parquet(fact_output_path, filters=[("conversation_id", "==", conversation_id)]) \
+                    .sort_values("timestamp").reset_index(drop=True)
+            # The statistics of the index files skip the row groups without the conversation.
+            entries = pq.read_table(index_paths, schema=CONVERSATION_INDEX_SCHEMA,
+                                    filters=[("conversation_id", "==", conversation_id)])
+            row_groups = {}
+            for file, row_group in zip(entries["file"].to_pylist(), entries["row_group"].to_pylist()):
+                row_groups.setdefault(file, set()).add(row_group)
+            tables = []
+            for file, file_row_groups in row_groups.items():
+                file_path = os.path.join(fact_output_path, file)
+                if not os.path.exists(file_path):
+                    logger.warning(f"Fact file {file} of the conversation index no longer exists")
+                    continue
+                table = pq.ParquetFile(file_path).read_row_groups(sorted(file_row_groups))
+                conversation_ids = table["conversation_id"]
+                if pa.types.is_dictionary(conversation_ids.type):
+                    conversation_ids = conversation_ids.cast(conversation_ids.type.value_type)
+                tables.append(table.filter(pc.equal(conversation_ids.cast(pa.string()), conversation_id)))
+            logger.info(f"Read {sum(table.num_rows for table in tables)} rows of conversation {conversation_id} "
+                        f"from {len(tables)} fact files")
+            if len(tables) == 0:
+                return pd.DataFrame()
+            return pa.concat_tables(tables, promote_options="permissive").to_pandas() \
+                .sort_values("timestamp").reset_index(drop=True)
+        except Exception as e:
+            logger.error(f"Failed to read conversation {conversation_id} from {fact_output_path}: {e}")
+            raise e
+
+    def write_fact_archive(self, archive_output_path: str, df_archive: pd.DataFrame, time_column: str,
+                           batch_index: int = 0) -> None:
+        """
+        Write a batch of archived rows to the specified output path in Parquet format, partitioned by year and month.
+
+        File names are derived from the batch index, so that archiving the same month again overwrites
+        the files written by a previous attempt instead of duplicating the rows.
+
+        Parameters:
+            archive_output_path (str): The output path where the archive will be written.
+            df_archive (pd.DataFrame): The archived rows.
+            time_column (str): The name of the datetime column used to derive the partitions.
+            batch_index (int): The index of the batch within the archived month.
+
+        Returns:
+            None
+        """
+        try:
+            timestamps = pd.to_datetime(df_archive[time_column])
+            df_archive["year"] = timestamps.dt.year
+            df_archive["month"] = timestamps.dt.month
+            df_archive.to_parquet(
+                f"{archive_output_path}",
+                partition_cols=["year", "month"],
+                index=False,
+                basename_template=f"part-{batch_index:05d}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+        except Exception as e:
+            logger.error(f"Failed to write archive to {archive_output_path}: {e}")
+            raise e
+
+    def read_fact_archive(self, archive_output_path: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        """
+        Read the archived rows of the months within the specified date range.
+
+        Parameters:
+            archive_output_path (str): The path where the archive is located.
+            start_date (datetime): The start date of the period.
+            end_date (datetime): The end date of the period.
+
+        Returns:
+            pd.DataFrame: The archived rows.
+        """
+        try:
+            valid_paths = []
+            month = datetime(start_date.year, start_date.month, 1)
+            while month <= end_date:
+                valid_paths.extend(glob(f"{archive_output_path}/year={month.year}/month={month.month}/*.parquet"))
+                month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+            if len(valid_paths) == 0:
+                logger.error(f"No archive files found for date range {start_date} to {end_date}")
+                raise FileNotFoundError(f"No archive files found for date range {start_date} to {end_date}")
+            return pd.concat([pd.read_parquet(f) for f in valid_paths])
+        except Exception as e:
+            logger.error(f"Failed to read archive from {archive_output_path}: {e}")
+            raise e
@@ -225,6 +225,25 @@ class AzureMLHandler:
         job_schedule = self.ml_client.schedules.begin_create_or_update(schedule=job_schedule).result()
         logger.info(f"Pipeline {job_schedule.create_job.display_name} scheduled successfully to run starting {job_schedule.trigger.start_time}")
     
+    def invoke_batch_endpoint(self, endpoint_name: str, inputs: dict, experiment_name: str = None):
+        """Invoke the default deployment of a batch endpoint.
+        Args:
+            endpoint_name (str): Name of the batch endpoint
+            inputs (dict): Inputs of the deployed pipeline
+            experiment_name (str): Name of the experiment
+        Returns:
+            PipelineJob: The job of the invocation
+        """
+        try:
+            job = self.ml_client.batch_endpoints.invoke(
+                endpoint_name=endpoint_name, inputs=inputs, experiment_name=experiment_name
+            )
+            logger.info(f"Batch endpoint {endpoint_name} invoked with job {job.name}")
+            return job
+        except Exception as ex:
+            logger.exception(f"Error invoking batch endpoint {endpoint_name}: {ex}")
+            raise
+
     def submit_pipeline_job(self, pipeline_job: PipelineJob, experiment_name: str):
         """Submit an AML pipeline job.
         Args:
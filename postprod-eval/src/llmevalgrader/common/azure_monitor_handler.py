@@ -1,65 +1,190 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from logging import Logger
-from datetime import datetime
+from typing import Tuple, Union
 import pandas as pd
+import pyarrow as pa
 from azure.core.exceptions import HttpResponseError
-from azure.identity import DefaultAzureCredential
 from azure.monitor.query import LogsQueryClient, LogsQueryStatus
 
+from llmevalgrader.common.entities import LogsQueryCompletenessReport
+from llmevalgrader.common.get_secret import get_credential
 from llmevalgrader.common.logger import get_logger
 
+# Log Analytics returns at most 500,000 rows per query, a result reaching it is treated as truncated.
+LOGS_QUERY_MAX_ROWS = 500000
+# Log Analytics allows 5 concurrent queries per user.
+LOGS_QUERY_MAX_CONCURRENCY = 4
+LOGS_QUERY_MIN_SLICE = timedelta(minutes=1)
+LOGS_OUTPUT_FORMATS = ("pandas", "arrow")
+
+
 class AzureMonitorHandler:
-    def __init__(self, workspace_id: str, logger: Logger = get_logger("azure_monitor_handler")):
+    def __init__(
+            self,
+            workspace_id: str,
+            logger: Logger = get_logger("azure_monitor_handler"),
+            max_concurrency: int = LOGS_QUERY_MAX_CONCURRENCY,
+            min_slice: timedelta = LOGS_QUERY_MIN_SLICE,
+            max_rows: int = LOGS_QUERY_MAX_ROWS):
         """
         Initializes an instance of the AzureMonitorHandler class.
 
         Args:
             workspace_id (str): The ID of the Azure workspace.
             logger (Logger, optional): The logger instance to use for logging. Defaults to get_logger("azure_monitor_handler").
+            max_concurrency (int, optional): The maximum number of sub-queries run at the same time.
+            min_slice (timedelta, optional): The smallest time slice a query is split into.
+            max_rows (int, optional): The row count at which a result is considered truncated.
         """
         self.workspace_id = workspace_id
         self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.min_slice = min_slice
+        self.max_rows = max_rows
+        self.last_completeness_report = None
+        self._client = None
+
+    @property
+    def client(self) -> LogsQueryClient:
+        """
+        The LogsQueryClient shared by every query of the handler.
+        """
+        if self._client is None:
+            self._client = LogsQueryClient(get_credential())
+        return self._client
+
+    @staticmethod
+    def _logs_table_to_arrow(table) -> pa.Table:
+        """
+        Converts a LogsTable to an Arrow table, column by column.
+        """
+        return pa.table({
+            column: pa.array([row[index] for row in table.rows]) for index, column in enumerate(table.columns)
+        })
+
+    def _query_slice(self, start_date: datetime, end_date: datetime, query: str,
+                     output_format: str = "pandas") -> Tuple[Union[pd.DataFrame, pa.Table], str]:
+        """
+        Runs the query over a single time slice.
+
+        Args:
+            start_date (datetime): The start of the slice.
+            end_date (datetime): The end of the slice.
+            query (str): The query to run.
+            output_format (str): "pandas" for a DataFrame or "arrow" for an Arrow table.
+
+        Returns:
+            Tuple[Union[pd.DataFrame, pa.Table], str]: The rows of every table returned, and the reason
+                the result is incomplete, or None when it is complete.
+        """
+        response = self.client.query_workspace(
+            workspace_id=self.workspace_id,
+            query=query,
+            timespan=(start_date, end_date),
+        )
+        incomplete_reason = None
+        if response.status == LogsQueryStatus.PARTIAL:
+            data = response.partial_data
+            incomplete_reason = f"partial result: {response.partial_error}"
+        else:
+            data = response.tables
+        if output_format == "arrow":
+            df_logs = pa.concat_tables(
+                [self._logs_table_to_arrow(table) for table in data], promote_options="default"
+            ) if len(data) > 0 else pa.table({})
+        else:
+            df_logs = pd.concat(
+                [pd.DataFrame(data=table.rows, columns=table.columns) for table in data]
+            ) if len(data) > 0 else pd.DataFrame()
+        if incomplete_reason is None and df_logs.shape[0] >= self.max_rows:
+            incomplete_reason = f"row limit of {self.max_rows} reached"
+        return df_logs, incomplete_reason
 
-    def get_logs_by_time_range(self, start_date: datetime, end_date: datetime, query: str) -> pd.DataFrame:
+    def get_logs_by_time_range(self, start_date: datetime, end_date: datetime, query: str,
+                               output_format: str = "pandas") -> Union[pd.DataFrame, pa.Table]:
         """
         Retrieves logs from Azure Monitor within the specified time range and based on the given query.
 
+        A slice whose result is partial or reaches the row limit is split in two halves that are queried again,
+        until the results are complete or the slices reach the minimum slice size. Each round of slices is run
+        concurrently under the concurrency cap, and the rows of every slice and table are merged in time order.
+        The completeness of the result is kept in last_completeness_report.
+
         Args:
             start_date (datetime): The start date of the time range.
             end_date (datetime): The end date of the time range.
             query (str): The query to filter the logs.
+            output_format (str, optional): "pandas" (default) for a DataFrame or "arrow" for an Arrow table.
 
         Returns:
-            pd.DataFrame: A pandas DataFrame containing the retrieved logs.
+            Union[pd.DataFrame, pa.Table]: A pandas DataFrame or an Arrow table containing the retrieved logs.
 
         Raises:
             HttpResponseError: If an HTTP response error occurs during the query.
 
         """
-        credential = DefaultAzureCredential()
-        client = LogsQueryClient(credential)
+        if output_format not in LOGS_OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format {output_format}. Allowed values are {LOGS_OUTPUT_FORMATS}")
+        report = LogsQueryCompletenessReport(start_date, end_date)
+        self.last_completeness_report = report
         try:
             self.logger.info(f"Querying logs from {start_date} to {end_date}")
             self.logger.info(f"Query: {query}")
-            response = client.query_workspace(
-                workspace_id=self.workspace_id,
-                query=query,
-                timespan=(start_date, end_date),
-            )
-            if response.status == LogsQueryStatus.PARTIAL:
-                error = response.partial_error
-                data = response.partial_data
-                self.logger.error(error)
-            elif response.status == LogsQueryStatus.SUCCESS:
-                data = response.tables
-            for table in data:
-                df_logs = pd.DataFrame(data=table.rows, columns=table.columns)
-                self.logger.info(f"Gathered logs: {df_logs.shape[0]} rows")
-                return df_logs
+            # Create the shared client before fanning out the sub-queries.
+            self.client
+            completed_slices = []
+            pending_slices = [(start_date, end_date)]
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                while pending_slices:
+                    results = list(executor.map(
+                        lambda s: self._query_slice(s[0], s[1], query, output_format), pending_slices
+                    ))
+                    report.slices_queried += len(pending_slices)
+                    next_slices = []
+                    for (slice_start, slice_end), (df_slice, incomplete_reason) in zip(pending_slices, results):
+                        if incomplete_reason is None:
+                            completed_slices.append((slice_start, df_slice))
+                        elif slice_end - slice_start <= self.min_slice:
+                            self.logger.error(
+                                f"Logs from {slice_start} to {slice_end} are incomplete at the minimum slice size: "
+                                f"{incomplete_reason}"
+                            )
+                            report.incomplete_slices.append((slice_start, slice_end, incomplete_reason))
+                            completed_slices.append((slice_start, df_slice))
+                        else:
+                            self.logger.info(
+                                f"Splitting logs query from {slice_start} to {slice_end}: {incomplete_reason}"
+                            )
+                            report.slices_split += 1
+                            slice_middle = slice_start + (slice_end - slice_start) / 2
+                            next_slices.extend([(slice_start, slice_middle), (slice_middle, slice_end)])
+                    pending_slices = next_slices
+
+            completed_slices.sort(key=lambda completed_slice: completed_slice[0])
+            if output_format == "arrow":
+                df_logs = pa.concat_tables(
+                    [df_slice for _, df_slice in completed_slices], promote_options="default"
+                )
+            else:
+                df_logs = pd.concat([df_slice for _, df_slice in completed_slices], ignore_index=True)
+            report.row_count = df_logs.shape[0]
+            self.logger.info(f"Gathered logs: {df_logs.shape[0]} rows")
+            self.logger.info(f"Logs query completeness: {report.to_dict()}")
+            return df_logs
         except HttpResponseError as err:
             self.logger.error("Something fatal happened")
             self.logger.error(err)
             raise err
+
+    def get_completeness_report(self) -> LogsQueryCompletenessReport:
+        """
+        Returns the completeness report of the last call to get_logs_by_time_range.
+
+        Returns:
+            LogsQueryCompletenessReport: The completeness report, or None if no query has been run.
+        """
+        return self.last_completeness_report
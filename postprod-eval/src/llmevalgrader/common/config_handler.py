@@ -105,6 +105,12 @@ def get_evaluator_info(evaluation_config_file_path):
                     evaluation_metrics=evaluation_metrics,
                     evaluation_metrics_version=evaluator_info.get('version'),
                     app=app,
+                    turns_per_request=evaluator_info.get('turns_per_request', 1),
+                    near_duplicate_threshold=float(evaluator_info.get('near_duplicate_threshold', 0.0)),
+                    max_retry_attempts=int(active_evaluator.get('max_retry_attempts', 0)),
+                    prescreen=active_evaluator.get('prescreen'),
+                    grading_cache_blob_url=evaluator_info.get('grading_cache_blob_url'),
+                    rate_limit=evaluator_info.get('rate_limit'),
                 )
                 evaluators_list.append(evaluator)
     return evaluators_list
\ No newline at end of file
@@ -2,19 +2,22 @@
 # Licensed under the MIT License.
 
 from datetime import datetime
-from typing import List
+from typing import Iterator, List, Union
 
-import pyodbc
+import pandas as pd
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-from llmevalgrader.common.get_secret import get_key_vault_secret
+from llmevalgrader.common.get_secret import prefetch_key_vault_secrets
 from llmevalgrader.common.logger import get_logger
+from llmevalgrader.common.sql_dialect import AzureSqlDialect, SqlDialect
 
 logger = get_logger("db_handler")
 
 DB_WAKEUP_RETRY_WAIT_TIME_IN_SECONDS = 10
 DB_WAKEUP_ATTEMPTS = 30
 DB_QUERY_TIMEOUT = 300
+DB_FETCH_BATCH_SIZE = 10000
+QUERY_BATCH_FORMATS = ("records", "columns", "dataframe")
 
 
 class DBHandler:
@@ -22,8 +25,9 @@ class DBHandler:
     Class for handling database operations.
     """
 
-    def __init__(self, key_vault_url):
+    def __init__(self, key_vault_url, dialect: SqlDialect = None):
         self.key_vault_url = key_vault_url
+        self.dialect = dialect if dialect is not None else AzureSqlDialect(query_timeout=DB_QUERY_TIMEOUT)
         self.conn = None
 
     def init_db_connection(
@@ -35,13 +39,21 @@ class DBHandler:
     ):
         """Initializes the database connection."""
         try:
-            server = get_key_vault_secret(self.key_vault_url, server_secret_name)
-            database = get_key_vault_secret(self.key_vault_url, database_secret_name)
-            userid = get_key_vault_secret(self.key_vault_url, userid_secret_name)
-            password = get_key_vault_secret(self.key_vault_url, password_secret_name)
+            if not self.dialect.requires_credentials:
+                self.conn = self.dialect.connect()
+                logger.info(f"Connection to {self.dialect.name} database successful")
+                return
 
-            conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={userid};PWD={password}"
-            self.wake_up_database(conn_str)
+            secrets = prefetch_key_vault_secrets(
+                self.key_vault_url,
+                [server_secret_name, database_secret_name, userid_secret_name, password_secret_name],
+            )
+            server = secrets[server_secret_name]
+            database = secrets[database_secret_name]
+            userid = secrets[userid_secret_name]
+            password = secrets[password_secret_name]
+
+            self.wake_up_database(server=server, database=database, userid=userid, password=password)
             logger.info(f"Connection to database {database} successful")
         except Exception as ex:
             logger.exception(f"Error connecting to database: {ex}")
@@ -51,12 +63,12 @@ class DBHandler:
         wait=wait_fixed(DB_WAKEUP_RETRY_WAIT_TIME_IN_SECONDS),
         stop=stop_after_attempt(DB_WAKEUP_ATTEMPTS),
     )
-    def wake_up_database(self, conn_str):
+    def wake_up_database(self, **connection_args):
         """
         Wakes up the database by executing a simple query.
         """
         logger.info("Waking up database")
-        self.conn = pyodbc.connect(conn_str, timeout=DB_QUERY_TIMEOUT)
+        self.conn = self.dialect.connect(**connection_args)
         cursor = self.conn.cursor()
 
         # Execute a simple query
@@ -80,9 +92,9 @@ class DBHandler:
         Creates a cursor for executing SQL queries.
 
         Returns:
-            pyodbc.Cursor: A cursor object.
+            ContextManager: A context manager yielding a DB-API cursor.
         """
-        return self.conn.cursor()
+        return self.dialect.cursor(self.conn)
 
     def select_row_by_columns(
         self, table_name, column_names, column_values, select_column_name=None
@@ -102,18 +114,7 @@ class DBHandler:
                           None if no row is found.
         """
         try:
-            if len(column_names) == 1:
-                where_condition = f"{column_names[0]} = ?"
-            else:
-                where_condition = " AND ".join(
-                    f"{column_name} = ?" for column_name in column_names
-                )
-
-            if select_column_name is None:
-                query = f"SELECT * FROM {table_name} WHERE {where_condition}"
-            else:
-                query = f"SELECT {select_column_name} FROM {table_name} WHERE {where_condition}"
-
+            query = self.dialect.build_select_query(table_name, column_names, select_column_name)
             params = tuple(column_values)
 
             logger.debug(f"Running select query: {query} with params: {params}")
@@ -157,17 +158,113 @@ class DBHandler:
                     cursor.execute(query)
                 rows = cursor.fetchall()
                 if rows:
-                    rows_dict = [
-                        dict(zip([col[0] for col in cursor.description], row))
-                        for row in rows
-                    ]
-                    return rows_dict
+                    column_names = [col[0] for col in cursor.description]
+                    return [dict(zip(column_names, row)) for row in rows]
                 else:
                     return []
         except Exception as ex:
             logger.exception(f"Error executing query: {ex}")
             raise
 
+    def table_exists(self, table_name) -> bool:
+        """
+        Returns whether a database table exists.
+
+        Parameters:
+            table_name (str): The name of the database table.
+        """
+        query, params = self.dialect.build_table_exists_query(table_name)
+        return len(self.execute_query(query, params)) > 0
+
+    def get_table_columns(self, table_name) -> List[str]:
+        """
+        Returns the column names of a database table, read from the description of an empty result set.
+
+        Parameters:
+            table_name (str): The name of the database table.
+        """
+        try:
+            with self._create_cursor() as cursor:
+                cursor.execute(f"SELECT * FROM {table_name} WHERE 1 = 0")
+                column_names = [col[0] for col in cursor.description]
+                cursor.fetchall()
+                return column_names
+        except Exception as ex:
+            logger.exception(f"Error reading the columns of database table {table_name}: {ex}")
+            raise
+
+    def execute_non_query(self, query, params=None):
+        """
+        Executes a SQL statement that does not return rows (DDL, DELETE, UPDATE...) and commits it.
+
+        Parameters:
+            query (str): The SQL statement to execute.
+            params (tuple): A tuple of parameters for the statement.
+
+        Returns:
+            int: The number of rows affected, as reported by the driver.
+        """
+        try:
+            logger.debug(f"Running statement: {query} with params: {params}")
+            with self._create_cursor() as cursor:
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                row_count = cursor.rowcount
+                self.conn.commit()
+                return row_count
+        except Exception as ex:
+            logger.exception(f"Error executing statement: {ex}")
+            raise
+
+    def stream_query(
+        self, query, params=None, batch_size: int = DB_FETCH_BATCH_SIZE, batch_format: str = "records"
+    ) -> Iterator[Union[List[dict], dict, pd.DataFrame]]:
+        """
+        Executes a SQL query and yields the result set in batches fetched with fetchmany,
+        so that memory stays bounded by the batch size instead of the result size.
+
+        Parameters:
+            query (str): The SQL query to execute.
+            params (tuple): A tuple of parameters for the query.
+            batch_size (int): The number of rows fetched per batch.
+            batch_format (str): The format of each yielded batch:
+                "records" - a list of dictionaries, one per row.
+                "columns" - a dictionary of column name to list of values.
+                "dataframe" - a pandas DataFrame.
+
+        Yields:
+            list, dict or pd.DataFrame: A batch of at most batch_size rows in the requested format.
+        """
+        if batch_format not in QUERY_BATCH_FORMATS:
+            raise ValueError(f"Invalid batch format {batch_format}. Allowed values are {QUERY_BATCH_FORMATS}")
+        try:
+            logger.debug(f"Streaming query: {query} with params: {params} in batches of {batch_size}")
+            with self._create_cursor() as cursor:
+                cursor.arraysize = batch_size
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                column_names = [col[0] for col in cursor.description]
+                row_count = 0
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    row_count += len(rows)
+                    if batch_format == "records":
+                        yield [dict(zip(column_names, row)) for row in rows]
+                    elif batch_format == "columns":
+                        yield dict(zip(column_names, (list(values) for values in zip(*rows))))
+                    else:
+                        yield pd.DataFrame.from_records(rows, columns=column_names)
+                logger.debug(f"Streamed {row_count} rows")
+        except Exception as ex:
+            logger.exception(f"Error streaming query: {ex}")
+            raise
+
     def upsert_into_table(
         self, table_name, entities, unique_columns, is_insert_only=False
     ):
@@ -182,43 +279,24 @@ class DBHandler:
         logger.debug("DB Handler : Upsert")
         if entities is not None and len(entities) > 0:
             entity = entities[0]
-            columns = ", ".join(entity.__dict__.keys())
-            placeholders = ", ".join("?" * len(entity.__dict__.keys()))
+            columns = list(entity.__dict__.keys())
+            unique_columns = list(unique_columns)
             try:
-                query = ""
-                if is_insert_only:
-                    query = f"MERGE {table_name} AS target \
-                            USING (VALUES ( {','.join(['?']*len(unique_columns))})) AS source ({','.join(unique_columns)}) \
-                            ON ({' AND '.join([f'target.{col} = source.{col}' for col in unique_columns])}) \
-                            WHEN NOT MATCHED THEN \
-                            INSERT ({columns}) VALUES ({placeholders});"
-                else:
-                    query = f"MERGE {table_name} AS target \
-                            USING (VALUES ( {','.join(['?']*len(unique_columns))})) AS source ({','.join(unique_columns)}) \
-                            ON ({' AND '.join([f'target.{col} = source.{col}' for col in unique_columns])}) \
-                            WHEN MATCHED THEN \
-                            UPDATE SET {','.join(column + ' = ?' for column in entity.__dict__.keys())} \
-                            WHEN NOT MATCHED THEN \
-                            INSERT ({columns}) VALUES ({placeholders});"
-
                 logger.info(f"length of entities to be upserted: {len(entities)}")
-                params_list = []
+                rows = []
                 for entiy in entities:
                     unique_values = tuple(entiy.__dict__[col] for col in unique_columns)
                     placeholder_values = tuple(entiy.__dict__.values())
-                    merge_params = (
-                        tuple(unique_values + placeholder_values)
-                        if is_insert_only
-                        else tuple(
-                            unique_values + placeholder_values + placeholder_values
-                        )
-                    )
-                    params_list.append(merge_params)
-                logger.debug(f"length of params to be upserted: {len(params_list)}")
+                    rows.append((unique_values, placeholder_values))
+                statements = self.dialect.build_upsert_statements(
+                    table_name, columns, unique_columns, rows, is_insert_only
+                )
+                logger.debug(f"length of params to be upserted: {len(rows)}")
                 with self._create_cursor() as cursor:
-                    cursor.fast_executemany = True
-                    cursor.executemany(query, params_list)
-                    cursor.commit()
+                    self.dialect.prepare_bulk_cursor(cursor)
+                    for query, params_list in statements:
+                        cursor.executemany(query, params_list)
+                    self.conn.commit()
             except Exception as ex:
                 logger.exception(
                     f"Error inserting rows into database table {table_name}: {ex}"
@@ -67,6 +67,12 @@ class Evaluator:
         evaluation_metrics (list[Metric]): A list of Metric objects representing evaluation metrics.
         evaluation_metrics_version (float): The version of the evaluation metrics.
         app (App): An App object representing the associated application.
+        turns_per_request (int): The number of turns graded by each run of the evaluation promptflow.
+        max_retry_attempts (int): The number of evaluation runs invoked automatically for the rows that failed.
+        near_duplicate_threshold (float): The similarity of the near duplicate rows graded once, 0 to grade every row.
+        prescreen (dict): The configuration of the pre-screen model of the metric of the evaluator, None for none.
+        grading_cache_blob_url (str): The URL of the blob container of the grading cache of the flow, None for none.
+        rate_limit (dict): The deployment quota and the worker processes of the flow, None for no limit.
     """
 
     def __init__(
@@ -80,6 +86,12 @@ class Evaluator:
         evaluation_metrics: list[Metric],
         evaluation_metrics_version: float,
         app: App,
+        turns_per_request: int = 1,
+        max_retry_attempts: int = 0,
+        near_duplicate_threshold: float = 0.0,
+        prescreen: dict = None,
+        grading_cache_blob_url: str = None,
+        rate_limit: dict = None,
     ):
         self.evaluator_name = evaluator_name
         self.evaluator_type = evaluator_type
@@ -90,6 +102,12 @@ class Evaluator:
         self.evaluation_metrics = evaluation_metrics
         self.evaluation_metrics_version = evaluation_metrics_version
         self.app = app
+        self.turns_per_request = turns_per_request
+        self.max_retry_attempts = max_retry_attempts
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.prescreen = prescreen
+        self.grading_cache_blob_url = grading_cache_blob_url
+        self.rate_limit = rate_limit
 
 
 class MappingColumn:
@@ -189,12 +207,15 @@ class AzureMonitorDataSource(DataSource):
     Attributes:
         table (str): The table associated with the data source.
         workspace_id_secret_key (str): The secret key for the workspace ID.
+        app_role_name (str): The AppRoleName of the chatbot, used to route rows when several chatbots
+            log to the same workspace. If None, every row of the workspace is read.
     """
     
-    def __init__(self, table: str, workspace_id_secret_key: str):
+    def __init__(self, table: str, workspace_id_secret_key: str, app_role_name: str = None):
         super().__init__("azure_monitor")
         self.table = table
         self.workspace_id_secret_key = workspace_id_secret_key
+        self.app_role_name = app_role_name
     
     def to_dict(self):
         """
@@ -206,7 +227,8 @@ class AzureMonitorDataSource(DataSource):
         return {
             "type": self.type,
             "table": self.table,
-            "workspace_id_secret_key": self.workspace_id_secret_key
+            "workspace_id_secret_key": self.workspace_id_secret_key,
+            "app_role_name": self.app_role_name
         }
     
     @staticmethod
@@ -220,7 +242,7 @@ class AzureMonitorDataSource(DataSource):
         Returns:
             AzureMonitorDataSource: The created AzureMonitorDataSource object.
         """
-        return AzureMonitorDataSource(data["table"], data["workspace_id_secret_key"])
+        return AzureMonitorDataSource(data["table"], data["workspace_id_secret_key"], data.get("app_role_name"))
 
 class TransformationDTO:
     """
@@ -315,7 +337,8 @@ class FactEvaluationMetric:
         fact_creation_time: datetime.datetime,
         created_by: str,
         updated_by: str,
-        updated_date: datetime.datetime
+        updated_date: datetime.datetime,
+        app_name: str = None
     ):
         self.metric_id = metric_id
         self.evaluation_dataset_id = evaluation_dataset_id
@@ -329,3 +352,152 @@ class FactEvaluationMetric:
         self.created_by = created_by
         self.updated_by = updated_by
         self.updated_date = updated_date
+        self.app_name = app_name
+
+
+class AggDailyEvaluationMetric:
+    """
+    Represents a row of AGG_DAILY_EVALUATION_METRIC, the daily aggregates of a metric of an app and metadata.
+    """
+
+    def __init__(
+        self,
+        metric_date: datetime.date,
+        metric_id: int,
+        metric_version: str,
+        app_name: str,
+        metadata_id: str,
+        metric_count: int,
+        metric_sum: float,
+        metric_min: float,
+        metric_max: float,
+        metric_histogram: str,
+        updated_by: str,
+        updated_date: datetime.datetime
+    ):
+        self.metric_date = metric_date
+        self.metric_id = metric_id
+        self.metric_version = metric_version
+        self.app_name = app_name
+        self.metadata_id = metadata_id
+        self.metric_count = metric_count
+        self.metric_sum = metric_sum
+        self.metric_min = metric_min
+        self.metric_max = metric_max
+        self.metric_histogram = metric_histogram
+        self.updated_by = updated_by
+        self.updated_date = updated_date
+
+
+class LogsQueryCompletenessReport:
+    """
+    Represents the completeness of a log query split into time slices.
+
+    Attributes:
+        start_date (datetime): The start of the requested time range.
+        end_date (datetime): The end of the requested time range.
+        slices_queried (int): The number of sub-queries run, including the ones that were split.
+        slices_split (int): The number of slices split in two because their result was partial or truncated.
+        incomplete_slices (list): The (start, end, reason) of the slices that stayed partial at the minimum slice size.
+        row_count (int): The number of rows returned.
+    """
+
+    def __init__(self, start_date: datetime, end_date: datetime):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.slices_queried = 0
+        self.slices_split = 0
+        self.incomplete_slices = []
+        self.row_count = 0
+
+    @property
+    def is_complete(self) -> bool:
+        """
+        Whether every slice returned its full result.
+        """
+        return len(self.incomplete_slices) == 0
+
+    def to_dict(self):
+        """
+        Converts the LogsQueryCompletenessReport object to a dictionary.
+
+        Returns:
+            dict: A dictionary representation of the LogsQueryCompletenessReport object.
+        """
+        return {
+            "start_date": str(self.start_date),
+            "end_date": str(self.end_date),
+            "is_complete": self.is_complete,
+            "slices_queried": self.slices_queried,
+            "slices_split": self.slices_split,
+            "incomplete_slices": [
+                {"start_date": str(start), "end_date": str(end), "reason": reason}
+                for start, end, reason in self.incomplete_slices
+            ],
+            "row_count": self.row_count,
+        }
+
+
+class ParquetLayout:
+    """
+    Represents the physical layout of parquet files: row order, row groups, compression and encoding.
+
+    The default layout is the one of the parquet writer: rows in arrival order, snappy compression
+    and dictionary encoding attempted for every column.
+
+    Attributes:
+        sort_columns (list): The columns the rows are sorted by, so that row group statistics can skip rows.
+            Empty to keep the arrival order.
+        row_group_size (int): The maximum number of rows per row group, None for the writer default.
+        compression (str): The compression codec, e.g. snappy or zstd.
+        compression_level (int): The level of the compression codec, None for the codec default.
+        dictionary_columns (list): The columns dictionary encoded, None to attempt it for every column.
+    """
+
+    def __init__(self, sort_columns: list = None, row_group_size: int = None, compression: str = "snappy",
+                 compression_level: int = None, dictionary_columns: list = None):
+        self.sort_columns = sort_columns or []
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.dictionary_columns = dictionary_columns
+
+    def to_write_options(self) -> dict:
+        """
+        Returns the options of pyarrow.parquet.write_to_dataset for the layout.
+        """
+        write_options = {"compression": self.compression}
+        if self.compression_level is not None:
+            write_options["compression_level"] = self.compression_level
+        if self.dictionary_columns is not None:
+            write_options["use_dictionary"] = self.dictionary_columns
+        if self.row_group_size is not None:
+            # Fill the row groups up to the target size instead of writing each batch as a row group.
+            write_options["row_group_size"] = self.row_group_size
+            write_options["min_rows_per_group"] = self.row_group_size
+        return write_options
+
+    def to_dict(self):
+        """
+        Converts the ParquetLayout object to a dictionary.
+        """
+        return {
+            "sort_columns": self.sort_columns,
+            "row_group_size": self.row_group_size,
+            "compression": self.compression,
+            "compression_level": self.compression_level,
+            "dictionary_columns": self.dictionary_columns,
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        """
+        Creates a ParquetLayout object from a dictionary. Missing keys take the default layout.
+        """
+        return ParquetLayout(
+            sort_columns=data.get("sort_columns"),
+            row_group_size=data.get("row_group_size"),
+            compression=data.get("compression", "snappy"),
+            compression_level=data.get("compression_level"),
+            dictionary_columns=data.get("dictionary_columns"),
+        )
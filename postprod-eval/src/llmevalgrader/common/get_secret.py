@@ -1,13 +1,181 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("get_secret")
+
+SECRET_CACHE_TTL_IN_SECONDS = 3600
+SECRET_PREFETCH_MAX_WORKERS = 8
+# "keyvault" (default), "env" or "file"
+SECRET_BACKEND_ENV_VAR = "LLMEVAL_SECRET_BACKEND"
+# JSON file of secret name to value, used by the "file" backend
+SECRET_FILE_ENV_VAR = "LLMEVAL_SECRET_FILE"
+
+_credential = None
+_credential_lock = threading.Lock()
+
+
+def get_credential() -> DefaultAzureCredential:
+    """
+    Returns the DefaultAzureCredential shared by the process, creating it on first use.
+
+    Sharing the credential lets every client reuse the token it has already acquired
+    instead of walking the credential chain again.
+
+    Returns:
+        DefaultAzureCredential: The shared credential.
+    """
+    global _credential
+    if _credential is None:
+        with _credential_lock:
+            if _credential is None:
+                _credential = DefaultAzureCredential()
+    return _credential
+
+
+def get_secret_env_var_name(secret_name: str) -> str:
+    """
+    Returns the environment variable read by the "env" backend for a secret, e.g.
+    azuresqlserver-password -> AZURESQLSERVER_PASSWORD.
+    """
+    return secret_name.upper().replace("-", "_")
+
+
+class SecretCache:
+    """
+    Process-wide cache of secrets with TTL based expiry.
+
+    Secrets are read from Azure Key Vault with a single shared credential and one SecretClient per vault,
+    or from environment variables or a local JSON file for offline runs.
+
+    Args:
+        ttl_in_seconds (int): The number of seconds a secret is served from the cache.
+        backend (str): "keyvault", "env" or "file". Defaults to the LLMEVAL_SECRET_BACKEND environment variable.
+        secret_file_path (str): The JSON file read by the "file" backend. Defaults to LLMEVAL_SECRET_FILE.
+    """
+
+    def __init__(self, ttl_in_seconds: int = SECRET_CACHE_TTL_IN_SECONDS, backend: str = None,
+                 secret_file_path: str = None):
+        self.ttl_in_seconds = ttl_in_seconds
+        self.backend = (backend or os.getenv(SECRET_BACKEND_ENV_VAR) or "keyvault").strip().lower()
+        if self.backend not in ("keyvault", "env", "file"):
+            raise ValueError(f"Invalid secret backend {self.backend}. Allowed values are 'keyvault', 'env' and 'file'")
+        self.secret_file_path = secret_file_path or os.getenv(SECRET_FILE_ENV_VAR)
+        self._secrets = {}
+        self._secret_clients = {}
+        self._file_secrets = None
+        self._lock = threading.Lock()
+
+    def _get_secret_client(self, key_vault_url: str) -> SecretClient:
+        with self._lock:
+            if key_vault_url not in self._secret_clients:
+                self._secret_clients[key_vault_url] = SecretClient(vault_url=key_vault_url, credential=get_credential())
+            return self._secret_clients[key_vault_url]
+
+    def _read_file_secrets(self) -> Dict[str, str]:
+        if self._file_secrets is None:
+            if not self.secret_file_path:
+                raise ValueError(f"{SECRET_FILE_ENV_VAR} must be set to use the 'file' secret backend")
+            with open(self.secret_file_path, "r") as file:
+                self._file_secrets = json.load(file)
+        return self._file_secrets
+
+    def _fetch(self, key_vault_url: str, secret_name: str) -> str:
+        if self.backend == "env":
+            env_var_name = get_secret_env_var_name(secret_name)
+            if env_var_name not in os.environ:
+                raise KeyError(f"Secret {secret_name} not found in environment variable {env_var_name}")
+            return os.environ[env_var_name]
+        if self.backend == "file":
+            file_secrets = self._read_file_secrets()
+            if secret_name not in file_secrets:
+                raise KeyError(f"Secret {secret_name} not found in {self.secret_file_path}")
+            return file_secrets[secret_name]
+        return self._get_secret_client(key_vault_url).get_secret(secret_name).value
+
+    def get(self, key_vault_url: str, secret_name: str) -> str:
+        """
+        Returns a secret, reading it from the backend when it is not cached or has expired.
+
+        Args:
+            key_vault_url (str): The URL of the Azure Key Vault.
+            secret_name (str): The name of the secret to retrieve.
+
+        Returns:
+            str: The value of the secret.
+        """
+        key = (key_vault_url, secret_name)
+        cached = self._secrets.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        value = self._fetch(key_vault_url, secret_name)
+        self._secrets[key] = (value, time.monotonic() + self.ttl_in_seconds)
+        return value
+
+    def prefetch(self, key_vault_url: str, secret_names: Iterable[str],
+                 max_workers: int = SECRET_PREFETCH_MAX_WORKERS) -> Dict[str, str]:
+        """
+        Reads a set of secrets concurrently and caches them.
+
+        Args:
+            key_vault_url (str): The URL of the Azure Key Vault.
+            secret_names (Iterable[str]): The names of the secrets to retrieve.
+            max_workers (int): The maximum number of concurrent requests.
+
+        Returns:
+            Dict[str, str]: The value of each secret by name.
+        """
+        secret_names = list(dict.fromkeys(secret_names))
+        start = time.perf_counter()
+        # Create the client before fanning out, so that the workers share it and the credential.
+        if self.backend == "keyvault":
+            self._get_secret_client(key_vault_url)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(secret_names)))) as executor:
+            values = list(executor.map(lambda name: self.get(key_vault_url, name), secret_names))
+        logger.info(f"Fetched {len(secret_names)} secret(s) from {self.backend} in {time.perf_counter() - start:.2f}s")
+        return dict(zip(secret_names, values))
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        self._secrets.clear()
+
+
+_secret_cache = None
+_secret_cache_lock = threading.Lock()
+
+
+def get_secret_cache() -> SecretCache:
+    """
+    Returns the SecretCache shared by the process, creating it on first use.
+    """
+    global _secret_cache
+    if _secret_cache is None:
+        with _secret_cache_lock:
+            if _secret_cache is None:
+                _secret_cache = SecretCache()
+    return _secret_cache
+
+
 def get_key_vault_secret(key_vault_url, secret_name):
     """
     Retrieves a secret from Azure Key Vault.
 
+    Secrets are cached for the process with a TTL and read with a shared credential,
+    see SecretCache for the offline backends.
+
     Args:
         key_vault_url (str): The URL of the Azure Key Vault.
         secret_name (str): The name of the secret to retrieve.
@@ -18,6 +186,18 @@ def get_key_vault_secret(key_vault_url, secret_name):
     Raises:
         AzureError: If an error occurs while retrieving the secret.
     """
-    credential = DefaultAzureCredential()
-    secret_client = SecretClient(vault_url=key_vault_url, credential=credential)
-    return secret_client.get_secret(secret_name).value
\ No newline at end of file
+    return get_secret_cache().get(key_vault_url, secret_name)
+
+
+def prefetch_key_vault_secrets(key_vault_url, secret_names):
+    """
+    Retrieves a set of secrets from Azure Key Vault concurrently and caches them.
+
+    Args:
+        key_vault_url (str): The URL of the Azure Key Vault.
+        secret_names (list): The names of the secrets to retrieve.
+
+    Returns:
+        dict: The value of each secret by name.
+    """
+    return get_secret_cache().prefetch(key_vault_url, secret_names)
@@ -0,0 +1,302 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Versioned schema migrations for the evaluation metrics database."""
+import datetime
+from typing import Dict, Iterable, List
+
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("schema_migrations")
+
+SCHEMA_VERSION_TABLE = "SCHEMA_VERSION"
+FACT_PARTITION_FUNCTION = "PF_FACT_EVALUATION_METRIC_MONTH"
+FACT_PARTITION_SCHEME = "PS_FACT_EVALUATION_METRIC_MONTH"
+FACT_PARTITION_MONTHS_AHEAD = 12
+
+SCHEMA_VERSION_TABLE_DDL = {
+    "azuresql": [
+        f"""IF OBJECT_ID('{SCHEMA_VERSION_TABLE}') IS NULL
+        CREATE TABLE {SCHEMA_VERSION_TABLE}(
+        version INT NOT NULL PRIMARY KEY,
+        description Varchar(255) NOT NULL,
+        applied_date DATETIME NOT NULL DEFAULT GETDATE())"""
+    ],
+    "sqlite": [
+        f"""CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE}(
+        version INTEGER NOT NULL PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"""
+    ],
+}
+
+
+class Migration:
+    """
+    Represents a versioned schema change.
+
+    Attributes:
+        version (int): The version of the migration. Migrations are applied in ascending order.
+        description (str): A short description of the schema change.
+        statements (dict): The statements to run for each dialect name. A dialect without an entry has nothing to do.
+        optional (bool): Whether the migration is only applied when explicitly requested.
+    """
+
+    def __init__(self, version: int, description: str, statements: Dict[str, List[str]], optional: bool = False):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.optional = optional
+
+    def get_statements(self, dialect_name: str) -> List[str]:
+        """
+        Returns the statements of the migration for the given dialect.
+        """
+        return self.statements.get(dialect_name, [])
+
+
+MIGRATIONS = [
+    Migration(
+        version=1,
+        description="Add app_name to FACT_EVALUATION_METRIC",
+        statements={
+            "azuresql": [
+                """IF COL_LENGTH('FACT_EVALUATION_METRIC', 'app_name') IS NULL
+                ALTER TABLE FACT_EVALUATION_METRIC ADD app_name Varchar(255) NULL"""
+            ],
+        },
+    ),
+    Migration(
+        version=2,
+        description="Unique index on the FACT_EVALUATION_METRIC merge key",
+        statements={
+            "azuresql": [
+                """IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_FACT_EVALUATION_METRIC_MERGE_KEY'
+                AND object_id = OBJECT_ID('FACT_EVALUATION_METRIC'))
+                CREATE UNIQUE NONCLUSTERED INDEX UX_FACT_EVALUATION_METRIC_MERGE_KEY
+                ON FACT_EVALUATION_METRIC (evaluation_dataset_id, metric_id)"""
+            ],
+            "sqlite": [
+                """CREATE UNIQUE INDEX IF NOT EXISTS UX_FACT_EVALUATION_METRIC_MERGE_KEY
+                ON FACT_EVALUATION_METRIC (evaluation_dataset_id, metric_id)"""
+            ],
+        },
+    ),
+    Migration(
+        version=3,
+        description="Lookup index on DIM_METRIC metric name and version",
+        statements={
+            "azuresql": [
+                """IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_DIM_METRIC_NAME_VERSION'
+                AND object_id = OBJECT_ID('DIM_METRIC'))
+                CREATE NONCLUSTERED INDEX IX_DIM_METRIC_NAME_VERSION
+                ON DIM_METRIC (metric_name, metric_version) INCLUDE (metric_type)"""
+            ],
+            "sqlite": [
+                """CREATE INDEX IF NOT EXISTS IX_DIM_METRIC_NAME_VERSION
+                ON DIM_METRIC (metric_name, metric_version)"""
+            ],
+        },
+    ),
+    Migration(
+        version=4,
+        description="Clustered columnstore index on FACT_EVALUATION_METRIC for analytics",
+        statements={
+            "azuresql": [
+                """IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE object_id = OBJECT_ID('FACT_EVALUATION_METRIC')
+                AND type = 5)
+                BEGIN
+                    DECLARE @pk_name sysname = (SELECT name FROM sys.key_constraints
+                        WHERE parent_object_id = OBJECT_ID('FACT_EVALUATION_METRIC') AND type = 'PK');
+                    DECLARE @drop_pk nvarchar(max) = N'ALTER TABLE FACT_EVALUATION_METRIC DROP CONSTRAINT '
+                        + QUOTENAME(@pk_name);
+                    EXEC sp_executesql @drop_pk;
+                    ALTER TABLE FACT_EVALUATION_METRIC
+                        ADD CONSTRAINT PK_FACT_EVALUATION_METRIC PRIMARY KEY NONCLUSTERED (metric_fact_id);
+                    CREATE CLUSTERED COLUMNSTORE INDEX CCI_FACT_EVALUATION_METRIC ON FACT_EVALUATION_METRIC;
+                END"""
+            ],
+        },
+        optional=True,
+    ),
+    Migration(
+        version=5,
+        description="Monthly partitioning of FACT_EVALUATION_METRIC on fact_creation_time",
+        statements={
+            "azuresql": [
+                # The partitioning column is part of every aligned unique index, so it cannot be nullable.
+                """IF COLUMNPROPERTY(OBJECT_ID('FACT_EVALUATION_METRIC'), 'fact_creation_time', 'AllowsNull') = 1
+                BEGIN
+                    UPDATE FACT_EVALUATION_METRIC SET fact_creation_time = created_date
+                        WHERE fact_creation_time IS NULL;
+                    ALTER TABLE FACT_EVALUATION_METRIC ALTER COLUMN fact_creation_time DATETIME NOT NULL;
+                END""",
+                f"""IF NOT EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = '{FACT_PARTITION_FUNCTION}')
+                BEGIN
+                    DECLARE @first_fact DATETIME = ISNULL(
+                        (SELECT MIN(fact_creation_time) FROM FACT_EVALUATION_METRIC), GETDATE());
+                    DECLARE @create_function nvarchar(max) = N'CREATE PARTITION FUNCTION {FACT_PARTITION_FUNCTION}
+                        (DATETIME) AS RANGE RIGHT FOR VALUES ('''
+                        + CONVERT(nvarchar(10), DATEFROMPARTS(YEAR(@first_fact), MONTH(@first_fact), 1), 23) + N''')';
+                    EXEC sp_executesql @create_function;
+                    EXEC sp_executesql N'CREATE PARTITION SCHEME {FACT_PARTITION_SCHEME}
+                        AS PARTITION {FACT_PARTITION_FUNCTION} ALL TO ([PRIMARY])';
+                END""",
+                f"""DECLARE @boundary DATETIME = (SELECT DATEADD(MONTH, 1, MAX(CAST(rv.value AS DATETIME)))
+                    FROM sys.partition_range_values rv
+                    JOIN sys.partition_functions pf ON rv.function_id = pf.function_id
+                    WHERE pf.name = '{FACT_PARTITION_FUNCTION}');
+                DECLARE @last_boundary DATETIME = DATEADD(MONTH, {FACT_PARTITION_MONTHS_AHEAD},
+                    DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1));
+                WHILE @boundary <= @last_boundary
+                BEGIN
+                    ALTER PARTITION SCHEME {FACT_PARTITION_SCHEME} NEXT USED [PRIMARY];
+                    ALTER PARTITION FUNCTION {FACT_PARTITION_FUNCTION}() SPLIT RANGE (@boundary);
+                    SET @boundary = DATEADD(MONTH, 1, @boundary);
+                END""",
+                # Rebuild the clustered index, the primary key and the merge key index on the partition scheme,
+                # so that archived months can be truncated partition by partition, which a non-aligned index
+                # prevents. An aligned unique index includes the partitioning column, so the merge key is only
+                # unique per fact_creation_time from then on. The facts of a merge key share the timestamp of
+                # their turn, and the MERGE of upsert_into_table still matches on the merge key alone.
+                f"""IF NOT EXISTS (SELECT 1 FROM sys.indexes i
+                    JOIN sys.partition_schemes ps ON i.data_space_id = ps.data_space_id
+                    WHERE i.object_id = OBJECT_ID('FACT_EVALUATION_METRIC') AND i.index_id <= 1)
+                BEGIN
+                    DECLARE @pk_name sysname = (SELECT name FROM sys.key_constraints
+                        WHERE parent_object_id = OBJECT_ID('FACT_EVALUATION_METRIC') AND type = 'PK');
+                    IF @pk_name IS NOT NULL
+                    BEGIN
+                        DECLARE @drop_pk nvarchar(max) = N'ALTER TABLE FACT_EVALUATION_METRIC DROP CONSTRAINT '
+                            + QUOTENAME(@pk_name);
+                        EXEC sp_executesql @drop_pk;
+                    END
+                    IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_FACT_EVALUATION_METRIC_MERGE_KEY'
+                        AND object_id = OBJECT_ID('FACT_EVALUATION_METRIC'))
+                        DROP INDEX UX_FACT_EVALUATION_METRIC_MERGE_KEY ON FACT_EVALUATION_METRIC;
+                    IF EXISTS (SELECT 1 FROM sys.indexes WHERE object_id = OBJECT_ID('FACT_EVALUATION_METRIC')
+                        AND type = 5)
+                        CREATE CLUSTERED COLUMNSTORE INDEX CCI_FACT_EVALUATION_METRIC ON FACT_EVALUATION_METRIC
+                            WITH (DROP_EXISTING = ON) ON {FACT_PARTITION_SCHEME}(fact_creation_time);
+                    ELSE
+                        CREATE CLUSTERED INDEX CIX_FACT_EVALUATION_METRIC_CREATION_TIME
+                            ON FACT_EVALUATION_METRIC (fact_creation_time, metric_fact_id)
+                            ON {FACT_PARTITION_SCHEME}(fact_creation_time);
+                    ALTER TABLE FACT_EVALUATION_METRIC ADD CONSTRAINT PK_FACT_EVALUATION_METRIC
+                        PRIMARY KEY NONCLUSTERED (metric_fact_id, fact_creation_time)
+                        ON {FACT_PARTITION_SCHEME}(fact_creation_time);
+                    CREATE UNIQUE NONCLUSTERED INDEX UX_FACT_EVALUATION_METRIC_MERGE_KEY
+                        ON FACT_EVALUATION_METRIC (evaluation_dataset_id, metric_id, fact_creation_time)
+                        ON {FACT_PARTITION_SCHEME}(fact_creation_time);
+                END""",
+            ],
+        },
+        optional=True,
+    ),
+    Migration(
+        version=6,
+        description="Create AGG_DAILY_EVALUATION_METRIC, the daily rollup of FACT_EVALUATION_METRIC",
+        statements={
+            # The primary key is the key of the rollup upserts, see azuresql/AGG_DAILY_EVALUATION_METRIC.sql.
+            "azuresql": [
+                """IF OBJECT_ID('AGG_DAILY_EVALUATION_METRIC', 'U') IS NULL
+                CREATE TABLE AGG_DAILY_EVALUATION_METRIC(
+                metric_date DATE NOT NULL,
+                metric_id INT FOREIGN KEY(metric_id) REFERENCES DIM_METRIC(metric_id) NOT NULL,
+                metric_version Varchar(255) NOT NULL,
+                app_name Varchar(255) NOT NULL,
+                metadata_id Varchar(255) NOT NULL,
+                metric_count INT NOT NULL,
+                metric_sum FLOAT,
+                metric_min FLOAT,
+                metric_max FLOAT,
+                metric_histogram Varchar(MAX),
+                created_date DATETIME NOT NULL DEFAULT GETDATE(),
+                updated_date DATETIME NOT NULL DEFAULT GETDATE(),
+                updated_by VARCHAR(255) NOT NULL,
+                CONSTRAINT PK_AGG_DAILY_EVALUATION_METRIC
+                    PRIMARY KEY (metric_date, metric_id, app_name, metadata_id))"""
+            ],
+        },
+    ),
+]
+
+
+class SchemaMigrator:
+    """
+    Applies the pending schema migrations to a database and records them in the SCHEMA_VERSION table.
+    """
+
+    def __init__(self, db_handler: DBHandler, migrations: List[Migration] = None):
+        self.db_handler = db_handler
+        self.migrations = sorted(migrations if migrations is not None else MIGRATIONS, key=lambda m: m.version)
+
+    def _ensure_schema_version_table(self):
+        """
+        Creates the SCHEMA_VERSION table if it does not exist.
+        """
+        for statement in SCHEMA_VERSION_TABLE_DDL[self.db_handler.dialect.name]:
+            self.db_handler.execute_non_query(statement)
+
+    def get_applied_versions(self) -> List[int]:
+        """
+        Returns the versions of the migrations already applied to the database.
+        """
+        self._ensure_schema_version_table()
+        rows = self.db_handler.execute_query(f"SELECT version FROM {SCHEMA_VERSION_TABLE}")
+        return sorted(row["version"] for row in rows)
+
+    def get_pending_migrations(self, include: Iterable[int] = ()) -> List[Migration]:
+        """
+        Returns the migrations not yet applied, in version order.
+
+        Args:
+            include (Iterable[int]): The versions of the optional migrations to include.
+
+        Returns:
+            List[Migration]: The pending migrations.
+        """
+        include = set(include)
+        optional_versions = {migration.version for migration in self.migrations if migration.optional}
+        unknown_versions = include - optional_versions
+        if unknown_versions:
+            error_msg = (f"Unknown optional schema migration(s) {sorted(unknown_versions)}. "
+                         f"Optional migrations are {sorted(optional_versions)}")
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        applied_versions = set(self.get_applied_versions())
+        return [
+            migration for migration in self.migrations
+            if migration.version not in applied_versions and (not migration.optional or migration.version in include)
+        ]
+
+    def apply(self, include: Iterable[int] = (), dry_run: bool = False) -> List[int]:
+        """
+        Applies the pending migrations in version order.
+
+        Args:
+            include (Iterable[int]): The versions of the optional migrations to apply, such as 4 for the
+                columnstore index or 5 for the monthly partitioning.
+            dry_run (bool): If True, only logs the statements that would be run.
+
+        Returns:
+            List[int]: The versions of the migrations applied.
+        """
+        dialect_name = self.db_handler.dialect.name
+        applied = []
+        for migration in self.get_pending_migrations(include):
+            logger.info(f"Applying schema migration {migration.version}: {migration.description}")
+            for statement in migration.get_statements(dialect_name):
+                if dry_run:
+                    logger.info(f"Dry run, statement not executed: {statement}")
+                else:
+                    self.db_handler.execute_non_query(statement)
+            if not dry_run:
+                self.db_handler.execute_non_query(
+                    f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description, applied_date) VALUES (?, ?, ?)",
+                    (migration.version, migration.description, datetime.datetime.now()),
+                )
+            applied.append(migration.version)
+        logger.info(f"Schema migrations applied: {applied}")
+        return applied
@@ -0,0 +1,349 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""SQL dialects used by DBHandler to talk to Azure SQL or to an embedded local engine."""
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Tuple
+
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("sql_dialect")
+
+# SQLite mirror of the tables defined in azuresql/*.sql
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS DIM_METRIC(
+    metric_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    metric_name VARCHAR(255) NOT NULL,
+    metric_version VARCHAR(255) NOT NULL,
+    metric_type VARCHAR(255) NOT NULL,
+    evaluator_name VARCHAR(255) NOT NULL,
+    evaluator_type VARCHAR(255) NOT NULL,
+    created_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_by VARCHAR(255) NULL,
+    updated_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_by VARCHAR(255) NULL)""",
+    """CREATE TABLE IF NOT EXISTS FACT_EVALUATION_METRIC(
+    metric_fact_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    metric_id INTEGER NOT NULL REFERENCES DIM_METRIC(metric_id),
+    evaluation_dataset_id VARCHAR(255) NOT NULL,
+    conversation_id VARCHAR(255),
+    metadata_id VARCHAR(255),
+    evaluator_metadata VARCHAR(255),
+    metric_numeric_value FLOAT,
+    metric_str_value VARCHAR(255),
+    metric_raw_value TEXT,
+    fact_creation_time DATETIME,
+    created_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_by VARCHAR(255) NOT NULL,
+    updated_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_by VARCHAR(255) NOT NULL,
+    app_name VARCHAR(255) NULL)""",
+    """CREATE TABLE IF NOT EXISTS AGG_DAILY_EVALUATION_METRIC(
+    metric_date DATE NOT NULL,
+    metric_id INTEGER NOT NULL REFERENCES DIM_METRIC(metric_id),
+    metric_version VARCHAR(255) NOT NULL,
+    app_name VARCHAR(255) NOT NULL,
+    metadata_id VARCHAR(255) NOT NULL,
+    metric_count INTEGER NOT NULL,
+    metric_sum FLOAT,
+    metric_min FLOAT,
+    metric_max FLOAT,
+    metric_histogram TEXT,
+    created_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_by VARCHAR(255) NOT NULL,
+    PRIMARY KEY (metric_date, metric_id, app_name, metadata_id))""",
+]
+
+
+class SqlDialect:
+    """
+    Base class for the database specific parts of DBHandler.
+
+    A dialect knows how to open a connection, build the select and upsert statements
+    and configure cursors for the target database engine.
+    """
+
+    name = None
+    requires_credentials = True
+
+    def connect(self, **connection_args):
+        """Opens and returns a DB-API connection."""
+        raise NotImplementedError
+
+    @contextmanager
+    def cursor(self, conn):
+        """
+        Yields a cursor for the given connection and closes it afterwards.
+
+        Parameters:
+            conn: An open DB-API connection.
+        """
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def prepare_bulk_cursor(self, cursor):
+        """Configures a cursor before an executemany call."""
+        return cursor
+
+    def build_select_query(self, table_name: str, column_names: List[str], select_column_name: str = None) -> str:
+        """
+        Builds a parametrised query selecting rows by equality on the given columns.
+
+        Parameters:
+            table_name (str): The name of the database table to select from.
+            column_names (list): The names of the columns for the condition.
+            select_column_name (str): The name of the column to select. If None, selects all columns.
+
+        Returns:
+            str: The select query.
+        """
+        where_condition = " AND ".join(f"{column_name} = ?" for column_name in column_names)
+        select_columns = "*" if select_column_name is None else select_column_name
+        return f"SELECT {select_columns} FROM {table_name} WHERE {where_condition}"
+
+    def build_table_exists_query(self, table_name: str) -> Tuple[str, tuple]:
+        """
+        Builds the query returning a row if the table exists and none otherwise.
+
+        Parameters:
+            table_name (str): The name of the database table.
+
+        Returns:
+            tuple: A (query, params) tuple.
+        """
+        raise NotImplementedError
+
+    def build_upsert_statements(
+        self, table_name: str, columns: List[str], unique_columns: List[str], rows: List[Tuple[tuple, tuple]],
+        is_insert_only: bool = False
+    ) -> List[Tuple[str, List[tuple]]]:
+        """
+        Builds the statements needed to upsert rows into a table.
+
+        Parameters:
+            table_name (str): The name of the database table to upsert into.
+            columns (list): The names of all the columns being written.
+            unique_columns (list): The names of the columns identifying a row.
+            rows (list): A list of (unique_values, values) tuples, one per entity.
+            is_insert_only (bool): If True, existing rows are left untouched.
+
+        Returns:
+            list: A list of (query, params_list) tuples to run with executemany, in order.
+        """
+        raise NotImplementedError
+
+    def build_purge_range_statement(
+        self, table_name: str, column_name: str, start: datetime, end: datetime, partition_function: str = None
+    ) -> Tuple[str, tuple]:
+        """
+        Builds the statement removing the rows of a table whose column value falls in [start, end).
+
+        Parameters:
+            table_name (str): The name of the database table to purge.
+            column_name (str): The name of the datetime column bounding the range.
+            start (datetime): The inclusive start of the range.
+            end (datetime): The exclusive end of the range.
+            partition_function (str): The partition function of the table, if the engine supports partitioning.
+
+        Returns:
+            tuple: A (query, params) tuple.
+        """
+        query = f"DELETE FROM {table_name} WHERE {column_name} >= ? AND {column_name} < ?"
+        return query, (start, end)
+
+    def build_partition_maintenance_statements(
+        self, partition_function: str, partition_scheme: str, retain_from: datetime, months_ahead: int
+    ) -> List[Tuple[str, tuple]]:
+        """
+        Builds the statements keeping a monthly partition function sliding: boundaries are added for the
+        upcoming months and the boundaries older than the retention start are merged away.
+
+        Parameters:
+            partition_function (str): The name of the monthly partition function.
+            partition_scheme (str): The name of the partition scheme using the function.
+            retain_from (datetime): The oldest month kept in the table.
+            months_ahead (int): The number of future months that must have their own partition.
+
+        Returns:
+            list: A list of (query, params) tuples. Empty for engines without partitioning.
+        """
+        return []
+
+
+class AzureSqlDialect(SqlDialect):
+    """Dialect for Azure SQL Database accessed through pyodbc and the ODBC Driver 17 for SQL Server."""
+
+    name = "azuresql"
+    odbc_driver = "ODBC Driver 17 for SQL Server"
+
+    def __init__(self, query_timeout: int = 300):
+        self.query_timeout = query_timeout
+
+    def connect(self, server: str, database: str, userid: str, password: str):
+        import pyodbc
+
+        conn_str = f"DRIVER={{{self.odbc_driver}}};SERVER={server};DATABASE={database};UID={userid};PWD={password}"
+        return pyodbc.connect(conn_str, timeout=self.query_timeout)
+
+    def prepare_bulk_cursor(self, cursor):
+        cursor.fast_executemany = True
+        return cursor
+
+    def build_table_exists_query(self, table_name):
+        return "SELECT 1 AS table_exists WHERE OBJECT_ID(?, 'U') IS NOT NULL", (table_name,)
+
+    def build_upsert_statements(self, table_name, columns, unique_columns, rows, is_insert_only=False):
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" * len(columns))
+        source = f"USING (VALUES ( {','.join(['?'] * len(unique_columns))})) AS source ({','.join(unique_columns)})"
+        condition = f"ON ({' AND '.join([f'target.{col} = source.{col}' for col in unique_columns])})"
+        if is_insert_only:
+            query = f"MERGE {table_name} AS target \
+                    {source} \
+                    {condition} \
+                    WHEN NOT MATCHED THEN \
+                    INSERT ({column_list}) VALUES ({placeholders});"
+            params_list = [tuple(unique_values + values) for unique_values, values in rows]
+        else:
+            query = f"MERGE {table_name} AS target \
+                    {source} \
+                    {condition} \
+                    WHEN MATCHED THEN \
+                    UPDATE SET {','.join(column + ' = ?' for column in columns)} \
+                    WHEN NOT MATCHED THEN \
+                    INSERT ({column_list}) VALUES ({placeholders});"
+            params_list = [tuple(unique_values + values + values) for unique_values, values in rows]
+        return [(query, params_list)]
+
+    def build_purge_range_statement(self, table_name, column_name, start, end, partition_function=None):
+        # On a partitioned table the month is removed with a metadata-only partition truncate,
+        # otherwise the rows are deleted in batches to keep the transaction log small.
+        delete_batches = f"""WHILE 1 = 1
+            BEGIN
+                DELETE TOP (50000) FROM {table_name} WHERE {column_name} >= @start AND {column_name} < @end;
+                IF @@ROWCOUNT = 0 BREAK;
+            END"""
+        if partition_function is None:
+            query = f"""DECLARE @start DATETIME = ?, @end DATETIME = ?;
+            {delete_batches}"""
+            return query, (start, end)
+
+        # The partition is only truncated when it holds no rows outside of the range.
+        query = f"""DECLARE @start DATETIME = ?, @end DATETIME = ?;
+            DECLARE @partition_number INT = NULL;
+            IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = '{partition_function}')
+                EXEC sp_executesql N'SET @p = $PARTITION.{partition_function}(@s);
+                    IF EXISTS (SELECT 1 FROM {table_name} WHERE $PARTITION.{partition_function}({column_name}) = @p
+                        AND ({column_name} < @s OR {column_name} >= @e))
+                        SET @p = NULL;',
+                    N'@p INT OUTPUT, @s DATETIME, @e DATETIME',
+                    @p = @partition_number OUTPUT, @s = @start, @e = @end;
+            IF @partition_number IS NOT NULL
+            BEGIN
+                DECLARE @truncate nvarchar(max) = N'TRUNCATE TABLE {table_name} WITH (PARTITIONS ('
+                    + CAST(@partition_number AS nvarchar(10)) + N'))';
+                EXEC sp_executesql @truncate;
+            END
+            ELSE
+            {delete_batches}"""
+        return query, (start, end)
+
+    def build_partition_maintenance_statements(self, partition_function, partition_scheme, retain_from, months_ahead):
+        split_query = f"""IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = '{partition_function}')
+            BEGIN
+                DECLARE @boundary DATETIME = (SELECT DATEADD(MONTH, 1, MAX(CAST(rv.value AS DATETIME)))
+                    FROM sys.partition_range_values rv
+                    JOIN sys.partition_functions pf ON rv.function_id = pf.function_id
+                    WHERE pf.name = '{partition_function}');
+                DECLARE @last_boundary DATETIME = DATEADD(MONTH, ?,
+                    DATEFROMPARTS(YEAR(GETDATE()), MONTH(GETDATE()), 1));
+                WHILE @boundary <= @last_boundary
+                BEGIN
+                    ALTER PARTITION SCHEME {partition_scheme} NEXT USED [PRIMARY];
+                    ALTER PARTITION FUNCTION {partition_function}() SPLIT RANGE (@boundary);
+                    SET @boundary = DATEADD(MONTH, 1, @boundary);
+                END
+            END"""
+        merge_query = f"""IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = '{partition_function}')
+            BEGIN
+                DECLARE @retain_from DATETIME = ?;
+                DECLARE @boundary DATETIME;
+                WHILE 1 = 1
+                BEGIN
+                    SET @boundary = (SELECT MIN(CAST(rv.value AS DATETIME))
+                        FROM sys.partition_range_values rv
+                        JOIN sys.partition_functions pf ON rv.function_id = pf.function_id
+                        WHERE pf.name = '{partition_function}' AND CAST(rv.value AS DATETIME) < @retain_from);
+                    IF @boundary IS NULL BREAK;
+                    ALTER PARTITION FUNCTION {partition_function}() MERGE RANGE (@boundary);
+                END
+            END"""
+        return [(split_query, (months_ahead,)), (merge_query, (retain_from,))]
+
+
+class SqliteDialect(SqlDialect):
+    """
+    Dialect for an embedded SQLite database mirroring the tables defined in azuresql/*.sql.
+
+    Used to run and benchmark the write path locally without an Azure SQL instance.
+    MERGE is emulated with an UPDATE followed by an INSERT guarded by NOT EXISTS, so that
+    the upsert semantics do not depend on unique indexes being present.
+    """
+
+    name = "sqlite"
+    requires_credentials = False
+
+    def __init__(self, database_path: str = ":memory:", create_schema: bool = True):
+        self.database_path = database_path
+        self.create_schema = create_schema
+
+    def connect(self, **connection_args):
+        sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+        conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        if self.create_schema:
+            for statement in SQLITE_SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+        logger.info(f"Connected to SQLite database {self.database_path}")
+        return conn
+
+    def build_table_exists_query(self, table_name):
+        return "SELECT 1 AS table_exists FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+
+    def build_upsert_statements(self, table_name, columns, unique_columns, rows, is_insert_only=False):
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" * len(columns))
+        match_condition = " AND ".join(f"{col} = ?" for col in unique_columns)
+        insert_query = f"INSERT INTO {table_name} ({column_list}) SELECT {placeholders} \
+                         WHERE NOT EXISTS (SELECT 1 FROM {table_name} WHERE {match_condition})"
+        insert_params = [tuple(values + unique_values) for unique_values, values in rows]
+        if is_insert_only:
+            return [(insert_query, insert_params)]
+
+        update_query = f"UPDATE {table_name} SET {', '.join(column + ' = ?' for column in columns)} \
+                         WHERE {match_condition}"
+        update_params = [tuple(values + unique_values) for unique_values, values in rows]
+        return [(update_query, update_params), (insert_query, insert_params)]
+
+
+def get_dialect(name: str = "azuresql", **dialect_args) -> SqlDialect:
+    """
+    Returns a dialect instance by name.
+
+    Args:
+        name (str): Either "azuresql" or "sqlite".
+        dialect_args: Keyword arguments passed to the dialect constructor.
+
+    Returns:
+        SqlDialect: The dialect instance.
+    """
+    dialects = {AzureSqlDialect.name: AzureSqlDialect, SqliteDialect.name: SqliteDialect}
+    if name not in dialects:
+        raise ValueError(f"Unknown SQL dialect {name}. Allowed values are {list(dialects.keys())}")
+    return dialects[name](**dialect_args)
@@ -0,0 +1,114 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import pandas as pd
+
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("conversation_context")
+
+CONVERSATION_APP_TYPE = "conversation"
+CONTEXT_COLUMN = "context"
+TURN_ORDER_COLUMN = "turn_order"
+
+
+def format_turn(query: str, response: str) -> str:
+    """
+    Formats a turn of the conversation history as the sample chatbot passes it to its models.
+    """
+    return "\nUser:" + str(query) + "\nBot:" + str(response) + "\n"
+
+
+def get_conversation_turns(df_fact: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the turns of the conversations in the fact rows, in order. The text of a turn is stored once,
+    in its conversation row.
+
+    Args:
+        df_fact (pd.DataFrame): The fact rows, with at least the conversation rows of the conversations.
+
+    Returns:
+        pd.DataFrame: One row per turn with conversation_id, turn_id, timestamp, the formatted turn text and
+            the turn_order of the turn in its conversation, starting at 0.
+    """
+    df_turns = df_fact[df_fact["app_type"].astype(str) == CONVERSATION_APP_TYPE]
+    df_turns = df_turns[["conversation_id", "turn_id", "timestamp", "query", "response"]] \
+        .sort_values(["conversation_id", "timestamp"], kind="stable") \
+        .drop_duplicates(subset=["conversation_id", "turn_id"], keep="first")
+    df_turns["text"] = [format_turn(query, response)
+                        for query, response in zip(df_turns["query"], df_turns["response"])]
+    df_turns[TURN_ORDER_COLUMN] = df_turns.groupby("conversation_id", sort=False).cumcount()
+    return df_turns[["conversation_id", "turn_id", "timestamp", "text", TURN_ORDER_COLUMN]].reset_index(drop=True)
+
+
+def get_turn_order(eval_fact_df: pd.DataFrame, df_turns: pd.DataFrame) -> pd.Series:
+    """
+    Returns the turn order of each evaluation row in its conversation.
+
+    The rows of a turn logged in the conversation rows get the order of that turn. Other rows, e.g. the llm
+    rows of a turn without a conversation row, get the number of turns of the conversation before them.
+
+    Args:
+        eval_fact_df (pd.DataFrame): The evaluation rows.
+        df_turns (pd.DataFrame): The turns, see get_conversation_turns.
+
+    Returns:
+        pd.Series: The turn order of each row, aligned on eval_fact_df.
+    """
+    turn_keys = pd.MultiIndex.from_frame(df_turns[["conversation_id", "turn_id"]].astype(str))
+    row_keys = pd.MultiIndex.from_frame(eval_fact_df[["conversation_id", "turn_id"]].astype(str))
+    turn_orders = df_turns[TURN_ORDER_COLUMN].to_list()
+    turn_order = pd.Series(
+        [turn_orders[position] if position >= 0 else None for position in turn_keys.get_indexer(row_keys)],
+        index=eval_fact_df.index, dtype=float,
+    )
+    unmatched = turn_order.isna()
+    if unmatched.any():
+        turn_timestamps = {conversation_id: group["timestamp"].to_numpy()
+                           for conversation_id, group in df_turns.groupby("conversation_id", sort=False)}
+        turn_order[unmatched] = [
+            turn_timestamps[conversation_id].searchsorted(timestamp) if conversation_id in turn_timestamps else 0
+            for conversation_id, timestamp in zip(
+                eval_fact_df.loc[unmatched, "conversation_id"], eval_fact_df.loc[unmatched, "timestamp"].to_numpy()
+            )
+        ]
+    return turn_order.astype(int)
+
+
+def build_context(eval_fact_df: pd.DataFrame, df_fact: pd.DataFrame, window_turns: int = 0) -> pd.DataFrame:
+    """
+    Adds the context of each evaluation row, the history of its conversation before its turn, rebuilt from
+    the text stored once per turn in the gold zone.
+
+    Args:
+        eval_fact_df (pd.DataFrame): The evaluation rows.
+        df_fact (pd.DataFrame): The fact rows holding the conversation rows of the evaluated conversations,
+            including the turns before the evaluation period.
+        window_turns (int): The number of previous turns in the context, 0 for all of them.
+
+    Returns:
+        pd.DataFrame: The evaluation rows with the turn_order and context columns. The context is null for
+            the first turn of a conversation. A context already stored in the fact rows is kept for the rows
+            without history.
+    """
+    if window_turns < 0:
+        raise ValueError(f"Invalid context window of {window_turns} turns, it must be 0 or more")
+    df_turns = get_conversation_turns(
+        df_fact[df_fact["conversation_id"].isin(eval_fact_df["conversation_id"].unique())]
+    )
+    turn_order = get_turn_order(eval_fact_df, df_turns)
+    turn_texts = {conversation_id: group["text"].to_list()
+                  for conversation_id, group in df_turns.groupby("conversation_id", sort=False)}
+    contexts = []
+    for conversation_id, order in zip(eval_fact_df["conversation_id"], turn_order):
+        texts = turn_texts.get(conversation_id, [])[:order]
+        if window_turns > 0:
+            texts = texts[-window_turns:]
+        contexts.append("".join(texts) if texts else None)
+    context = pd.Series(contexts, index=eval_fact_df.index, dtype=object)
+    if CONTEXT_COLUMN in eval_fact_df.columns:
+        context = context.where(context.notna(), eval_fact_df[CONTEXT_COLUMN].astype(object))
+    eval_fact_df = eval_fact_df.assign(**{TURN_ORDER_COLUMN: turn_order, CONTEXT_COLUMN: context})
+    logger.info(f"Rebuilt the context of {context.notna().sum()} of {len(eval_fact_df)} rows from "
+                f"{len(df_turns)} turns with a window of {window_turns or 'all'} turns")
+    return eval_fact_df
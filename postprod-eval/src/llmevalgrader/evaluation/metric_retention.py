@@ -0,0 +1,180 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import datetime
+from typing import List
+
+from llmevalgrader.common.adls_handler import ADLSHandler
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.common.schema_migrations import (
+    FACT_PARTITION_FUNCTION,
+    FACT_PARTITION_MONTHS_AHEAD,
+    FACT_PARTITION_SCHEME,
+)
+
+logger = get_logger("metric_retention")
+
+FACT_TABLE_NAME = "FACT_EVALUATION_METRIC"
+FACT_TIME_COLUMN = "fact_creation_time"
+ARCHIVE_BATCH_SIZE = 100000
+
+
+def add_months(month_start: datetime.datetime, months: int) -> datetime.datetime:
+    """
+    Returns the first day of the month shifted by the given number of months.
+    """
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return datetime.datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+class FactMetricRetention:
+    """
+    Keeps FACT_EVALUATION_METRIC bounded by moving the months older than the retention period
+    to parquet files in the evaluation datastore.
+
+    Each expired month is exported with year/month partitions, its row count is checked against the
+    table and only then is it removed from the table. On a partitioned Azure SQL table the removal is a
+    partition truncate, otherwise the rows are deleted in batches. The daily rollup table is left untouched,
+    so dashboards keep the aggregated history.
+    """
+
+    def __init__(self, db_handler: DBHandler, adls_handler: ADLSHandler = None,
+                 archive_batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.db_handler = db_handler
+        self.adls_handler = adls_handler or ADLSHandler()
+        self.archive_batch_size = archive_batch_size
+
+    @staticmethod
+    def get_cutoff_month(retention_months: int, today: datetime.date = None) -> datetime.datetime:
+        """
+        Returns the first month kept in the table. Every month before it is archived.
+
+        Args:
+            retention_months (int): The number of months kept in the table, including the current month.
+            today (datetime.date): The reference date. Defaults to today.
+
+        Returns:
+            datetime.datetime: The first day of the oldest month kept in the table.
+        """
+        if retention_months < 1:
+            raise ValueError(f"Invalid retention period {retention_months}. At least one month must be kept")
+        today = today or datetime.date.today()
+        return add_months(datetime.datetime(today.year, today.month, 1), 1 - retention_months)
+
+    def get_expired_months(self, cutoff_month: datetime.datetime) -> List[datetime.datetime]:
+        """
+        Returns the months with rows older than the cutoff month, oldest first.
+
+        Args:
+            cutoff_month (datetime.datetime): The first month kept in the table.
+
+        Returns:
+            List[datetime.datetime]: The first day of each expired month.
+        """
+        rows = self.db_handler.execute_query(
+            f"SELECT MIN({FACT_TIME_COLUMN}) AS first_fact_time FROM {FACT_TABLE_NAME} WHERE {FACT_TIME_COLUMN} < ?",
+            (cutoff_month,),
+        )
+        first_fact_time = rows[0]["first_fact_time"] if rows else None
+        if first_fact_time is None:
+            return []
+        if isinstance(first_fact_time, str):
+            first_fact_time = datetime.datetime.fromisoformat(first_fact_time)
+
+        expired_months = []
+        month = datetime.datetime(first_fact_time.year, first_fact_time.month, 1)
+        while month < cutoff_month:
+            expired_months.append(month)
+            month = add_months(month, 1)
+        return expired_months
+
+    def count_rows(self, month_start: datetime.datetime) -> int:
+        """
+        Returns the number of rows of the table in the given month.
+        """
+        rows = self.db_handler.execute_query(
+            f"SELECT COUNT(*) AS row_count FROM {FACT_TABLE_NAME} \
+              WHERE {FACT_TIME_COLUMN} >= ? AND {FACT_TIME_COLUMN} < ?",
+            (month_start, add_months(month_start, 1)),
+        )
+        return rows[0]["row_count"]
+
+    def archive_month(self, archive_path: str, month_start: datetime.datetime) -> int:
+        """
+        Exports the rows of a month to parquet, streaming the result set in batches.
+
+        Args:
+            archive_path (str): The root path of the archive.
+            month_start (datetime.datetime): The first day of the month to export.
+
+        Returns:
+            int: The number of rows exported.
+        """
+        query = f"SELECT * FROM {FACT_TABLE_NAME} WHERE {FACT_TIME_COLUMN} >= ? AND {FACT_TIME_COLUMN} < ?"
+        archived_row_count = 0
+        batches = self.db_handler.stream_query(
+            query, (month_start, add_months(month_start, 1)), self.archive_batch_size, batch_format="dataframe"
+        )
+        for batch_index, df_batch in enumerate(batches):
+            self.adls_handler.write_fact_archive(archive_path, df_batch, FACT_TIME_COLUMN, batch_index)
+            archived_row_count += df_batch.shape[0]
+        logger.info(f"Archived {archived_row_count} rows of {month_start:%Y-%m} to {archive_path}")
+        return archived_row_count
+
+    def purge_month(self, month_start: datetime.datetime):
+        """
+        Removes the rows of a month from the table.
+        """
+        query, params = self.db_handler.dialect.build_purge_range_statement(
+            FACT_TABLE_NAME, FACT_TIME_COLUMN, month_start, add_months(month_start, 1), FACT_PARTITION_FUNCTION
+        )
+        self.db_handler.execute_non_query(query, params)
+        logger.info(f"Removed {month_start:%Y-%m} from {FACT_TABLE_NAME}")
+
+    def maintain_partitions(self, cutoff_month: datetime.datetime, months_ahead: int = FACT_PARTITION_MONTHS_AHEAD):
+        """
+        Adds the partitions of the upcoming months and merges the emptied partitions older than the cutoff month.
+        Does nothing when the database engine or the table is not partitioned.
+        """
+        statements = self.db_handler.dialect.build_partition_maintenance_statements(
+            FACT_PARTITION_FUNCTION, FACT_PARTITION_SCHEME, cutoff_month, months_ahead
+        )
+        for query, params in statements:
+            self.db_handler.execute_non_query(query, params)
+
+    def run(self, archive_path: str, retention_months: int, dry_run: bool = False) -> List[datetime.datetime]:
+        """
+        Archives and removes every month older than the retention period.
+
+        All expired months are exported before any of them is removed, since a partition truncate
+        may cover more than one month when the oldest boundaries have been merged.
+
+        Args:
+            archive_path (str): The root path of the archive.
+            retention_months (int): The number of months kept in the table, including the current month.
+            dry_run (bool): If True, only logs the months that would be archived.
+
+        Returns:
+            List[datetime.datetime]: The months archived.
+        """
+        cutoff_month = self.get_cutoff_month(retention_months)
+        expired_months = self.get_expired_months(cutoff_month)
+        logger.info(f"Found {len(expired_months)} month(s) older than {cutoff_month:%Y-%m} in {FACT_TABLE_NAME}")
+        if dry_run:
+            logger.info(f"Dry run, months not archived: {[f'{month:%Y-%m}' for month in expired_months]}")
+            return expired_months
+
+        for month_start in expired_months:
+            table_row_count = self.count_rows(month_start)
+            archived_row_count = self.archive_month(archive_path, month_start)
+            if archived_row_count != table_row_count:
+                error_msg = f"Archived {archived_row_count} rows of {month_start:%Y-%m} " \
+                            f"but the table has {table_row_count} rows. Nothing has been removed"
+                logger.error(error_msg)
+                raise ValueError(error_msg)
+
+        for month_start in expired_months:
+            self.purge_month(month_start)
+        self.maintain_partitions(cutoff_month)
+        return expired_months
@@ -0,0 +1,151 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import datetime
+import json
+from typing import Iterable, List
+
+from llmevalgrader.common.db_handler import DBHandler
+from llmevalgrader.common.entities import AggDailyEvaluationMetric, FactEvaluationMetric
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("metric_rollup")
+
+DEFAULT_HISTOGRAM_BUCKET_EDGES = [1, 2, 3, 4, 5]
+MISSING_KEY_VALUE = "NA"
+
+# The app_name column is selected as NULL from databases not yet migrated, see schema_migrations.
+DAILY_FACTS_QUERY = """SELECT F.metric_id, D.metric_version, {app_name_column} AS app_name, F.metadata_id,
+    F.metric_numeric_value, F.metric_str_value
+    FROM FACT_EVALUATION_METRIC F
+    INNER JOIN DIM_METRIC D ON F.metric_id = D.metric_id
+    WHERE F.fact_creation_time >= ? AND F.fact_creation_time < ?"""
+
+
+class DailyMetricRollup:
+    """
+    Maintains the AGG_DAILY_EVALUATION_METRIC table, a daily pre-aggregation of FACT_EVALUATION_METRIC
+    keyed by day, metric, metric version, app and metadata (model and intent).
+
+    Only the days touched by a run are recomputed from the fact table, so the cost of a rollup
+    is proportional to the rows of those days and dashboards can read one row per key and day.
+    """
+
+    def __init__(self, db_handler: DBHandler, histogram_bucket_edges: List[float] = None):
+        self.db_handler = db_handler
+        self.histogram_bucket_edges = sorted(histogram_bucket_edges or DEFAULT_HISTOGRAM_BUCKET_EDGES)
+
+    @staticmethod
+    def get_touched_dates(fact_evaluation_metric_list: Iterable[FactEvaluationMetric]) -> List[datetime.date]:
+        """
+        Returns the distinct days of the given fact rows.
+
+        Args:
+            fact_evaluation_metric_list (Iterable[FactEvaluationMetric]): The fact rows written by the current run.
+
+        Returns:
+            List[datetime.date]: The sorted list of days touched by the run.
+        """
+        touched_dates = set()
+        for fact in fact_evaluation_metric_list:
+            fact_creation_time = fact.fact_creation_time
+            if isinstance(fact_creation_time, str):
+                fact_creation_time = datetime.datetime.strptime(fact_creation_time, "%Y-%m-%d %H:%M:%S")
+            if fact_creation_time is not None:
+                touched_dates.add(fact_creation_time.date())
+        return sorted(touched_dates)
+
+    def _get_histogram_bucket(self, value: float) -> str:
+        """
+        Returns the histogram bucket label of a numeric value, i.e. the largest bucket edge
+        lower than or equal to the value.
+        """
+        bucket = f"<{self.histogram_bucket_edges[0]:g}"
+        for edge in self.histogram_bucket_edges:
+            if value >= edge:
+                bucket = f"{edge:g}"
+            else:
+                break
+        return bucket
+
+    def compute_daily_rollup(self, metric_date: datetime.date) -> List[AggDailyEvaluationMetric]:
+        """
+        Recomputes the aggregates of a single day from FACT_EVALUATION_METRIC.
+
+        Numerical metrics get count, sum, min, max and a histogram over the bucket edges.
+        Categorical metrics get count and a histogram over the distinct string values.
+
+        Args:
+            metric_date (datetime.date): The day to recompute.
+
+        Returns:
+            List[AggDailyEvaluationMetric]: One aggregate row per key for the day.
+        """
+        day_start = datetime.datetime.combine(metric_date, datetime.time.min)
+        day_end = day_start + datetime.timedelta(days=1)
+        fact_columns = self.db_handler.get_table_columns("FACT_EVALUATION_METRIC")
+        daily_facts_query = DAILY_FACTS_QUERY.format(
+            app_name_column="F.app_name" if "app_name" in fact_columns else "NULL"
+        )
+        aggregates = {}
+        for batch in self.db_handler.stream_query(daily_facts_query, (day_start, day_end)):
+            for row in batch:
+                key = (
+                    row["metric_id"],
+                    str(row["metric_version"]),
+                    row["app_name"] or MISSING_KEY_VALUE,
+                    row["metadata_id"] or MISSING_KEY_VALUE,
+                )
+                aggregate = aggregates.setdefault(
+                    key, {"count": 0, "sum": None, "min": None, "max": None, "histogram": {}}
+                )
+                aggregate["count"] += 1
+                value = row["metric_numeric_value"]
+                if value is not None:
+                    aggregate["sum"] = value if aggregate["sum"] is None else aggregate["sum"] + value
+                    aggregate["min"] = value if aggregate["min"] is None else min(aggregate["min"], value)
+                    aggregate["max"] = value if aggregate["max"] is None else max(aggregate["max"], value)
+                    bucket = self._get_histogram_bucket(value)
+                else:
+                    bucket = str(row["metric_str_value"])
+                aggregate["histogram"][bucket] = aggregate["histogram"].get(bucket, 0) + 1
+
+        updated_date = datetime.datetime.now()
+        return [
+            AggDailyEvaluationMetric(
+                metric_date=metric_date,
+                metric_id=metric_id,
+                metric_version=metric_version,
+                app_name=app_name,
+                metadata_id=metadata_id,
+                metric_count=aggregate["count"],
+                metric_sum=aggregate["sum"],
+                metric_min=aggregate["min"],
+                metric_max=aggregate["max"],
+                metric_histogram=json.dumps(aggregate["histogram"], sort_keys=True),
+                updated_by="system",
+                updated_date=updated_date,
+            )
+            for (metric_id, metric_version, app_name, metadata_id), aggregate in aggregates.items()
+        ]
+
+    def run(self, fact_evaluation_metric_list: List[FactEvaluationMetric]) -> int:
+        """
+        Recomputes and upserts the daily aggregates for every day touched by the given fact rows.
+
+        Args:
+            fact_evaluation_metric_list (List[FactEvaluationMetric]): The fact rows written by the current run.
+
+        Returns:
+            int: The number of aggregate rows written.
+        """
+        touched_dates = self.get_touched_dates(fact_evaluation_metric_list)
+        logger.info(f"Recomputing daily metric rollup for {len(touched_dates)} day(s): {touched_dates}")
+        unique_columns = ["metric_date", "metric_id", "app_name", "metadata_id"]
+        rollup_row_count = 0
+        for metric_date in touched_dates:
+            daily_rollup = self.compute_daily_rollup(metric_date)
+            self.db_handler.upsert_into_table("AGG_DAILY_EVALUATION_METRIC", daily_rollup, unique_columns)
+            rollup_row_count += len(daily_rollup)
+        logger.info(f"Upserted {rollup_row_count} rows into AGG_DAILY_EVALUATION_METRIC table.")
+        return rollup_row_count
@@ -0,0 +1,238 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import re
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("near_duplicates")
+
+NEAR_DUPLICATES_COLUMN = "near_duplicates"
+# The fields of a near duplicate row kept with its representative, to write its metrics.
+NEAR_DUPLICATE_MEMBER_COLUMNS = ["evaluation_dataset_id", "conversation_id", "metadata_id", "turn_id", "timestamp",
+                                 "app_name"]
+# The fields compared, the context included since the grade of a turn depends on the conversation before it.
+NEAR_DUPLICATE_TEXT_COLUMNS = ["query", "context", "response"]
+DEFAULT_NUM_PERM = 64
+DEFAULT_SHINGLE_SIZE = 5
+# Prime above 2**32, the modulus of the permutations of the MinHash signatures.
+MINHASH_PRIME = np.uint64(4294967311)
+# Number of shingles hashed at once, which bounds the memory of the permutations to about 50 MB.
+MINHASH_CHUNK_SHINGLES = 100_000
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text for the comparison of near duplicates: lower case, punctuation and runs of whitespace
+    replaced with a single space.
+    """
+    return re.sub(r"[\W_]+", " ", str(text).lower()).strip()
+
+
+def get_lsh_bands(threshold: float, num_perm: int) -> tuple:
+    """
+    Returns the number of bands and of rows per band of the LSH index of MinHash signatures, such that pairs
+    above the similarity threshold are likely candidates. The threshold of the bands, (1 / bands) ** (1 / rows),
+    is the highest one below the similarity threshold, the false positives being removed when the candidates
+    are verified.
+
+    Args:
+        threshold (float): The Jaccard similarity of near duplicates.
+        num_perm (int): The number of permutations of the signatures.
+
+    Returns:
+        tuple: The number of bands and the number of rows per band.
+    """
+    bands_and_rows = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below_threshold = [(bands, rows) for bands, rows in bands_and_rows if (1 / bands) ** (1 / rows) <= threshold]
+    if not below_threshold:
+        return num_perm, 1
+    return max(below_threshold, key=lambda band: (1 / band[0]) ** (1 / band[1]))
+
+
+def hash_shingles(texts: List[str], shingle_size: int = DEFAULT_SHINGLE_SIZE) -> tuple:
+    """
+    Hashes the character shingles of the texts, all texts at once.
+
+    Args:
+        texts (List[str]): The texts, shorter texts are padded to one shingle.
+        shingle_size (int): The number of bytes of a shingle.
+
+    Returns:
+        tuple: The 32 bit hashes of the shingles of all texts, in order, and the position of the first shingle
+            of each text.
+    """
+    texts_bytes = [text.encode("utf-8").ljust(shingle_size) for text in texts]
+    text_lengths = np.fromiter((len(text_bytes) for text_bytes in texts_bytes), dtype=np.int64, count=len(texts))
+    data = np.frombuffer(b"".join(texts_bytes), dtype=np.uint8).astype(np.uint64)
+    # Polynomial hash of every window of the concatenated texts, wrapping around 2**64.
+    powers = np.uint64(257) ** np.arange(shingle_size - 1, -1, -1, dtype=np.uint64)
+    window_hashes = np.lib.stride_tricks.sliding_window_view(data, shingle_size) @ powers
+    window_hashes = (window_hashes * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+
+    # The windows across two texts are dropped.
+    shingle_counts = text_lengths - shingle_size + 1
+    shingle_offsets = np.concatenate([[0], np.cumsum(shingle_counts)[:-1]])
+    text_offsets = np.concatenate([[0], np.cumsum(text_lengths)[:-1]])
+    window_positions = np.repeat(text_offsets - shingle_offsets, shingle_counts) + np.arange(shingle_counts.sum())
+    return window_hashes[window_positions], shingle_offsets
+
+
+def compute_minhash_signatures(
+    texts: List[str],
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Computes the MinHash signatures of the character shingles of the texts. The share of equal values of two
+    signatures estimates the Jaccard similarity of the shingles of the texts.
+
+    Args:
+        texts (List[str]): The texts.
+        num_perm (int): The number of permutations, the length of the signatures.
+        shingle_size (int): The number of bytes of a shingle.
+        seed (int): The seed of the permutations.
+
+    Returns:
+        np.ndarray: The signature of each text, of shape (len(texts), num_perm).
+    """
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    if len(texts) == 0:
+        return signatures
+    random_state = np.random.RandomState(seed)
+    # Below 2**31, so that the permutations do not overflow 64 bits.
+    a = random_state.randint(1, 2 ** 31, size=num_perm, dtype=np.int64).astype(np.uint64)[:, None]
+    b = random_state.randint(0, 2 ** 31, size=num_perm, dtype=np.int64).astype(np.uint64)[:, None]
+
+    shingle_hashes, shingle_offsets = hash_shingles(texts, shingle_size)
+    shingle_ends = np.append(shingle_offsets[1:], len(shingle_hashes))
+    start = 0
+    while start < len(texts):
+        # The texts of a chunk, at least one, up to the chunk size of shingles.
+        end = max(start + 1, int(np.searchsorted(shingle_ends, shingle_offsets[start] + MINHASH_CHUNK_SHINGLES,
+                                                 side="right")))
+        chunk_hashes = shingle_hashes[shingle_offsets[start]:shingle_ends[end - 1]]
+        permuted_hashes = (a * chunk_hashes[None, :] + b) % MINHASH_PRIME
+        signatures[start:end] = np.minimum.reduceat(
+            permuted_hashes, shingle_offsets[start:end] - shingle_offsets[start], axis=1
+        ).T
+        start = end
+    return signatures
+
+
+def _find(parents: np.ndarray, position: int) -> int:
+    while parents[position] != position:
+        parents[position] = parents[parents[position]]
+        position = parents[position]
+    return position
+
+
+def cluster_near_duplicates(
+    texts: List[str],
+    threshold: float,
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+) -> np.ndarray:
+    """
+    Clusters the near duplicate texts, the texts of about the threshold Jaccard similarity of their character
+    shingles, after normalization. The texts equal after normalization are grouped first, and the MinHash
+    signatures of the distinct texts are indexed with LSH, which only compares the texts sharing a band of
+    their signatures.
+
+    Args:
+        texts (List[str]): The texts.
+        threshold (float): The Jaccard similarity of near duplicates, 1.0 to only group equal texts after
+            normalization.
+        num_perm (int): The number of permutations of the MinHash signatures.
+        shingle_size (int): The number of bytes of a shingle.
+
+    Returns:
+        np.ndarray: The position of the representative of the cluster of each text, the first text of the
+            cluster.
+    """
+    text_codes, distinct_texts = pd.factorize(pd.Series([normalize_text(text) for text in texts], dtype=object))
+    parents = np.arange(len(distinct_texts))
+
+    if threshold < 1.0 and len(distinct_texts) > 1:
+        signatures = compute_minhash_signatures(list(distinct_texts), num_perm, shingle_size)
+        bands, rows = get_lsh_bands(threshold, num_perm)
+        band_multipliers = np.random.RandomState(1).randint(1, 2 ** 62, size=rows, dtype=np.int64).astype(np.uint64) | 1
+        for band in range(bands):
+            band_hashes = signatures[:, band * rows:(band + 1) * rows] @ band_multipliers
+            # The candidates of a bucket are compared with the first text of the bucket.
+            order = np.argsort(band_hashes, kind="stable")
+            sorted_hashes = band_hashes[order]
+            bucket_starts = np.flatnonzero(np.r_[True, sorted_hashes[1:] != sorted_hashes[:-1]])
+            bucket_leaders = order[np.repeat(bucket_starts, np.diff(np.r_[bucket_starts, len(order)]))]
+            candidates = order != bucket_leaders
+            leaders, members = bucket_leaders[candidates], order[candidates]
+            similarities = (signatures[leaders] == signatures[members]).mean(axis=1)
+            for leader, member in zip(leaders[similarities >= threshold], members[similarities >= threshold]):
+                leader_root, member_root = _find(parents, leader), _find(parents, member)
+                if leader_root != member_root:
+                    # The first text of a cluster is its root.
+                    parents[max(leader_root, member_root)] = min(leader_root, member_root)
+
+    distinct_roots = np.array([_find(parents, position) for position in range(len(distinct_texts))], dtype=np.int64)
+    # The representative of a cluster is its first text, a cluster of distinct texts starts at the first
+    # text of its first distinct text.
+    first_positions = np.full(len(distinct_texts), len(texts), dtype=np.int64)
+    np.minimum.at(first_positions, distinct_roots[text_codes], np.arange(len(texts)))
+    return first_positions[distinct_roots[text_codes]]
+
+
+def collapse_near_duplicates(
+    eval_fact_df: pd.DataFrame,
+    threshold: float,
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+) -> pd.DataFrame:
+    """
+    Keeps one representative of each cluster of near duplicate (query, context, response) triples, the earliest
+    row, so that only the representatives are graded. The context is the one built by build_context, compared when
+    the column is present. The fields of the other rows of the cluster, see
+    NEAR_DUPLICATE_MEMBER_COLUMNS, are kept in the near_duplicates column of their representative, and the
+    metrics of the representative are written for them too by write_metrics.
+
+    Args:
+        eval_fact_df (pd.DataFrame): The evaluation rows.
+        threshold (float): The Jaccard similarity of near duplicates, see cluster_near_duplicates.
+        num_perm (int): The number of permutations of the MinHash signatures.
+        shingle_size (int): The number of bytes of a shingle.
+
+    Returns:
+        pd.DataFrame: The representatives, in the order of their timestamp, with the near_duplicates column.
+    """
+    eval_fact_df = eval_fact_df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+    text_columns = [column for column in NEAR_DUPLICATE_TEXT_COLUMNS if column in eval_fact_df.columns]
+    texts = ["\n".join(str(value) for value in values)
+             for values in zip(*(eval_fact_df[column] for column in text_columns))]
+    representatives = cluster_near_duplicates(texts, threshold, num_perm, shingle_size)
+
+    is_representative = representatives == np.arange(len(eval_fact_df))
+    member_columns = [column for column in NEAR_DUPLICATE_MEMBER_COLUMNS if column in eval_fact_df.columns]
+    members = eval_fact_df.loc[~is_representative, member_columns].to_dict(orient="records")
+    near_duplicates = [[] for _ in range(len(eval_fact_df))]
+    for representative, member in zip(representatives[~is_representative], members):
+        near_duplicates[representative].append(member)
+
+    representative_df = eval_fact_df[is_representative].copy()
+    representative_df[NEAR_DUPLICATES_COLUMN] = [near_duplicates[position]
+                                                 for position in np.flatnonzero(is_representative)]
+    logger.info(f"Collapsed {len(eval_fact_df)} rows into {len(representative_df)} representatives of near "
+                f"duplicate {', '.join(text_columns)} texts at a similarity of {threshold}")
+    return representative_df.reset_index(drop=True)
+
+
+def get_near_duplicate_metadata(representative_id: str, representative_metadata: str = None) -> str:
+    """
+    Returns the evaluator_metadata of the metrics of a near duplicate row, copied from its representative, the
+    evaluator_metadata of the representative with a reference to it.
+    """
+    return json.dumps({**json.loads(representative_metadata or "{}"), "near_duplicate_of": str(representative_id)})
@@ -0,0 +1,347 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import datetime
+import json
+import os
+import re
+import zlib
+from itertools import chain
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("prescreen_model")
+
+MODEL_FILE_NAME = "prescreen_model.npz"
+METADATA_FILE_NAME = "prescreen_model.json"
+PRESCREEN_ROUTE_COLUMN = "prescreen_route"
+PRESCREEN_SCORE_COLUMN = "prescreen_score"
+# Routes of a row: scored by the pre-screen model, or graded by the LLM as an audit of a confident prediction,
+# a prediction below the skip threshold or a low prediction.
+PRESCREEN_ROUTE = "prescreen"
+AUDIT_ROUTE = "audit"
+UNCERTAIN_ROUTE = "uncertain"
+LOW_ROUTE = "low"
+DENSE_FEATURE_NAMES = ["query_overlap", "query_words", "response_words"]
+
+
+def get_words(text: str) -> List[str]:
+    """
+    Returns the lower case words of a text.
+    """
+    return re.findall(r"\w+", str(text).lower())
+
+
+def get_tokens(query: str, response: str) -> List[str]:
+    """
+    Returns the tokens of a (query, response) pair: the words of the query, the words and word pairs of the
+    response, and the words of the query found in the response, each with the prefix of its kind.
+    """
+    query_words = get_words(query)
+    response_words = get_words(response)
+    shared_words = set(query_words).intersection(response_words)
+    return (
+        ["q:" + word for word in query_words]
+        + ["r:" + word for word in response_words]
+        + ["r:" + first + "_" + second for first, second in zip(response_words, response_words[1:])]
+        + ["s:" + word for word in sorted(shared_words)]
+    )
+
+
+def get_dense_features(queries: List[str], responses: List[str]) -> np.ndarray:
+    """
+    Returns the dense features of the (query, response) pairs, see DENSE_FEATURE_NAMES.
+    """
+    features = np.zeros((len(queries), len(DENSE_FEATURE_NAMES)))
+    for position, (query, response) in enumerate(zip(queries, responses)):
+        query_words = set(get_words(query))
+        response_words = get_words(response)
+        features[position] = [
+            len(query_words.intersection(response_words)) / max(1, len(query_words)),
+            np.log1p(len(query_words)),
+            np.log1p(len(response_words)),
+        ]
+    return features
+
+
+class PrescreenModel:
+    """
+    Lightweight model of the LLM grade of a (query, response) pair, a ridge regression on the TF-IDF of its
+    tokens, see get_tokens, and a few dense features, trained on the grades of previous evaluation runs. Only
+    numpy is needed to train it and score with it, on CPU.
+
+    The model scores the rows whose predicted grade is above a skip threshold, calibrated on held-out grades so
+    that most of them are graded at least high_score by the LLM, and the other rows are graded by the LLM.
+
+    Args:
+        vocabulary (List[str]): The tokens of the TF-IDF features.
+        idf (np.ndarray): The inverse document frequency of each token.
+        coefficients (np.ndarray): The coefficients of the tokens, then of the dense features, then the intercept.
+        dense_mean (np.ndarray): The mean of the dense features, to standardize them.
+        dense_std (np.ndarray): The standard deviation of the dense features, to standardize them.
+        metadata (dict): The metric, the skip threshold, the score range and the training metrics of the model.
+    """
+
+    def __init__(self, vocabulary: List[str], idf: np.ndarray, coefficients: np.ndarray, dense_mean: np.ndarray,
+                 dense_std: np.ndarray, metadata: dict = None):
+        self.vocabulary = pd.Index(vocabulary)
+        self.idf = idf
+        self.coefficients = coefficients
+        self.dense_mean = dense_mean
+        self.dense_std = dense_std
+        self.metadata = metadata or {}
+
+    def _transform(self, queries: List[str], responses: List[str]) -> tuple:
+        """
+        Returns the sparse TF-IDF features, as the row, column and value of each non-zero feature, and the
+        standardized dense features of the pairs.
+        """
+        token_lists = [get_tokens(query, response) for query, response in zip(queries, responses)]
+        columns = self.vocabulary.get_indexer(list(chain.from_iterable(token_lists)))
+        rows = np.repeat(np.arange(len(token_lists)), [len(tokens) for tokens in token_lists])
+        known = columns >= 0
+        # The counts of each token of each row, with sublinear term frequencies and L2 normalized rows.
+        keys, term_counts = np.unique(rows[known] * len(self.vocabulary) + columns[known], return_counts=True)
+        rows, columns = np.divmod(keys, len(self.vocabulary))
+        values = (1 + np.log(term_counts)) * self.idf[columns]
+        row_norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(token_lists)))
+        values = values / row_norms[rows]
+        dense = (get_dense_features(queries, responses) - self.dense_mean) / self.dense_std
+        return (rows, columns, values), dense
+
+    def _dot(self, features: tuple, coefficients: np.ndarray) -> np.ndarray:
+        (rows, columns, values), dense = features
+        return (np.bincount(rows, weights=values * coefficients[columns], minlength=len(dense))
+                + dense @ coefficients[len(self.vocabulary):-1] + coefficients[-1])
+
+    def _transpose_dot(self, features: tuple, residuals: np.ndarray) -> np.ndarray:
+        (rows, columns, values), dense = features
+        return np.concatenate([
+            np.bincount(columns, weights=values * residuals[rows], minlength=len(self.vocabulary)),
+            dense.T @ residuals,
+            [residuals.sum()],
+        ])
+
+    def predict(self, queries: List[str], responses: List[str]) -> np.ndarray:
+        """
+        Predicts the grades of (query, response) pairs.
+
+        Args:
+            queries (List[str]): The queries.
+            responses (List[str]): The responses.
+
+        Returns:
+            np.ndarray: The predicted grade of each pair, within the grades of the training rows.
+        """
+        if len(queries) == 0:
+            return np.zeros(0)
+        predictions = self._dot(self._transform(queries, responses), self.coefficients)
+        return np.clip(predictions, self.metadata.get("min_score", -np.inf), self.metadata.get("max_score", np.inf))
+
+    @classmethod
+    def fit(
+        cls,
+        queries: List[str],
+        responses: List[str],
+        scores: List[float],
+        max_features: int = 50000,
+        min_document_frequency: int = 2,
+        alpha: float = 1.0,
+        max_iterations: int = 200,
+        tolerance: float = 1e-6,
+    ):
+        """
+        Trains a model on the grades of (query, response) pairs. The ridge regression is solved with the
+        conjugate gradient method on its normal equations, the intercept is not regularized.
+
+        Args:
+            queries (List[str]): The queries.
+            responses (List[str]): The responses.
+            scores (List[float]): The LLM grade of each pair.
+            max_features (int): The number of tokens of the TF-IDF features, the most frequent ones.
+            min_document_frequency (int): The number of pairs a token must be found in.
+            alpha (float): The regularization of the coefficients.
+            max_iterations (int): The iterations of the conjugate gradient method.
+            tolerance (float): The relative residual at which the conjugate gradient method stops.
+
+        Returns:
+            PrescreenModel: The trained model.
+        """
+        scores = np.asarray(scores, dtype=float)
+        document_tokens = pd.Series(list(chain.from_iterable(
+            set(get_tokens(query, response)) for query, response in zip(queries, responses)
+        )), dtype=object)
+        document_frequencies = document_tokens.value_counts()
+        document_frequencies = document_frequencies[document_frequencies >= min_document_frequency]
+        document_frequencies = document_frequencies.sort_index().sort_values(ascending=False, kind="stable")
+        document_frequencies = document_frequencies.iloc[:max_features]
+        idf = np.log((1 + len(scores)) / (1 + document_frequencies.to_numpy(dtype=float))) + 1
+
+        dense = get_dense_features(queries, responses)
+        dense_std = dense.std(axis=0)
+        model = cls(document_frequencies.index.to_list(), idf, np.zeros(len(idf) + len(DENSE_FEATURE_NAMES) + 1),
+                    dense.mean(axis=0), np.where(dense_std > 0, dense_std, 1.0),
+                    {"min_score": float(scores.min()), "max_score": float(scores.max())})
+        features = model._transform(queries, responses)
+        regularization = np.full(len(model.coefficients), alpha)
+        regularization[-1] = 0.0
+
+        def normal_dot(coefficients):
+            return model._transpose_dot(features, model._dot(features, coefficients)) + regularization * coefficients
+
+        # Conjugate gradient on (X'X + alpha I) w = X'y, X'X being positive semi-definite.
+        target = model._transpose_dot(features, scores)
+        coefficients = np.zeros(len(model.coefficients))
+        residual = target.copy()
+        direction = residual.copy()
+        residual_norm = residual @ residual
+        for iteration in range(max_iterations):
+            if np.sqrt(residual_norm) <= tolerance * np.linalg.norm(target):
+                break
+            normal_direction = normal_dot(direction)
+            step = residual_norm / (direction @ normal_direction)
+            coefficients += step * direction
+            residual -= step * normal_direction
+            previous_residual_norm, residual_norm = residual_norm, residual @ residual
+            direction = residual + residual_norm / previous_residual_norm * direction
+        model.coefficients = coefficients
+        logger.info(f"Trained the pre-screen model on {len(scores)} rows with {len(idf)} tokens in "
+                    f"{iteration + 1} iterations")
+        return model
+
+    def save(self, model_path: str):
+        """
+        Saves the model in a folder, without pickles.
+        """
+        np.savez_compressed(
+            os.path.join(model_path, MODEL_FILE_NAME),
+            vocabulary=np.array(self.vocabulary.to_list(), dtype=str),
+            idf=self.idf,
+            coefficients=self.coefficients,
+            dense_mean=self.dense_mean,
+            dense_std=self.dense_std,
+        )
+        with open(os.path.join(model_path, METADATA_FILE_NAME), "w") as file:
+            json.dump(self.metadata, file, indent=2)
+
+    @classmethod
+    def load(cls, model_path: str):
+        """
+        Loads the model saved in a folder.
+        """
+        with np.load(os.path.join(model_path, MODEL_FILE_NAME), allow_pickle=False) as arrays:
+            model_arrays = {name: arrays[name] for name in arrays.files}
+        with open(os.path.join(model_path, METADATA_FILE_NAME), "r") as file:
+            metadata = json.load(file)
+        return cls(model_arrays["vocabulary"].tolist(), model_arrays["idf"], model_arrays["coefficients"],
+                   model_arrays["dense_mean"], model_arrays["dense_std"], metadata)
+
+
+def calibrate_skip_threshold(predictions: np.ndarray, scores: np.ndarray, high_score: float,
+                             target_precision: float, min_support: int = 50) -> dict:
+    """
+    Returns the lowest skip threshold of the predictions, at least high_score, such that the share of the
+    held-out rows predicted at or above it and graded at least high_score by the LLM reaches the target
+    precision.
+
+    Args:
+        predictions (np.ndarray): The predicted grades of the held-out rows.
+        scores (np.ndarray): The LLM grades of the held-out rows.
+        high_score (float): The lowest grade of a high relevance row.
+        target_precision (float): The share of skipped rows of a high relevance grade.
+        min_support (int): The number of held-out rows the threshold must skip.
+
+    Returns:
+        dict: The skip_threshold, infinite when no threshold reaches the target precision, with the coverage,
+            the share of the held-out rows skipped, and the precision on them.
+    """
+    order = np.argsort(-predictions, kind="stable")
+    sorted_predictions = predictions[order]
+    precisions = np.cumsum(np.asarray(scores)[order] >= high_score) / np.arange(1, len(order) + 1)
+    # The rows tied with a skipped row are skipped too, the threshold ends a group of tied predictions.
+    ends_tie = np.r_[sorted_predictions[:-1] > sorted_predictions[1:], True]
+    valid = np.flatnonzero((precisions >= target_precision) & (np.arange(1, len(order) + 1) >= min_support)
+                           & (sorted_predictions >= high_score) & ends_tie)
+    if len(valid) == 0:
+        return {"skip_threshold": float("inf"), "coverage": 0.0, "precision": 0.0}
+    last = valid[-1]
+    return {
+        "skip_threshold": float(sorted_predictions[last]),
+        "coverage": float((last + 1) / len(order)),
+        "precision": float(precisions[last]),
+    }
+
+
+def get_audit_draw(evaluation_dataset_id: str) -> float:
+    """
+    Returns the audit draw of a row, in [0, 1), the row being audited, i.e. graded by the LLM even though the
+    model is confident, below the audit rate. The draw is a hash of the row id, so that the retries of a row
+    take the same route.
+    """
+    return zlib.crc32(str(evaluation_dataset_id).encode("utf-8")) / 2 ** 32
+
+
+def prescreen_rows(eval_fact_df: pd.DataFrame, model: PrescreenModel, audit_rate: float = 0.05) -> tuple:
+    """
+    Pre-scores the evaluation rows with the model and routes them, the confident high grades to the model and
+    the other rows, with a share of audits of the confident ones, to the LLM. When the model is confident of
+    every row and none is drawn for audit, the row of the lowest audit draw is audited, so that the LLM grades
+    at least one row and the evaluation runs.
+
+    Args:
+        eval_fact_df (pd.DataFrame): The evaluation rows, with query and response.
+        model (PrescreenModel): The pre-screen model.
+        audit_rate (float): The share of the confident rows graded by the LLM too.
+
+    Returns:
+        tuple: The rows graded by the LLM and the rows scored by the model, with the prescreen_score and
+            prescreen_route columns.
+    """
+    eval_fact_df = eval_fact_df.copy()
+    predictions = model.predict(eval_fact_df["query"].to_list(), eval_fact_df["response"].to_list())
+    confident = predictions >= model.metadata["skip_threshold"]
+    audit_draws = np.array([get_audit_draw(evaluation_dataset_id)
+                            for evaluation_dataset_id in eval_fact_df["evaluation_dataset_id"]], dtype=float)
+    audited = audit_draws < audit_rate
+    if len(eval_fact_df) > 0 and (confident & ~audited).all():
+        audited[np.argmin(audit_draws)] = True
+    eval_fact_df[PRESCREEN_SCORE_COLUMN] = np.round(predictions, 4)
+    eval_fact_df[PRESCREEN_ROUTE_COLUMN] = np.select(
+        [confident & ~audited, confident, predictions >= model.metadata["high_score"]],
+        [PRESCREEN_ROUTE, AUDIT_ROUTE, UNCERTAIN_ROUTE],
+        LOW_ROUTE,
+    )
+    is_prescreened = eval_fact_df[PRESCREEN_ROUTE_COLUMN] == PRESCREEN_ROUTE
+    logger.info(f"Pre-screened {int(is_prescreened.sum())} of {len(eval_fact_df)} rows, "
+                f"{int((confident & audited).sum())} confident rows audited")
+    return eval_fact_df[~is_prescreened], eval_fact_df[is_prescreened]
+
+
+def get_prescreen_metadata(route: str, score: float) -> str:
+    """
+    Returns the evaluator_metadata of a pre-screened row, the path which scored it and the predicted grade.
+    """
+    return json.dumps({
+        "scored_by": PRESCREEN_ROUTE if route == PRESCREEN_ROUTE else "llm",
+        "prescreen_route": route,
+        "prescreen_score": round(float(score), 2),
+    })
+
+
+def get_model_metadata(metric_name: str, training_rows: int, high_score: float, calibration: dict,
+                       validation_mae: float) -> dict:
+    """
+    Returns the metadata of a trained model, saved with it.
+    """
+    return {
+        "metric_name": metric_name,
+        "trained_at": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "training_rows": training_rows,
+        "high_score": high_score,
+        "validation_mae": validation_mae,
+        **calibration,
+    }
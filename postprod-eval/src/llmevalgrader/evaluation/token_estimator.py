@@ -0,0 +1,146 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import functools
+import heapq
+from typing import List
+
+import pandas as pd
+
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("token_estimator")
+
+# The tokens are counted as azureml/promptflow/common/context_window.py counts the tokens of the context windowed
+# by the evaluation flows, which cannot import this package. Keep the encoding and the fallback ratio in sync.
+DEFAULT_ENCODING_NAME = "cl100k_base"
+CHARS_PER_TOKEN = 4
+PROMPT_TEXT_COLUMNS = ["query", "context", "response"]
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str):
+    """
+    Returns the tiktoken encoding of a name, or None when it cannot be loaded.
+    """
+    if not encoding_name:
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Failed to load the {encoding_name} encoding, estimating the tokens from the characters: {e}")
+        return None
+
+
+def count_tokens(texts: List[str], encoding_name: str = DEFAULT_ENCODING_NAME) -> List[int]:
+    """
+    Returns the number of tokens of each text, the batched counterpart of count_tokens of context_window.py.
+
+    Args:
+        texts (List[str]): The texts, None counts as an empty text.
+        encoding_name (str): The tiktoken encoding of the model, None to estimate the tokens from the characters.
+
+    Returns:
+        List[int]: The number of tokens of each text.
+    """
+    texts = ["" if text is None else str(text) for text in texts]
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return [-(-len(text) // CHARS_PER_TOKEN) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+def estimate_prompt_tokens(
+    eval_fact_df: pd.DataFrame,
+    context_max_tokens: int = 0,
+    encoding_name: str = DEFAULT_ENCODING_NAME,
+) -> pd.Series:
+    """
+    Estimates the prompt tokens of each evaluation row, the tokens of the text rendered in the prompt of the
+    evaluator. The tokens of the prompt template are added per request, see estimate_request_tokens.
+
+    Args:
+        eval_fact_df (pd.DataFrame): The evaluation rows.
+        context_max_tokens (int): The token budget of the context in the evaluation flow, 0 when the context
+            is not windowed.
+        encoding_name (str): The tiktoken encoding of the model, None to estimate the tokens from the characters.
+
+    Returns:
+        pd.Series: The estimated prompt tokens of each row, aligned on eval_fact_df.
+    """
+    prompt_tokens = pd.Series(0, index=eval_fact_df.index, dtype="int64")
+    for column_name in PROMPT_TEXT_COLUMNS:
+        if column_name not in eval_fact_df.columns:
+            continue
+        column_tokens = pd.Series(count_tokens(eval_fact_df[column_name].to_list(), encoding_name),
+                                  index=eval_fact_df.index, dtype="int64")
+        if column_name == "context" and context_max_tokens > 0:
+            column_tokens = column_tokens.clip(upper=context_max_tokens)
+        prompt_tokens += column_tokens
+    return prompt_tokens
+
+
+def estimate_request_tokens(row_prompt_tokens: List[int], turns_per_request: int,
+                            prompt_overhead_tokens: int) -> List[int]:
+    """
+    Estimates the prompt tokens of each request to the evaluator, with the rows grouped as format_dataframe_output
+    of prep_data groups them.
+
+    Args:
+        row_prompt_tokens (List[int]): The estimated prompt tokens of each row, in order.
+        turns_per_request (int): The number of rows graded by each request.
+        prompt_overhead_tokens (int): The tokens of the prompt template, sent once per request.
+
+    Returns:
+        List[int]: The estimated prompt tokens of each request.
+    """
+    return [
+        prompt_overhead_tokens + sum(row_prompt_tokens[start:start + turns_per_request])
+        for start in range(0, len(row_prompt_tokens), turns_per_request)
+    ]
+
+
+def balance_shards(token_counts: List[int], shard_count: int) -> List[List[int]]:
+    """
+    Splits items into shards of about the same number of tokens, rather than the same number of items, so
+    that the workers grading the shards in parallel finish at about the same time.
+
+    The items are assigned from the largest to the smallest to the shard with the fewest tokens, which keeps
+    the largest shard within the largest item of the mean.
+
+    Args:
+        token_counts (List[int]): The tokens of each item.
+        shard_count (int): The number of shards.
+
+    Returns:
+        List[List[int]]: The positions of the items of each non-empty shard, in their original order.
+    """
+    if shard_count < 1:
+        raise ValueError(f"Invalid number of shards {shard_count}, it must be 1 or more")
+    shards = [[] for _ in range(min(shard_count, len(token_counts)))]
+    if len(shards) == 0:
+        return []
+    shard_heap = [(0, shard_index) for shard_index in range(len(shards))]
+    for position in sorted(range(len(token_counts)), key=lambda position: -token_counts[position]):
+        shard_tokens, shard_index = heapq.heappop(shard_heap)
+        shards[shard_index].append(position)
+        heapq.heappush(shard_heap, (shard_tokens + token_counts[position], shard_index))
+    return [sorted(shard) for shard in shards]
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int, prompt_token_price: float,
+                  completion_token_price: float) -> float:
+    """
+    Returns the projected cost of a number of tokens.
+
+    Args:
+        prompt_tokens (int): The prompt tokens.
+        completion_tokens (int): The completion tokens.
+        prompt_token_price (float): The price of 1000 prompt tokens.
+        completion_token_price (float): The price of 1000 completion tokens.
+
+    Returns:
+        float: The projected cost, in the currency of the prices.
+    """
+    return (prompt_tokens * prompt_token_price + completion_tokens * completion_token_price) / 1000
@@ -0,0 +1,418 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Arrow implementation of the transformation and gold zone preparation steps.
+
+The data stays in Arrow tables from the Azure Monitor result to ADLSHandler.write_fact_table, and filtering,
+concatenation and deduplication run as Arrow compute kernels instead of successive pandas copies.
+The functions mirror DataTransformer, simple_sample and create_goldzone_tables and produce the same gold zone
+tables, apart from the generated metadata_id and evaluation_dataset_id values.
+"""
+from datetime import datetime
+from logging import Logger
+from typing import List, Union
+from uuid import uuid4
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from llmevalgrader.common.azure_monitor_handler import AzureMonitorHandler
+from llmevalgrader.common.entities import AzureMonitorDataSource, MappingList, TransformationDTO
+from llmevalgrader.common.get_secret import get_key_vault_secret
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.transformation.fetch_planner import FetchRequest, LogFetchPlanner
+from llmevalgrader.transformation.llm_response import LLM_OPTIONAL_COLUMNS, LLM_RESPONSE_COLUMNS, LlmResponseExtractor
+from llmevalgrader.transformation.properties_parser import ParallelPropertiesParser, parse_properties
+from llmevalgrader.transformation.schema import MISSING_CATEGORY_VALUE, compile_arrow_schema, to_arrow_array
+
+ROW_INDEX_COLUMN = "__row_index"
+# Number of log rows whose Properties are parsed at once.
+PARSE_BATCH_SIZE = 50000
+
+logger = get_logger("arrow_engine")
+
+
+def _to_timestamp(column: pa.ChunkedArray, arrow_type: pa.DataType) -> pa.ChunkedArray:
+    """
+    Converts the TimeGenerated column to the target timestamp type. Integers are epoch milliseconds.
+    """
+    if pa.types.is_integer(column.type):
+        column = column.cast(pa.int64()).cast(pa.timestamp("ms"))
+    if pa.types.is_timestamp(column.type):
+        return column.cast(arrow_type)
+    return pa.chunked_array([to_arrow_array(column.to_pylist(), arrow_type)])
+
+
+def _null_column(arrow_type: pa.DataType, length: int) -> pa.Array:
+    if pa.types.is_dictionary(arrow_type):
+        return pa.nulls(length, pa.string()).dictionary_encode()
+    return pa.nulls(length, arrow_type)
+
+
+def _as_string(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Decodes a dictionary encoded column, as join and group by keys.
+    """
+    return column.cast(pa.string()) if pa.types.is_dictionary(column.type) else column
+
+
+def _all_valid(table: pa.Table, columns: List[str]) -> pa.ChunkedArray:
+    """
+    Returns a mask of the rows without nulls in the given columns.
+    """
+    mask = pa.chunked_array([pa.repeat(True, table.num_rows)])
+    for column in columns:
+        mask = pc.and_(mask, pc.is_valid(table[column]))
+    return mask
+
+
+def _with_row_index(table: pa.Table) -> pa.Table:
+    return table.append_column(ROW_INDEX_COLUMN, pa.array(range(table.num_rows), pa.int64()))
+
+
+def _restore_row_order(table: pa.Table) -> pa.Table:
+    """
+    Sorts a joined table back in the order of its left input and drops the row index.
+    """
+    return table.sort_by(ROW_INDEX_COLUMN).drop_columns([ROW_INDEX_COLUMN])
+
+
+def _anti_join(table: pa.Table, existing_table: pa.Table, keys: List[str]) -> pa.Table:
+    """
+    Returns the rows of table whose keys are not in existing_table, in their original order.
+    """
+    left = _with_row_index(table)
+    left_keys = left.select(keys + [ROW_INDEX_COLUMN])
+    for key in keys:
+        left_keys = left_keys.set_column(left_keys.schema.get_field_index(key), key, _as_string(left_keys[key]))
+    right_keys = pa.table({key: _as_string(existing_table[key]) for key in keys})
+    remaining_rows = left_keys.join(right_keys, keys, join_type="left anti", use_threads=False)
+    remaining_indices = remaining_rows[ROW_INDEX_COLUMN].combine_chunks().sort()
+    return left.take(remaining_indices).drop_columns([ROW_INDEX_COLUMN])
+
+
+def _concat(tables: List[pa.Table]) -> pa.Table:
+    """
+    Concatenates tables like pd.concat: the columns of the first table, then the new columns of the next ones,
+    with nulls where a table lacks a column.
+    """
+    column_types = {}
+    for table in tables:
+        for field in table.schema:
+            column_types.setdefault(field.name, field.type)
+    aligned_tables = []
+    for table in tables:
+        columns = [
+            table[name] if name in table.column_names else _null_column(column_type, table.num_rows)
+            for name, column_type in column_types.items()
+        ]
+        columns = [
+            _as_string(column) if pa.types.is_dictionary(column.type) else column for column in columns
+        ]
+        aligned_tables.append(pa.table(columns, names=list(column_types.keys())))
+    concat_table = pa.concat_tables(aligned_tables, promote_options="permissive")
+    for name, column_type in column_types.items():
+        if pa.types.is_dictionary(column_type):
+            concat_table = concat_table.set_column(
+                concat_table.schema.get_field_index(name), name, concat_table[name].dictionary_encode()
+            )
+    return concat_table
+
+
+class ArrowDataTransformer:
+    """
+    Arrow counterpart of DataTransformer, transforming the logs of Azure Monitor into the gold zone format.
+    """
+
+    def __init__(
+            self,
+            start_date: datetime,
+            end_date: datetime,
+            key_vault_url: str,
+            data_source: AzureMonitorDataSource,
+            mappings: MappingList,
+            logger: Logger = get_logger("arrow_data_transformer"),
+            chatbot_name: str = None,
+            parse_batch_size: int = PARSE_BATCH_SIZE,
+            parse_workers: int = 0):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.key_vault_url = key_vault_url
+        self.data_source = data_source
+        self.mappings = mappings
+        self.logger = logger
+        self.chatbot_name = chatbot_name
+        self.parse_batch_size = parse_batch_size
+        self.properties_parser = ParallelPropertiesParser(parse_workers, logger=self.logger) \
+            if parse_workers > 1 else None
+        self.schema = compile_arrow_schema(
+            [column for mapping in self.mappings.mappings for column in mapping.columns],
+            extra_columns={"app_type": "string", "app_name": "string", **LLM_RESPONSE_COLUMNS},
+        )
+
+        self.azure_monitor_handler = AzureMonitorHandler(
+            workspace_id=get_key_vault_secret(key_vault_url, self.data_source.workspace_id_secret_key))
+
+    def get_logs(self) -> List[TransformationDTO]:
+        """
+        Gets the logs from Azure Monitor as Arrow tables, with a single query for all the mappings.
+
+        Returns:
+            List[TransformationDTO]: One TransformationDTO per mapping.
+        """
+        fetch_planner = LogFetchPlanner(
+            self.key_vault_url,
+            {self.data_source.workspace_id_secret_key: self.azure_monitor_handler},
+            self.logger,
+        )
+        request = FetchRequest(self.chatbot_name, self.data_source, self.mappings)
+        return fetch_planner.fetch(
+            [request], self.start_date, self.end_date, output_format="arrow"
+        )[self.chatbot_name]
+
+    def _assemble_columns(self, transformation_dto: TransformationDTO, parsed_properties: pa.Table,
+                          logs: Union[pa.Table, pa.RecordBatch], app_type: str) -> pa.Table:
+        """
+        Builds the mapped columns of log rows from their parsed Properties and TimeGenerated.
+        """
+        columns = {}
+        for column in transformation_dto.mapping.columns:
+            if column.source_name == "TimeGenerated":
+                time_generated = logs.column("TimeGenerated")
+                if isinstance(time_generated, pa.Array):
+                    time_generated = pa.chunked_array([time_generated])
+                columns[column.target_name] = _to_timestamp(time_generated, self.schema[column.target_name])
+            else:
+                columns[column.target_name] = parsed_properties[column.target_name]
+        columns["app_type"] = pa.chunked_array(
+            [to_arrow_array([app_type] * logs.num_rows, self.schema["app_type"])]
+        )
+        if app_type == "llm":
+            for column_name in LLM_RESPONSE_COLUMNS:
+                columns[column_name] = parsed_properties[column_name]
+        return pa.table(list(columns.values()), names=list(columns.keys()))
+
+    def _map_columns(self, transformation_dto: TransformationDTO, app_type: str) -> pa.Table:
+        """
+        Maps the log rows of a TransformationDTO. Without the parallel parser, the rows are parsed batch by batch,
+        so that the parsed Properties are only held as Python objects for one batch at a time.
+        """
+        columns = {
+            column.target_name: (column.source_name, self.schema[column.target_name])
+            for column in transformation_dto.mapping.columns if column.source_name != "TimeGenerated"
+        }
+        llm_response_columns = None
+        extractor = LlmResponseExtractor()
+        if app_type == "llm":
+            llm_response_columns = {column_name: self.schema[column_name] for column_name in LLM_RESPONSE_COLUMNS}
+        if self.properties_parser is not None:
+            parsed_properties = self.properties_parser.parse(
+                transformation_dto.data["Properties"], columns, llm_response_columns, extractor
+            )
+            mapped_table = self._assemble_columns(
+                transformation_dto, parsed_properties, transformation_dto.data, app_type
+            )
+        else:
+            batches = transformation_dto.data.to_batches(max_chunksize=self.parse_batch_size)
+            if len(batches) == 0:
+                batches = [pa.RecordBatch.from_pylist([], schema=transformation_dto.data.schema)]
+            mapped_table = pa.concat_tables([
+                self._assemble_columns(
+                    transformation_dto,
+                    parse_properties(
+                        batch.column("Properties").to_pylist(), columns, llm_response_columns, extractor
+                    ),
+                    batch,
+                    app_type,
+                )
+                for batch in batches
+            ])
+        if app_type == "llm":
+            extractor.log_counts(transformation_dto.name)
+        return mapped_table
+
+    def _transform_conversation_data(self, transformation_dto: TransformationDTO) -> TransformationDTO:
+        """
+        Transforms the conversation data.
+        """
+        transformation_dto.data = self._map_columns(transformation_dto, "conversation")
+        return transformation_dto
+
+    def _transform_llm_data(self, transformation_dto: TransformationDTO) -> TransformationDTO:
+        """
+        Transforms the llm data, with the response, token usage and creation time of its llm_response payload.
+        """
+        transformation_dto.data = self._map_columns(transformation_dto, "llm")
+        return transformation_dto
+
+    def transform_data(self, transformation_dtos: List[TransformationDTO]) -> List[TransformationDTO]:
+        """
+        Transforms the data.
+
+        Args:
+            transformation_dtos (List[TransformationDTO]): The TransformationDTOs holding the logs as Arrow tables.
+
+        Returns:
+            List[TransformationDTO]: The TransformationDTOs holding the mapped columns.
+        """
+        post_transformation_dtos = []
+        for transformation_dto in transformation_dtos:
+            if transformation_dto.mapping.name == "conversation_data":
+                transformation_dto = self._transform_conversation_data(transformation_dto)
+            elif transformation_dto.mapping.name == "llm_data":
+                transformation_dto = self._transform_llm_data(transformation_dto)
+            self.logger.info(f"Shape of the data after transformation: {transformation_dto.data.shape} "
+                             f"for {transformation_dto.name}")
+            post_transformation_dtos.append(transformation_dto)
+        self.logger.info("Data transformation completed.")
+        return post_transformation_dtos
+
+    def clean_data(self, transformation_dtos: List[TransformationDTO]) -> List[TransformationDTO]:
+        """
+        Cleans the data by removing rows with missing values. The optional llm_response columns,
+        such as the token usage, may be missing.
+        """
+        for transformation_dto in transformation_dtos:
+            required_columns = [
+                column for column in transformation_dto.data.column_names if column not in LLM_OPTIONAL_COLUMNS
+            ]
+            transformation_dto.data = transformation_dto.data.filter(
+                _all_valid(transformation_dto.data, required_columns)
+            )
+            self.logger.info(f"Shape of the data after cleaning: {transformation_dto.data.shape} "
+                             f"for {transformation_dto.name}")
+        return transformation_dtos
+
+    def add_optional_extra_columns(self, transformation_dtos: List[TransformationDTO],
+                                   extra_column: str, extra_value: str) -> List[TransformationDTO]:
+        """
+        Adds a column with a constant value to every TransformationDTO.
+        """
+        self.logger.info(f"Adding optional extra column: {extra_column} with value: {extra_value}")
+        arrow_type = self.schema.get(extra_column, pa.string())
+        for transformation_dto in transformation_dtos:
+            transformation_dto.data = transformation_dto.data.append_column(
+                extra_column, to_arrow_array([extra_value] * transformation_dto.data.num_rows, arrow_type)
+            )
+        return transformation_dtos
+
+    def concat_data(self, transformation_dtos: List[TransformationDTO]) -> pa.Table:
+        """
+        Concatenates the data of the TransformationDTOs.
+        """
+        concat_table = _concat([transformation_dto.data for transformation_dto in transformation_dtos])
+        self.logger.info(f"Shape of the concatenated data: {concat_table.shape}")
+        return concat_table
+
+    def fill_missing_values(self, concat_data: pa.Table) -> pa.Table:
+        """
+        Fills the missing values of the dictionary encoded columns with "NA". Other columns keep their nulls.
+        """
+        for index, field in enumerate(concat_data.schema):
+            if pa.types.is_dictionary(field.type) and concat_data[field.name].null_count > 0:
+                filled = pc.fill_null(_as_string(concat_data[field.name]), MISSING_CATEGORY_VALUE)
+                concat_data = concat_data.set_column(index, field.name, filled.dictionary_encode())
+        return concat_data
+
+
+def simple_sample(table: pa.Table, sample_conversation_fraction: float = 0.8) -> pa.Table:
+    """
+    Sample a fraction of conversations from an Arrow table, see llmevalgrader.transformation.sampling.
+
+    Args:
+        table (pa.Table): The table containing conversations.
+        sample_conversation_fraction (float): The fraction of conversations to sample. Default is 0.8.
+
+    Returns:
+        pa.Table: The rows of the sampled conversations.
+    """
+    all_conversations = pc.unique(table["conversation_id"])
+    sampled_conversations = all_conversations[:int(sample_conversation_fraction * len(all_conversations))]
+    sampled_table = table.filter(pc.is_in(table["conversation_id"], value_set=sampled_conversations))
+    logger.info(f"Sampled conversation count: {len(sampled_conversations)} of {len(all_conversations)}")
+    return sampled_table
+
+
+def _get_metadata(sampled_data: pa.Table, existing_metadata: pa.Table) -> pa.Table:
+    """
+    Get metadata for sampled data: the distinct (model, intent) pairs in order of first appearance
+    with a new metadata_id, appended to the existing metadata.
+    """
+    model_intent = pa.table({"model": _as_string(sampled_data["model"]), "intent": _as_string(sampled_data["intent"])})
+    df_metadata = model_intent.group_by(["model", "intent"], use_threads=False).aggregate([])
+    df_metadata = pa.table({
+        "model": df_metadata["model"].dictionary_encode(),
+        "intent": df_metadata["intent"].dictionary_encode(),
+        "metadata_id": pa.array([str(uuid4()) for _ in range(df_metadata.num_rows)], pa.string()),
+    })
+    if existing_metadata is None or existing_metadata.num_rows == 0:
+        return df_metadata
+    df_metadata_new = _anti_join(df_metadata, existing_metadata, ["model", "intent"])
+    return _concat([existing_metadata, df_metadata_new])
+
+
+def _get_conversation(sampled_data: pa.Table, existing_conversation: pa.Table) -> pa.Table:
+    """
+    Get the conversation data: the first and last timestamp of each conversation, sorted by conversation ID.
+    """
+    df_conversation = sampled_data.select(["conversation_id", "timestamp"]) \
+        .group_by("conversation_id", use_threads=False) \
+        .aggregate([("timestamp", "min"), ("timestamp", "max")])
+    df_conversation = pa.table({
+        "conversation_id": df_conversation["conversation_id"],
+        "conv_start_time": df_conversation["timestamp_min"],
+        "conv_end_time": df_conversation["timestamp_max"],
+    }).sort_by("conversation_id")
+    if existing_conversation is None or existing_conversation.num_rows == 0:
+        return df_conversation
+    df_conversation_new = _anti_join(df_conversation, existing_conversation, ["conversation_id"])
+    return _concat([existing_conversation, df_conversation_new])
+
+
+def _get_fact_data(sampled_data: pa.Table, existing_fact_data: pa.Table, df_metadata_future: pa.Table) -> pa.Table:
+    """
+    Get the fact data: the sampled rows with their metadata_id and a new evaluation_dataset_id,
+    without the rows already in the existing fact data.
+    """
+    keyed_data = _with_row_index(pa.table({
+        "model": _as_string(sampled_data["model"]),
+        "intent": _as_string(sampled_data["intent"]),
+    }))
+    metadata_keys = pa.table({
+        "model": _as_string(df_metadata_future["model"]),
+        "intent": _as_string(df_metadata_future["intent"]),
+        "metadata_id": df_metadata_future["metadata_id"],
+    })
+    metadata_ids = _restore_row_order(
+        keyed_data.join(metadata_keys, ["model", "intent"], join_type="left outer", use_threads=False)
+    )["metadata_id"]
+    fact_data = sampled_data.drop_columns(["model", "intent"]) \
+        .append_column("metadata_id", metadata_ids) \
+        .append_column("evaluation_dataset_id",
+                       pa.array([str(uuid4()) for _ in range(sampled_data.num_rows)], pa.string()))
+    logger.info(f"Gold zone data columns: {fact_data.column_names}")
+    if existing_fact_data is None or existing_fact_data.num_rows == 0:
+        return fact_data
+    return _anti_join(fact_data, existing_fact_data, ["app_name", "conversation_id", "metadata_id", "turn_id"])
+
+
+def create_goldzone_tables(sampled_data: pa.Table, existing_fact_data: pa.Table,
+                           existing_metadata: pa.Table, existing_conversation: pa.Table):
+    """
+    Create goldzone tables based on the sampled data and existing data, see
+    llmevalgrader.transformation.goldzone_prep.create_goldzone_tables.
+
+    Args:
+        sampled_data (pa.Table): The sampled data used to create the goldzone tables.
+        existing_fact_data (pa.Table): The existing fact data, or None.
+        existing_metadata (pa.Table): The existing metadata, or None.
+        existing_conversation (pa.Table): The existing conversation data, or None.
+
+    Returns:
+        tuple: A tuple containing the Arrow tables for the fact data, metadata, and conversation data.
+    """
+    metadata = _get_metadata(sampled_data, existing_metadata)
+    conversation = _get_conversation(sampled_data, existing_conversation)
+    fact_data = _get_fact_data(sampled_data, existing_fact_data, metadata)
+    return fact_data, metadata, conversation
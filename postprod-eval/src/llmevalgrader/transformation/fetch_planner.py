@@ -0,0 +1,198 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from datetime import datetime
+from logging import Logger
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from llmevalgrader.common.azure_monitor_handler import AzureMonitorHandler
+from llmevalgrader.common.entities import AzureMonitorDataSource, MappingList, TransformationDTO
+from llmevalgrader.common.get_secret import get_key_vault_secret
+from llmevalgrader.common.logger import get_logger
+
+LOG_COLUMNS = ["TimeGenerated", "Message", "Properties"]
+APP_ROLE_NAME_COLUMN = "AppRoleName"
+
+
+class FetchRequest:
+    """
+    Represents the logs needed by one chatbot: the mappings to read from its data source.
+
+    Attributes:
+        chatbot_name (str): The name of the chatbot.
+        data_source (AzureMonitorDataSource): The data source of the chatbot.
+        mappings (MappingList): The mappings to read. Each mapping name is a Message value in the table.
+    """
+
+    def __init__(self, chatbot_name: str, data_source: AzureMonitorDataSource, mappings: MappingList):
+        self.chatbot_name = chatbot_name
+        self.data_source = data_source
+        self.mappings = mappings
+
+
+class FetchPlan:
+    """
+    Represents a single query against a workspace table, serving every request that reads from it.
+
+    Attributes:
+        workspace_id_secret_key (str): The secret key for the workspace ID.
+        table (str): The table to query.
+        requests (List[FetchRequest]): The requests served by the query.
+    """
+
+    def __init__(self, workspace_id_secret_key: str, table: str):
+        self.workspace_id_secret_key = workspace_id_secret_key
+        self.table = table
+        self.requests = []
+
+    def get_message_names(self) -> List[str]:
+        """
+        Returns the distinct mapping names of the requests, in order of appearance.
+        """
+        return list(dict.fromkeys(
+            mapping.name for request in self.requests for mapping in request.mappings.mappings
+        ))
+
+    def get_app_role_names(self) -> List[str]:
+        """
+        Returns the distinct app role names of the requests, or None if any request reads the whole workspace.
+        """
+        app_role_names = [request.data_source.app_role_name for request in self.requests]
+        if any(app_role_name is None for app_role_name in app_role_names):
+            return None
+        return list(dict.fromkeys(app_role_names))
+
+    def build_query(self) -> str:
+        """
+        Builds the query reading the rows of every mapping, and of every chatbot when they are routed by role name.
+
+        Returns:
+            str: The KQL query.
+        """
+        message_names = ", ".join(f"'{name}'" for name in self.get_message_names())
+        query = f"{self.table} | where Message in ({message_names})"
+        app_role_names = self.get_app_role_names()
+        if app_role_names is None:
+            return f"{query} | project {', '.join(LOG_COLUMNS)}"
+        role_names = ", ".join(f"'{name}'" for name in app_role_names)
+        return (f"{query} and {APP_ROLE_NAME_COLUMN} in ({role_names}) "
+                f"| project {', '.join(LOG_COLUMNS)}, {APP_ROLE_NAME_COLUMN}")
+
+
+class LogFetchPlanner:
+    """
+    Fetches the logs of several mappings and chatbots with one query per workspace table,
+    and routes the rows to a TransformationDTO per chatbot and mapping afterwards.
+
+    Rows are routed by Message to the mappings, and by AppRoleName to the chatbots that declare one.
+    A chatbot without an app role name receives every row of its mappings, as with one query per mapping.
+    """
+
+    def __init__(self, key_vault_url: str, azure_monitor_handlers: Dict[str, AzureMonitorHandler] = None,
+                 logger: Logger = get_logger("log_fetch_planner")):
+        """
+        Args:
+            key_vault_url (str): The URL of the key vault holding the workspace IDs.
+            azure_monitor_handlers (Dict[str, AzureMonitorHandler], optional): Handlers to reuse,
+                by workspace ID secret key.
+            logger (Logger, optional): The logger instance to use for logging.
+        """
+        self.key_vault_url = key_vault_url
+        self.azure_monitor_handlers = dict(azure_monitor_handlers or {})
+        self.logger = logger
+
+    def plan(self, requests: List[FetchRequest]) -> List[FetchPlan]:
+        """
+        Groups the requests by workspace and table.
+
+        Args:
+            requests (List[FetchRequest]): The requests to serve.
+
+        Returns:
+            List[FetchPlan]: One plan per workspace table.
+        """
+        plans = {}
+        for request in requests:
+            key = (request.data_source.workspace_id_secret_key, request.data_source.table)
+            if key not in plans:
+                plans[key] = FetchPlan(*key)
+            plans[key].requests.append(request)
+        return list(plans.values())
+
+    def _get_azure_monitor_handler(self, workspace_id_secret_key: str) -> AzureMonitorHandler:
+        if workspace_id_secret_key not in self.azure_monitor_handlers:
+            self.azure_monitor_handlers[workspace_id_secret_key] = AzureMonitorHandler(
+                workspace_id=get_key_vault_secret(self.key_vault_url, workspace_id_secret_key))
+        return self.azure_monitor_handlers[workspace_id_secret_key]
+
+    @staticmethod
+    def _route_arrow(logs_table: pa.Table, request: FetchRequest) -> List[TransformationDTO]:
+        """
+        Splits the rows of a plan into one TransformationDTO per mapping of the request, as Arrow tables.
+        """
+        if "Message" not in logs_table.column_names:
+            logs_table = pa.table({column: pa.array([], pa.string()) for column in LOG_COLUMNS})
+        if request.data_source.app_role_name is not None and APP_ROLE_NAME_COLUMN in logs_table.column_names:
+            logs_table = logs_table.filter(
+                pc.equal(logs_table[APP_ROLE_NAME_COLUMN], request.data_source.app_role_name)
+            )
+        transformation_dtos = []
+        for mapping in request.mappings.mappings:
+            mapping_table = logs_table.filter(pc.equal(logs_table["Message"], mapping.name)).select(LOG_COLUMNS)
+            transformation_dtos.append(TransformationDTO(name=mapping.name, mapping=mapping, data=mapping_table))
+        return transformation_dtos
+
+    @staticmethod
+    def _route(df_logs: pd.DataFrame, request: FetchRequest) -> List[TransformationDTO]:
+        """
+        Splits the rows of a plan into one TransformationDTO per mapping of the request.
+        """
+        if "Message" not in df_logs.columns:
+            df_logs = pd.DataFrame(columns=LOG_COLUMNS)
+        if request.data_source.app_role_name is not None and APP_ROLE_NAME_COLUMN in df_logs.columns:
+            df_logs = df_logs[df_logs[APP_ROLE_NAME_COLUMN] == request.data_source.app_role_name]
+        transformation_dtos = []
+        for mapping in request.mappings.mappings:
+            df_mapping = df_logs[df_logs["Message"] == mapping.name][LOG_COLUMNS].reset_index(drop=True)
+            transformation_dtos.append(TransformationDTO(name=mapping.name, mapping=mapping, data=df_mapping))
+        return transformation_dtos
+
+    def fetch(self, requests: List[FetchRequest], start_date: datetime,
+              end_date: datetime, output_format: str = "pandas") -> Dict[str, List[TransformationDTO]]:
+        """
+        Runs one query per workspace table over the time range and routes the rows to the requests.
+
+        Args:
+            requests (List[FetchRequest]): The requests to serve.
+            start_date (datetime): The start of the time range.
+            end_date (datetime): The end of the time range.
+            output_format (str, optional): "pandas" (default) or "arrow", the type of the TransformationDTO data.
+
+        Returns:
+            Dict[str, List[TransformationDTO]]: The TransformationDTOs of each chatbot, one per mapping.
+        """
+        transformation_dtos = {}
+        plans = self.plan(requests)
+        self.logger.info(f"Fetching logs for {len(requests)} request(s) with {len(plans)} query(ies)")
+        for plan in plans:
+            azure_monitor_handler = self._get_azure_monitor_handler(plan.workspace_id_secret_key)
+            df_logs = azure_monitor_handler.get_logs_by_time_range(
+                start_date, end_date, plan.build_query(), output_format=output_format
+            )
+            completeness_report = azure_monitor_handler.get_completeness_report()
+            if completeness_report is not None and not completeness_report.is_complete:
+                self.logger.error(f"Logs of {plan.table} are incomplete: {completeness_report.to_dict()}")
+            for request in plan.requests:
+                if output_format == "arrow":
+                    request_dtos = self._route_arrow(df_logs, request)
+                else:
+                    request_dtos = self._route(df_logs, request)
+                transformation_dtos.setdefault(request.chatbot_name, []).extend(request_dtos)
+                for transformation_dto in request_dtos:
+                    self.logger.info(f"Shape of the data after getting logs: {transformation_dto.data.shape} "
+                                     f"for {transformation_dto.name} of {request.chatbot_name}")
+        return transformation_dtos
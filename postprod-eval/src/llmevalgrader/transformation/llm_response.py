@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Extraction of the fields of the llm_response payload logged with the llm data, the chat completion
+returned by Azure OpenAI as JSON.
+"""
+import json
+from datetime import datetime, timezone
+from typing import Dict
+
+from llmevalgrader.common.logger import get_logger
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    JSON_DECODER = "orjson"
+except ImportError:
+    _json_loads = json.loads
+    JSON_DECODER = "json"
+
+logger = get_logger("llm_response")
+
+LLM_RESPONSE_KEY = "llm_response"
+# Columns extracted from the payload and their mapping data type.
+LLM_RESPONSE_COLUMNS = {
+    "response": "string",
+    "prompt_tokens": "integer",
+    "completion_tokens": "integer",
+    "total_tokens": "integer",
+    "llm_created_time": "datetime",
+}
+# Columns that may be missing from a valid payload, so they do not invalidate the row.
+LLM_OPTIONAL_COLUMNS = ["prompt_tokens", "completion_tokens", "total_tokens", "llm_created_time"]
+
+
+class LlmResponseExtractor:
+    """
+    Extracts the content, the token usage and the creation time of llm_response payloads.
+
+    Each payload is decoded once, with orjson when it is installed. A payload that cannot be decoded
+    or has no choices[0].message.content is counted as malformed and extracted as nulls.
+
+    Attributes:
+        extracted_count (int): The number of payloads extracted.
+        missing_count (int): The number of rows without a payload.
+        malformed_count (int): The number of malformed payloads.
+    """
+
+    def __init__(self):
+        self.extracted_count = 0
+        self.missing_count = 0
+        self.malformed_count = 0
+
+    def extract(self, llm_response) -> Dict[str, object]:
+        """
+        Extracts the fields of a payload.
+
+        Args:
+            llm_response: The payload as a JSON string, an already decoded dict, or None.
+
+        Returns:
+            Dict[str, object]: The value of each column of LLM_RESPONSE_COLUMNS, None when missing.
+        """
+        fields = dict.fromkeys(LLM_RESPONSE_COLUMNS)
+        if llm_response is None:
+            self.missing_count += 1
+            return fields
+        try:
+            payload = llm_response if isinstance(llm_response, dict) else _json_loads(llm_response)
+            content = payload["choices"][0]["message"]["content"]
+            usage = payload.get("usage") or {}
+            created = payload.get("created")
+            fields["prompt_tokens"] = usage.get("prompt_tokens")
+            fields["completion_tokens"] = usage.get("completion_tokens")
+            fields["total_tokens"] = usage.get("total_tokens")
+            fields["llm_created_time"] = datetime.fromtimestamp(created, tz=timezone.utc) \
+                if created is not None else None
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError, OverflowError, OSError):
+            self.malformed_count += 1
+            return dict.fromkeys(LLM_RESPONSE_COLUMNS)
+        fields["response"] = content
+        self.extracted_count += 1
+        return fields
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        Returns the counters of the extractor.
+        """
+        return {
+            "extracted_count": self.extracted_count,
+            "missing_count": self.missing_count,
+            "malformed_count": self.malformed_count,
+        }
+
+    def add_counts(self, counts: Dict[str, int]):
+        """
+        Adds the counters of another extractor, e.g. of a worker process.
+        """
+        self.extracted_count += counts["extracted_count"]
+        self.missing_count += counts["missing_count"]
+        self.malformed_count += counts["malformed_count"]
+
+    def log_counts(self, name: str):
+        """
+        Logs the counters, with a warning when payloads are malformed.
+
+        Args:
+            name (str): The name of the data, e.g. of the TransformationDTO.
+        """
+        logger.info(f"llm_response payloads of {name} decoded with {JSON_DECODER}: {self.get_counts()}")
+        if self.malformed_count > 0:
+            logger.warning(f"{self.malformed_count} malformed llm_response payload(s) in {name}, "
+                           f"their rows have no response")
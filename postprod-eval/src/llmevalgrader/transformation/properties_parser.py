@@ -0,0 +1,216 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Parsing of the Properties column of the Azure Monitor logs into the mapped columns.
+
+ParallelPropertiesParser shards the rows across a process pool. The raw Properties and the parsed columns
+are handed between the processes as Arrow IPC streams in shared memory blocks, so that only the block names
+and row ranges are pickled.
+"""
+import ast
+import os
+from concurrent.futures import ProcessPoolExecutor
+from logging import Logger
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple, Union
+
+import pyarrow as pa
+
+from llmevalgrader.common.logger import get_logger
+from llmevalgrader.transformation.llm_response import LLM_RESPONSE_KEY, LlmResponseExtractor
+from llmevalgrader.transformation.schema import to_arrow_array
+
+# Target column name to the source key in Properties and the Arrow type of the column.
+ParseColumns = Dict[str, Tuple[str, pa.DataType]]
+
+PROPERTIES_COLUMN = "Properties"
+# Below this number of rows per worker, the rows are parsed in the calling process.
+MIN_ROWS_PER_WORKER = 10000
+
+
+def parse_properties(properties: List[str], columns: ParseColumns,
+                     llm_response_columns: Dict[str, pa.DataType] = None,
+                     extractor: LlmResponseExtractor = None) -> pa.Table:
+    """
+    Parses the Properties of log rows into typed columns. Each Properties string is parsed once.
+
+    Args:
+        properties (List[str]): The Properties of the rows, as Python literals.
+        columns (ParseColumns): The columns to extract, by target name.
+        llm_response_columns (Dict[str, pa.DataType], optional): When set, these columns of LLM_RESPONSE_COLUMNS
+            are extracted from the llm_response payload of the rows, as for the llm data.
+        extractor (LlmResponseExtractor, optional): The extractor of the payloads, to collect its counters.
+
+    Returns:
+        pa.Table: The extracted columns, in the order of columns, then llm_response_columns.
+    """
+    parsed_properties = [ast.literal_eval(x) for x in properties]
+    arrays = {
+        target_name: to_arrow_array([x.get(source_name) for x in parsed_properties], arrow_type)
+        for target_name, (source_name, arrow_type) in columns.items()
+    }
+    if llm_response_columns is not None:
+        extractor = extractor or LlmResponseExtractor()
+        llm_fields = [extractor.extract(x.get(LLM_RESPONSE_KEY)) for x in parsed_properties]
+        for column_name, arrow_type in llm_response_columns.items():
+            arrays[column_name] = to_arrow_array([fields[column_name] for fields in llm_fields], arrow_type)
+    return pa.table(arrays)
+
+
+def _write_shared_table(table: pa.Table) -> Tuple[shared_memory.SharedMemory, int]:
+    """
+    Writes a table as an Arrow IPC stream into a new shared memory block, without an intermediate buffer.
+
+    Returns:
+        Tuple[shared_memory.SharedMemory, int]: The block, to be closed by the caller, and the stream size.
+    """
+    mock_sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock_sink, table.schema) as writer:
+        writer.write_table(table)
+    size = mock_sink.size()
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    buffer = pa.py_buffer(block.buf)
+    try:
+        with pa.ipc.new_stream(pa.FixedSizeBufferWriter(buffer), table.schema) as writer:
+            writer.write_table(table)
+    finally:
+        # The block cannot be closed while Arrow still references its memory.
+        del buffer
+    return block, size
+
+
+def _parse_shard(input_name: str, input_size: int, start: int, stop: int, columns: ParseColumns,
+                 llm_response_columns: Dict[str, pa.DataType]) -> Tuple[str, int, Dict[str, int]]:
+    """
+    Parses the rows start to stop of the Properties in the input block, in a worker process.
+
+    Returns:
+        Tuple[str, int, Dict[str, int]]: The name of the block holding the parsed columns, the stream size
+            and the counters of the llm_response extractor.
+    """
+    input_block = shared_memory.SharedMemory(name=input_name)
+    try:
+        input_table = pa.ipc.open_stream(pa.py_buffer(input_block.buf)[:input_size]).read_all()
+        properties = input_table[PROPERTIES_COLUMN].slice(start, stop - start).to_pylist()
+        del input_table
+    finally:
+        input_block.close()
+    extractor = LlmResponseExtractor()
+    output_block, output_size = _write_shared_table(
+        parse_properties(properties, columns, llm_response_columns, extractor)
+    )
+    output_block.close()
+    return output_block.name, output_size, extractor.get_counts()
+
+
+def _release_shared_block(name: str):
+    """
+    Releases a shared memory block written by a worker.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    block.close()
+    block.unlink()
+
+
+def _read_shared_table(name: str, size: int) -> pa.Table:
+    """
+    Reads a table written by a worker and releases its shared memory block.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # Copy the stream once, so that the table outlives the block.
+        return pa.ipc.open_stream(pa.py_buffer(bytes(block.buf[:size]))).read_all()
+    finally:
+        block.close()
+        block.unlink()
+
+
+class ParallelPropertiesParser:
+    """
+    Parses the Properties of log rows with a pool of worker processes.
+
+    The rows are split into one contiguous shard per worker, and the parsed shards are concatenated in order,
+    so that the result is the same as parse_properties.
+
+    Args:
+        num_workers (int): The number of worker processes, capped to the number of CPUs.
+            With 0 or 1, the rows are parsed in the calling process.
+        min_rows_per_worker (int): The minimum number of rows given to a worker.
+        logger (Logger): The logger instance to use for logging.
+    """
+
+    def __init__(self, num_workers: int, min_rows_per_worker: int = MIN_ROWS_PER_WORKER,
+                 logger: Logger = get_logger("properties_parser")):
+        if num_workers < 0:
+            raise ValueError(f"Invalid number of parse workers {num_workers}, it must be 0 or more")
+        self.num_workers = min(num_workers, os.cpu_count() or 1)
+        self.min_rows_per_worker = min_rows_per_worker
+        self.logger = logger
+
+    def get_shards(self, row_count: int) -> List[Tuple[int, int]]:
+        """
+        Splits the rows into contiguous shards, one per worker.
+
+        Args:
+            row_count (int): The number of rows.
+
+        Returns:
+            List[Tuple[int, int]]: The start and stop of each shard.
+        """
+        shard_count = max(1, min(self.num_workers, row_count // max(self.min_rows_per_worker, 1)))
+        shard_size = -(-row_count // shard_count)
+        return [(start, min(start + shard_size, row_count)) for start in range(0, row_count, shard_size)] \
+            if row_count > 0 else [(0, 0)]
+
+    def parse(self, properties: Union[pa.Array, pa.ChunkedArray], columns: ParseColumns,
+              llm_response_columns: Dict[str, pa.DataType] = None,
+              extractor: LlmResponseExtractor = None) -> pa.Table:
+        """
+        Parses the Properties of log rows into typed columns, see parse_properties.
+
+        Args:
+            properties (Union[pa.Array, pa.ChunkedArray]): The Properties of the rows.
+            columns (ParseColumns): The columns to extract, by target name.
+            llm_response_columns (Dict[str, pa.DataType], optional): When set, these columns are extracted
+                from the llm_response payload.
+            extractor (LlmResponseExtractor, optional): Collects the counters of the workers' extractors.
+
+        Returns:
+            pa.Table: The extracted columns.
+        """
+        extractor = extractor or LlmResponseExtractor()
+        shards = self.get_shards(len(properties))
+        if len(shards) == 1:
+            return parse_properties(properties.to_pylist(), columns, llm_response_columns, extractor)
+
+        self.logger.info(f"Parsing {len(properties)} rows with {len(shards)} worker processes")
+        # Creating the input block before the pool also starts the resource tracker shared with the workers.
+        input_block, input_size = _write_shared_table(pa.table({PROPERTIES_COLUMN: properties}))
+        output_blocks = []
+        errors = []
+        try:
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                futures = [
+                    executor.submit(
+                        _parse_shard, input_block.name, input_size, start, stop, columns, llm_response_columns
+                    )
+                    for start, stop in shards
+                ]
+                # Wait for every shard, so that the blocks of the successful ones are released on failure.
+                for future in futures:
+                    try:
+                        output_blocks.append(future.result())
+                    except Exception as e:
+                        errors.append(e)
+        finally:
+            input_block.close()
+            input_block.unlink()
+        if errors:
+            for name, _, _ in output_blocks:
+                _release_shared_block(name)
+            self.logger.error(f"Failed to parse the Properties in parallel: {errors[0]}")
+            raise errors[0]
+        for _, _, counts in output_blocks:
+            extractor.add_counts(counts)
+        return pa.concat_tables([_read_shared_table(name, size) for name, size, _ in output_blocks])
@@ -0,0 +1,158 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+
+from llmevalgrader.common.entities import MappingColumn
+from llmevalgrader.common.logger import get_logger
+
+logger = get_logger("transformation_schema")
+
+# Low-cardinality columns stored as categoricals, i.e. dictionary encoded in the gold zone parquet files.
+CATEGORICAL_COLUMNS = ["app_name", "app_type", "model", "intent"]
+MISSING_CATEGORY_VALUE = "NA"
+
+MAPPING_DATA_TYPES = {
+    "string": pd.StringDtype(),
+    "datetime": pd.DatetimeTZDtype(tz="UTC"),
+    "integer": pd.Int64Dtype(),
+    "float": pd.Float64Dtype(),
+    "boolean": pd.BooleanDtype(),
+}
+
+
+def compile_schema(mapping_columns: List[MappingColumn], extra_columns: Dict[str, str] = None,
+                   categorical_columns: List[str] = CATEGORICAL_COLUMNS) -> Dict[str, object]:
+    """
+    Compiles mapping columns into a pandas schema of target column name to dtype.
+
+    Columns listed in categorical_columns are typed as categoricals whatever their declared data type.
+
+    Args:
+        mapping_columns (List[MappingColumn]): The columns of a mapping.
+        extra_columns (Dict[str, str], optional): Additional target columns and their data type,
+            for columns added by the transformation rather than mapped from the source.
+        categorical_columns (List[str], optional): The columns stored as categoricals.
+
+    Returns:
+        Dict[str, object]: The dtype of each target column.
+
+    Raises:
+        ValueError: If a data type is not supported.
+    """
+    column_types = {column.target_name: column.data_type for column in mapping_columns}
+    column_types.update(extra_columns or {})
+    schema = {}
+    for target_name, data_type in column_types.items():
+        if target_name in categorical_columns:
+            schema[target_name] = pd.CategoricalDtype()
+        elif str(data_type).lower() in MAPPING_DATA_TYPES:
+            schema[target_name] = MAPPING_DATA_TYPES[str(data_type).lower()]
+        else:
+            error_msg = f"Invalid data type {data_type} for column {target_name}. " \
+                        f"Allowed values are {list(MAPPING_DATA_TYPES.keys())}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+    return schema
+
+
+def apply_schema(df: pd.DataFrame, schema: Dict[str, object]) -> pd.DataFrame:
+    """
+    Casts the columns of a DataFrame to the schema, keeping native nulls.
+
+    Columns of the DataFrame missing from the schema are left untouched, and columns of the schema
+    missing from the DataFrame are ignored. This is also used to restore the dtypes lost by pd.concat,
+    e.g. categoricals with different categories are concatenated as object columns.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to cast.
+        schema (Dict[str, object]): The dtype of each column.
+
+    Returns:
+        pd.DataFrame: The DataFrame with typed columns.
+    """
+    for column_name, dtype in schema.items():
+        if column_name not in df.columns:
+            continue
+        if isinstance(dtype, pd.DatetimeTZDtype):
+            df[column_name] = pd.to_datetime(df[column_name], utc=True)
+        else:
+            df[column_name] = df[column_name].astype(dtype)
+    return df
+
+
+def fill_missing_categories(df: pd.DataFrame, value: str = MISSING_CATEGORY_VALUE) -> pd.DataFrame:
+    """
+    Replaces the nulls of the categorical columns with a placeholder value, so that they can be used as keys,
+    e.g. model and intent identify the gold zone metadata. Other columns keep their native nulls.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to fill.
+        value (str): The placeholder value.
+
+    Returns:
+        pd.DataFrame: The DataFrame with filled categorical columns.
+    """
+    for column_name in df.columns:
+        if isinstance(df[column_name].dtype, pd.CategoricalDtype) and df[column_name].isna().any():
+            if value not in df[column_name].cat.categories:
+                df[column_name] = df[column_name].cat.add_categories([value])
+            df[column_name] = df[column_name].fillna(value)
+    return df
+
+
+def to_arrow_type(dtype) -> pa.DataType:
+    """
+    Returns the Arrow type matching a dtype of a compiled schema.
+
+    Args:
+        dtype: A dtype returned by compile_schema.
+
+    Returns:
+        pa.DataType: The Arrow type. Categoricals are dictionary encoded strings.
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pa.dictionary(pa.int32(), pa.string())
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(dtype, pd.StringDtype):
+        return pa.string()
+    if isinstance(dtype, pd.Int64Dtype):
+        return pa.int64()
+    if isinstance(dtype, pd.Float64Dtype):
+        return pa.float64()
+    return pa.bool_()
+
+
+def compile_arrow_schema(mapping_columns: List[MappingColumn], extra_columns: Dict[str, str] = None,
+                         categorical_columns: List[str] = CATEGORICAL_COLUMNS) -> Dict[str, pa.DataType]:
+    """
+    Compiles mapping columns into the Arrow types of the target columns, see compile_schema.
+
+    Returns:
+        Dict[str, pa.DataType]: The Arrow type of each target column.
+    """
+    schema = compile_schema(mapping_columns, extra_columns, categorical_columns)
+    return {column_name: to_arrow_type(dtype) for column_name, dtype in schema.items()}
+
+
+def to_arrow_array(values: list, arrow_type: pa.DataType) -> pa.Array:
+    """
+    Builds an Arrow array of the given type from Python values, with the same conversions as apply_schema.
+
+    Args:
+        values (list): The values, None for nulls.
+        arrow_type (pa.DataType): A type returned by compile_arrow_schema.
+
+    Returns:
+        pa.Array: The typed array.
+    """
+    if pa.types.is_dictionary(arrow_type) or pa.types.is_string(arrow_type):
+        array = pa.array([None if value is None else str(value) for value in values], pa.string())
+        return array.dictionary_encode() if pa.types.is_dictionary(arrow_type) else array
+    if pa.types.is_timestamp(arrow_type):
+        return pa.array(pd.to_datetime(pd.Series(values, dtype=object), utc=True), arrow_type)
+    return pa.array(values).cast(arrow_type)
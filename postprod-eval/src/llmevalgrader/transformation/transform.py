@@ -1,18 +1,22 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-import ast
 import datetime
-import json
 from logging import Logger
 from datetime import datetime
-import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from llmevalgrader.common.logger import get_logger
 from llmevalgrader.common.azure_monitor_handler import AzureMonitorHandler
 from llmevalgrader.common.get_secret import get_key_vault_secret
 from llmevalgrader.common.entities import AzureMonitorDataSource, MappingList, TransformationDTO
+from llmevalgrader.transformation.fetch_planner import FetchRequest, LogFetchPlanner
+from llmevalgrader.transformation.llm_response import LLM_OPTIONAL_COLUMNS, LLM_RESPONSE_COLUMNS, LlmResponseExtractor
+from llmevalgrader.transformation.properties_parser import ParallelPropertiesParser
+from llmevalgrader.transformation.schema import (
+    apply_schema, compile_arrow_schema, compile_schema, fill_missing_categories
+)
 
 
 class DataTransformer:
@@ -27,46 +31,87 @@ class DataTransformer:
             key_vault_url: str,
             data_source: AzureMonitorDataSource,
             mappings: MappingList,
-            logger: Logger = get_logger("data_transformer")):
+            logger: Logger = get_logger("data_transformer"),
+            chatbot_name: str = None,
+            parse_workers: int = 0):
         self.start_date = start_date
         self.end_date = end_date
         self.key_vault_url = key_vault_url
         self.data_source = data_source
         self.mappings = mappings
         self.logger = logger
+        self.chatbot_name = chatbot_name
+        # Typed schema of the transformed data: the mapped columns of every mapping plus the derived columns.
+        mapping_columns = [column for mapping in self.mappings.mappings for column in mapping.columns]
+        extra_columns = {"app_type": "string", "app_name": "string", **LLM_RESPONSE_COLUMNS}
+        self.schema = compile_schema(mapping_columns, extra_columns=extra_columns)
+        self.arrow_schema = compile_arrow_schema(mapping_columns, extra_columns=extra_columns)
+        # Parsing of the Properties with a pool of worker processes is opt-in, with parse_workers above 1.
+        self.properties_parser = ParallelPropertiesParser(parse_workers, logger=self.logger)
 
         self.azure_monitor_handler = AzureMonitorHandler(
             workspace_id=get_key_vault_secret(key_vault_url, self.data_source.workspace_id_secret_key))
         
-    def _transform_conversation_data(self, transformation_dto: TransformationDTO) -> TransformationDTO:
+    def _parse_properties(self, transformation_dto: TransformationDTO, app_type: str) -> pd.DataFrame:
         """
-        Transforms the conversation data.
+        Maps the columns of the logs with the Properties parser, parsing each Properties once.
 
         Args:
             transformation_dto (TransformationDTO): The transformation data transfer object.
+            app_type (str): conversation or llm. The llm data also gets the columns of its llm_response payload.
 
         Returns:
-            TransformationDTO: The transformed transformation data transfer object.
+            pd.DataFrame: The mapped columns.
         """
-        df_conversation_mapped = pd.DataFrame(
-            columns=[column.target_name for column in transformation_dto.mapping.columns]
-        )
+        # Categoricals are parsed as strings, so that apply_schema orders their categories as pandas does.
+        columns = {
+            column.target_name: (column.source_name, pa.string() if pa.types.is_dictionary(
+                self.arrow_schema[column.target_name]) else self.arrow_schema[column.target_name])
+            for column in transformation_dto.mapping.columns if column.source_name != "TimeGenerated"
+        }
+        llm_response_columns = None
+        extractor = LlmResponseExtractor()
+        if app_type == "llm":
+            llm_response_columns = {column_name: self.arrow_schema[column_name] for column_name in LLM_RESPONSE_COLUMNS}
+        parsed_properties = self.properties_parser.parse(
+            pa.array(transformation_dto.data["Properties"], pa.string()),
+            columns,
+            llm_response_columns,
+            extractor,
+        ).to_pandas()
+        df_mapped = pd.DataFrame(index=parsed_properties.index)
         for column in transformation_dto.mapping.columns:
-            df_conversation_mapped[column.target_name] = transformation_dto.data["Properties"].apply(
-                lambda x: ast.literal_eval(x)[column.source_name] if column.source_name in ast.literal_eval(x) else None
-            )
             if column.source_name == "TimeGenerated":
-                df_conversation_mapped[column.target_name] = pd.to_datetime(
+                df_mapped[column.target_name] = pd.to_datetime(
                     transformation_dto.data[column.source_name], unit="ms"
-                )
-        df_conversation_mapped["app_type"] = "conversation"
-        transformation_dto.data = df_conversation_mapped
+                ).array
+            else:
+                df_mapped[column.target_name] = parsed_properties[column.target_name]
+        df_mapped["app_type"] = app_type
+        if app_type == "llm":
+            for column_name in LLM_RESPONSE_COLUMNS:
+                df_mapped[column_name] = parsed_properties[column_name]
+            extractor.log_counts(transformation_dto.name)
+        return apply_schema(df_mapped, self.schema)
+
+    def _transform_conversation_data(self, transformation_dto: TransformationDTO) -> TransformationDTO:
+        """
+        Transforms the conversation data.
+
+        Args:
+            transformation_dto (TransformationDTO): The transformation data transfer object.
+
+        Returns:
+            TransformationDTO: The transformed transformation data transfer object.
+        """
+        # Each Properties is parsed once, in the calling process unless parse_workers is above 1.
+        transformation_dto.data = self._parse_properties(transformation_dto, "conversation")
         return transformation_dto
 
 
     def _transform_llm_data(self, transformation_dto: TransformationDTO) -> TransformationDTO:
             """
-            Transforms the llm data.
+            Transforms the llm data, with the response, token usage and creation time of its llm_response payload.
 
             Args:
                 transformation_dto (TransformationDTO): The transformation DTO containing the data and mapping information.
@@ -75,22 +120,8 @@ class DataTransformer:
                 TransformationDTO: The transformed transformation DTO.
 
             """
-            df_llm_mapped = pd.DataFrame(
-                columns=[column.target_name for column in transformation_dto.mapping.columns]
-            )
-            for column in transformation_dto.mapping.columns:
-                df_llm_mapped[column.target_name] = transformation_dto.data["Properties"].apply(
-                    lambda x: ast.literal_eval(x)[column.source_name] if column.source_name in ast.literal_eval(x) else None
-                )
-                if column.source_name == "TimeGenerated":
-                    df_llm_mapped[column.target_name] = pd.to_datetime(
-                        transformation_dto.data[column.source_name], unit="ms"
-                    )
-            df_llm_mapped["app_type"] = "llm"
-            df_llm_mapped["response"] = transformation_dto.data["Properties"].apply(
-                lambda x: json.loads(json.loads(x)["llm_response"])["choices"][0]["message"]["content"] if x != np.nan and "llm_response" in json.loads(x) else None
-            )
-            transformation_dto.data = df_llm_mapped
+            # Each Properties and llm_response payload is decoded once, see LlmResponseExtractor.
+            transformation_dto.data = self._parse_properties(transformation_dto, "llm")
             return transformation_dto
 
     def get_logs(self) -> list[TransformationDTO]:
@@ -100,15 +131,14 @@ class DataTransformer:
             Returns:
                 A list of TransformationDTO objects representing the logs retrieved from Azure Monitor.
             """
-            transformation_dtos = []
-            for mapping in self.mappings.mappings:
-                query = f"AppTraces | project TimeGenerated, Message, Properties | where Message == '{mapping.name}'"
-                df_logs = self.azure_monitor_handler.get_logs_by_time_range(
-                    self.start_date, self.end_date, query
-                )
-                transformation_dtos.append(TransformationDTO(name=mapping.name, mapping=mapping, data=df_logs))
-                self.logger.info(f"Shape of the data after getting logs: {df_logs.shape} for {mapping.name}")
-            return transformation_dtos
+            # All the mappings are read with a single query and routed by Message afterwards.
+            fetch_planner = LogFetchPlanner(
+                self.key_vault_url,
+                {self.data_source.workspace_id_secret_key: self.azure_monitor_handler},
+                self.logger,
+            )
+            request = FetchRequest(self.chatbot_name, self.data_source, self.mappings)
+            return fetch_planner.fetch([request], self.start_date, self.end_date)[self.chatbot_name]
     
     def transform_data(self, transformation_dtos: list[TransformationDTO]) -> list[TransformationDTO]:
         """
@@ -138,7 +168,8 @@ class DataTransformer:
     
     def clean_data(self, transformation_dtos: list[TransformationDTO]) -> list[TransformationDTO]:
         """
-        Cleans the data by removing rows with missing values.
+        Cleans the data by removing rows with missing values. The optional llm_response columns,
+        such as the token usage, may be missing.
 
         Args:
             transformation_dtos (list[TransformationDTO]): A list of TransformationDTO objects representing the data to be cleaned.
@@ -149,7 +180,9 @@ class DataTransformer:
         for transformation_dto in transformation_dtos:
             self.logger.info(f"Data cleaning started for: {transformation_dto.name}")
             self.logger.info(f"Shape of the data before cleaning: {transformation_dto.data.shape}")
-            transformation_dto.data = transformation_dto.data.dropna()
+            transformation_dto.data = transformation_dto.data.dropna(
+                subset=[column for column in transformation_dto.data.columns if column not in LLM_OPTIONAL_COLUMNS]
+            )
             self.logger.info(f"Shape of the data after cleaning: {transformation_dto.data.shape}")
         self.logger.info("Data cleaning completed.")
         return transformation_dtos
@@ -184,13 +217,16 @@ class DataTransformer:
         """
         self.logger.info("Concatenating the data.")
         concat_df = pd.concat([transformation_dto.data for transformation_dto in transformation_dtos])
+        # Categoricals with different categories are concatenated as object columns, cast them back.
+        concat_df = apply_schema(concat_df, self.schema)
         self.logger.info(f"Shape of the concatenated data: {concat_df.shape}")
         self.logger.info(f"Columns of the concatenated data: {concat_df.columns.to_list()}")
         return concat_df
     
     def fill_missing_values(self, concat_data: pd.DataFrame) -> pd.DataFrame:
         """
-        Fills the missing values in the given DataFrame.
+        Fills the missing values of the categorical columns in the given DataFrame with "NA",
+        since model and intent are used as metadata keys. Other columns keep their native nulls.
 
         Args:
             concat_data (pd.DataFrame): The DataFrame containing the data to be filled.
@@ -200,6 +236,6 @@ class DataTransformer:
 
         """
         self.logger.info("Filling missing values.")
-        concat_data = concat_data.fillna("NA")
+        concat_data = fill_missing_categories(concat_data)
         self.logger.info(f"Shape of the data after filling missing values: {concat_data.shape}")
         return concat_data